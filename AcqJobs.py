@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+"""
+Job queue for res_data_acq.py acquisitions
+
+AcqJobQueue runs a list of acquisitions (cryomodule, rack, cavities,
+decimation, buffers) as QProcesses, at most maxRunning at a time and never
+two at once on the same resonance chassis. It signals as each job starts,
+prints and finishes, so the display stays live while a sweep runs.
+"""
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from os import environ, makedirs, path
+
+from PyQt5.QtCore import QObject, QProcess, pyqtSignal
+
+import FFt_math
+
+# RES_DATA_ACQ_SCRIPT can point at FakeResDataAcq.py on dev machines
+RES_SCRIPT = environ.get('RES_DATA_ACQ_SCRIPT',
+                         "/usr/local/lcls/package/lcls2_llrf/srf/software/res_ctl/res_data_acq.py")
+
+# converts a finished acquisition to binary when AcqJob.binary is set
+CONVERT_SCRIPT = path.join(path.dirname(path.abspath(__file__)), 'CavDatConvert.py')
+
+# acquisitions allowed to run at once, each rack is its own chassis
+MAX_RUNNING_JOBS = 8
+
+# rack A has cavities 1-4, rack B has cavities 5-8
+RACK_CAVITIES = {'A': '1234', 'B': '5678'}
+
+
+# acqDataDir is where the data for a CM goes:
+#  $DATA_DIR_PATH/ACCL_LxB_CM00/yyyy/mm/dd
+
+def acqDataDir(linac, cmNumStr, date):
+    return path.join(FFt_math.DATA_DIR_PATH, 'ACCL_' + linac + '_' + cmNumStr + '00',
+                     str(date.year), '%02d' % date.month, '%02d' % date.day)
+
+
+# Sergio had res_cav#_c#_yyyymmdd_hhmmss
+# Go to res_cm##_cav####_c#_yyyymmdd_hhmmss
+
+def acqFileName(cmNumStr, cavNumStr, buffers, date):
+    timestamp = date.strftime("%Y%m%d" + "_" + "%H%M%S")
+    return 'res_CM' + cmNumStr + '_cav' + cavNumStr + '_c' + str(buffers) + '_' + timestamp
+
+
+def acqCommand(linac, cmNumStr, rack, cavNumStr, decimation, buffers, dataDir, outFile):
+    # channel access spec for the chassis, ca://ACCL:L1B:0200:RESA:
+    caCmd = "ca://ACCL:" + linac + ":" + cmNumStr + "00:RES" + rack + ":"
+
+    # -u so the script's stdout comes back line by line instead of at the end
+    cmdList = ['python', '-u', RES_SCRIPT, '-D', str(dataDir), '-a', caCmd, '-wsp', str(decimation), '-acav']
+    for cav in cavNumStr:
+        cmdList += cav
+    cmdList += ['-ch', 'DF', '-c', str(buffers), '-F', outFile]
+    return cmdList
+
+
+# convertCommand converts the text file to binary and removes the text file,
+#  in the script's own process and without a manifest
+
+def convertCommand(fileName):
+    return ['python', '-u', CONVERT_SCRIPT, '--remove', '-j', '1', '--manifest', '', fileName]
+
+
+# eq=False so jobs compare and hash by identity
+@dataclass(slots=True, eq=False)
+class AcqJob:
+    cmid: str
+    rack: str
+    cavities: str
+    decimation: int = 2
+    buffers: int = 1
+    # convert the data file to binary (.npz) once it is written
+    binary: bool = False
+    # the acquisition is done and its file is being converted
+    converting: bool = False
+    # queued, running, done, failed or cancelled
+    state: str = 'queued'
+    return_code: int = None
+    # filled in when the job starts unless given
+    dataDir: str = ''
+    outFile: str = ''
+    output: str = ''
+    errors: str = ''
+    # time.monotonic() when the job started and finished, conversion included
+    startTime: float = None
+    endTime: float = None
+
+    @property
+    def linac(self):
+        return self.cmid.split(':')[1]
+
+    @property
+    def cmNumStr(self):
+        return self.cmid.split(':')[2]
+
+    @property
+    def fileName(self):
+        return path.join(self.dataDir, self.outFile)
+
+    def __str__(self):
+        return '{} RES{} cav{}'.format(self.cmid, self.rack, self.cavities)
+
+
+# cryomoduleJobs makes the two jobs that take all 8 cavities of a cryomodule
+#  at once, one per rack, with the same timestamp in their file names.
+#  Also returns the name for the file mergeCavDat puts them together in
+
+def cryomoduleJobs(cmid, decimation, buffers, binary=False, dataDir='', date=None):
+    if date is None:
+        date = datetime.now()
+    cmNumStr = cmid.split(':')[2]
+    jobs = [AcqJob(cmid, rack, cavities, decimation, buffers, binary, dataDir=dataDir,
+                   outFile=acqFileName(cmNumStr, cavities, buffers, date))
+            for rack, cavities in RACK_CAVITIES.items()]
+    mergedFile = acqFileName(cmNumStr, ''.join(RACK_CAVITIES.values()), buffers, date) + FFt_math.BINARY_SUFFIX
+    return jobs, mergedFile
+
+
+# sweepJobs makes one job per rack for every cryomodule in cmids
+
+def sweepJobs(cmids, decimation, buffers, binary=False):
+    return [AcqJob(cmid, rack, cavities, decimation, buffers, binary)
+            for cmid in cmids for rack, cavities in RACK_CAVITIES.items()]
+
+
+class AcqJobQueue(QObject):
+    jobStarted = pyqtSignal(object)
+    # job and the latest line of its stdout
+    jobOutput = pyqtSignal(object, str)
+    jobFinished = pyqtSignal(object)
+    allFinished = pyqtSignal()
+
+    def __init__(self, maxRunning=MAX_RUNNING_JOBS, parent=None):
+        super(AcqJobQueue, self).__init__(parent)
+        self.maxRunning = maxRunning
+        self.jobs = []
+        self.processes = {}
+
+    # submit adds jobs to the queue, jobs from an earlier finished batch are
+    #  kept for counts() until the next submit
+
+    def submit(self, jobs):
+        if not self.isRunning():
+            self.jobs = []
+        self.jobs += jobs
+        self.startJobs()
+        return jobs
+
+    def isRunning(self):
+        return any(job.state in ('queued', 'running') for job in self.jobs)
+
+    def counts(self):
+        states = {}
+        for job in self.jobs:
+            states[job.state] = states.get(job.state, 0) + 1
+        return states
+
+    # cancel drops the queued jobs and kills the running ones
+
+    def cancel(self):
+        for job in self.jobs:
+            if job.state == 'queued':
+                job.state = 'cancelled'
+                self.jobFinished.emit(job)
+        for job, process in list(self.processes.items()):
+            job.state = 'cancelled'
+            process.kill()
+        if len(self.processes) == 0:
+            self.finishQueue()
+
+    def startJobs(self):
+        busyRacks = {(job.cmid, job.rack) for job in self.processes}
+        for job in self.jobs:
+            if len(self.processes) >= self.maxRunning:
+                break
+            if job.state != 'queued' or (job.cmid, job.rack) in busyRacks:
+                continue
+            busyRacks.add((job.cmid, job.rack))
+            self.startJob(job)
+        if len(self.processes) == 0:
+            self.finishQueue()
+
+    def startJob(self, job):
+        now = datetime.now()
+        if job.dataDir == '':
+            job.dataDir = acqDataDir(job.linac, job.cmNumStr, now)
+        if job.outFile == '':
+            job.outFile = acqFileName(job.cmNumStr, job.cavities, job.buffers, now)
+        try:
+            makedirs(job.dataDir, exist_ok=True)
+        except OSError as e:
+            job.state = 'failed'
+            job.errors = str(e)
+            self.jobFinished.emit(job)
+            return
+
+        cmdList = acqCommand(job.linac, job.cmNumStr, job.rack, job.cavities,
+                             job.decimation, job.buffers, job.dataDir, job.outFile)
+        job.state = 'running'
+        job.startTime = time.monotonic()
+        self.jobStarted.emit(job)
+        self.runProcess(job, cmdList)
+
+    def runProcess(self, job, cmdList):
+        process = QProcess(self)
+        process.readyReadStandardOutput.connect(lambda: self.readStdout(job))
+        process.readyReadStandardError.connect(lambda: self.readStderr(job))
+        process.finished.connect(lambda return_code, exitStatus: self.processFinished(job, return_code, exitStatus))
+        process.errorOccurred.connect(lambda error: self.processError(job, error))
+        self.processes[job] = process
+        process.start(cmdList[0], cmdList[1:])
+
+    def readStdout(self, job):
+        out = bytes(self.processes[job].readAllStandardOutput()).decode(errors='replace')
+        job.output += out
+        lines = out.strip().splitlines()
+        if len(lines) > 0:
+            self.jobOutput.emit(job, lines[-1])
+
+    def readStderr(self, job):
+        job.errors += bytes(self.processes[job].readAllStandardError()).decode(errors='replace')
+
+    def processError(self, job, error):
+        # the script never started, so finished won't be emitted
+        if error == QProcess.FailedToStart:
+            job.errors += self.processes[job].errorString()
+            self.processFinished(job, -1, QProcess.CrashExit)
+
+    def processFinished(self, job, return_code, exitStatus):
+        self.processes.pop(job).deleteLater()
+        job.endTime = time.monotonic()
+        succeeded = exitStatus == QProcess.NormalExit and return_code == 0
+        if job.converting:
+            job.converting = False
+            if job.state != 'cancelled':
+                job.state = 'done'
+                if succeeded:
+                    job.outFile = path.basename(FFt_math.binaryPath(job.outFile))
+                else:
+                    # the text file is only removed once the binary checks out
+                    job.errors += 'Binary conversion failed (exit {}), the text file is kept\n'.format(return_code)
+        else:
+            job.return_code = return_code
+            if job.state != 'cancelled':
+                if succeeded and job.binary and not job.outFile.endswith(FFt_math.BINARY_SUFFIX):
+                    # the job stays running while its file is converted
+                    job.converting = True
+                    self.runProcess(job, convertCommand(job.fileName))
+                    return
+                job.state = 'done' if succeeded else 'failed'
+        self.jobFinished.emit(job)
+        self.startJobs()
+
+    def finishQueue(self):
+        if not self.isRunning():
+            self.allFinished.emit()
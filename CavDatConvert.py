@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""
+Convert text microphonics data files to the binary .npz format
+
+Walks DATA_DIR_PATH/ACCL_LxB_CM00/yyyy/mm/dd/ (or takes a list of files) and
+converts every text data file in a process pool. Each file is written next
+to the original as <name>.npz (or <name>_microphonics.npz), read back to check
+it, and removed with --remove. The display and MicBatch.py read either format.
+
+Every converted file is appended to a manifest (JSON lines, with the size,
+mtime and sha256 of the binary file) as soon as it is done, so an interrupted
+run started again with the same manifest skips what's already converted and
+still has the size and mtime of its record. --verify also checks the sha256
+of those, in the pool, and converts again any that changed. --manifest ''
+keeps no manifest. --io-jobs caps
+how many workers read or write at once, so a long run doesn't swamp the NFS
+server, and the workers run at low priority. -j 1 converts in this process.
+
+    python CavDatConvert.py --start 2019-01-01 --end 2021-12-31 -j 16 --io-jobs 2 --remove
+"""
+import argparse
+import hashlib
+import json
+import sys
+import time
+from contextlib import nullcontext
+from datetime import datetime
+from functools import partial
+from multiprocessing import BoundedSemaphore, Pool, cpu_count
+from os import nice, path, remove, stat
+
+import numpy as np
+
+import FFt_math
+
+MANIFEST = 'cavdat_manifest.jsonl'
+
+# niceness of the worker processes
+WORKER_NICE = 10
+
+# set in each worker by initWorker, no lock outside a pool
+_ioLock = nullcontext()
+
+
+def initWorker(ioLock, niceness):
+    global _ioLock
+    _ioLock = ioLock
+    nice(niceness)
+
+
+def sha256File(fileName, blockSize=1 << 20):
+    digest = hashlib.sha256()
+    with open(fileName, 'rb') as f:
+        for block in iter(partial(f.read, blockSize), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# convertFile runs in the pool workers, it returns the manifest record of one file
+
+def convertFile(fileName, compress=False, dtype=FFt_math.BINARY_DTYPE, removeText=False):
+    record = {'file': fileName, 'status': 'failed'}
+    start = time.perf_counter()
+    try:
+        fileStat = stat(fileName)
+        record.update(size=fileStat.st_size, mtime_ns=fileStat.st_mtime_ns)
+        outName = FFt_math.convertCavDat(fileName, compress=compress, dtype=dtype, ioLock=_ioLock)
+        with _ioLock:
+            outStat = stat(outName)
+            record.update(output=outName, output_size=outStat.st_size, output_mtime_ns=outStat.st_mtime_ns,
+                          sha256=sha256File(outName))
+            if removeText:
+                remove(fileName)
+        record['status'] = 'ok'
+    except (OSError, ValueError) as e:
+        record['error'] = str(e)
+    record['seconds'] = round(time.perf_counter() - start, 3)
+    record['converted'] = datetime.now().isoformat(timespec='seconds')
+    return record
+
+
+# readManifest returns the last record of every file in the manifest
+
+def readManifest(manifest):
+    records = {}
+    if path.exists(manifest):
+        with open(manifest) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # a line cut short by a killed run
+                    continue
+                records[record['file']] = record
+    return records
+
+
+# isConverted is True if the manifest has the file as converted, the binary
+#  file still has the size and mtime it was written with, and the text file
+#  hasn't changed since. With removeText a text file that is still there is
+#  converted again so it gets removed
+
+def isConverted(fileName, record, removeText=False):
+    if record is None or record['status'] != 'ok':
+        return False
+    try:
+        # a binary cut short by a killed run or a full disk is converted again
+        outStat = stat(record['output'])
+    except OSError:
+        return False
+    if outStat.st_size != record['output_size'] or outStat.st_mtime_ns != record['output_mtime_ns']:
+        return False
+    if not path.exists(fileName):
+        return True
+    if removeText:
+        return False
+    fileStat = stat(fileName)
+    return fileStat.st_size == record['size'] and fileStat.st_mtime_ns == record['mtime_ns']
+
+
+# verifyFile runs in the pool workers for --verify, it returns the file and
+#  whether its binary still has the sha256 of its record
+
+def verifyFile(record):
+    try:
+        with _ioLock:
+            return record['file'], sha256File(record['output']) == record['sha256']
+    except OSError:
+        return record['file'], False
+
+
+def parseDate(text):
+    return datetime.strptime(text, '%Y-%m-%d').date()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Convert text microphonics data files to binary')
+    parser.add_argument('files', nargs='*', help='data files to convert instead of walking --root')
+    parser.add_argument('--root', default=FFt_math.DATA_DIR_PATH, help='top of the data tree')
+    parser.add_argument('--start', type=parseDate, help='first day to include, yyyy-mm-dd')
+    parser.add_argument('--end', type=parseDate, help='last day to include, yyyy-mm-dd')
+    parser.add_argument('--compress', action='store_true', help='deflate the arrays, smaller but slower to read')
+    parser.add_argument('--float64', action='store_true', help='store float64 instead of float32')
+    parser.add_argument('--remove', action='store_true', help='remove each text file once its binary checks out')
+    parser.add_argument('--manifest', default=MANIFEST, help="progress record, also used to resume, '' for none")
+    parser.add_argument('--verify', action='store_true', help='check the sha256 of files already converted')
+    parser.add_argument('-j', '--processes', type=int, default=cpu_count(), help='worker processes')
+    parser.add_argument('--io-jobs', type=int, default=2, help='workers allowed to read or write at once')
+    parser.add_argument('--nice', type=int, default=WORKER_NICE, help='niceness added to the workers')
+    args = parser.parse_args(argv)
+
+    if len(args.files) > 0:
+        fileNames = args.files
+    else:
+        # text files that already have a binary are listed too, the
+        #  manifest decides whether they're done
+        fileNames = list(FFt_math.findCavDatFiles(args.root, args.start, args.end, preferBinary=False))
+    fileNames = [fileName for fileName in fileNames if not fileName.endswith(FFt_math.BINARY_SUFFIX)]
+
+    done = readManifest(args.manifest) if args.manifest else {}
+    todo = []
+    converted = []
+    for fileName in fileNames:
+        if isConverted(fileName, done.get(fileName), args.remove):
+            converted.append(done[fileName])
+        else:
+            todo.append(fileName)
+
+    dtype = np.float64 if args.float64 else FFt_math.BINARY_DTYPE
+    worker = partial(convertFile, compress=args.compress, dtype=dtype, removeText=args.remove)
+    textBytes = binaryBytes = errors = 0
+    # one process, e.g. the display converting the file it just took, doesn't need a pool
+    pool = None
+    if args.processes > 1 and len(todo) + (len(converted) if args.verify else 0) > 1:
+        pool = Pool(args.processes, initWorker, (BoundedSemaphore(args.io_jobs), args.nice))
+    manifest = None
+    try:
+        if args.verify:
+            checks = pool.imap_unordered(verifyFile, converted) if pool is not None else map(verifyFile, converted)
+            changed = [fileName for fileName, same in checks if not same]
+            print('{} converted files verified, {} changed'.format(len(converted), len(changed)))
+            todo += changed
+        print('{} files, {} already converted, {} to convert with {} processes ({} doing I/O)'.format(
+            len(fileNames), len(fileNames) - len(todo), len(todo), args.processes, args.io_jobs))
+        if len(todo) == 0:
+            return 0
+
+        start = time.perf_counter()
+        manifest = open(args.manifest, 'a') if args.manifest else None
+        for count, record in enumerate(pool.imap_unordered(worker, todo) if pool is not None else
+                                       map(worker, todo), 1):
+            if manifest is not None:
+                manifest.write(json.dumps(record) + '\n')
+                manifest.flush()
+            if record['status'] == 'ok':
+                textBytes += record['size']
+                binaryBytes += record['output_size']
+            else:
+                errors += 1
+                print('\n{}: {}'.format(record['file'], record['error']), file=sys.stderr)
+            elapsed = time.perf_counter() - start
+            print('\r{}/{} files, {:.0f} MB at {:.1f} MB/s'.format(
+                count, len(todo), textBytes / 1e6, textBytes / 1e6 / elapsed), end='', flush=True)
+    finally:
+        if pool is not None:
+            pool.terminate()
+        if manifest is not None:
+            manifest.close()
+    print()
+
+    if textBytes > 0:
+        print('{:.1f} MB of text in {:.1f} MB of binary ({:.0f}%)'.format(
+            textBytes / 1e6, binaryBytes / 1e6, 100 * binaryBytes / textBytes))
+    print('{} converted, {} failed{}'.format(len(todo) - errors, errors,
+                                             ', manifest in ' + args.manifest if args.manifest else ''))
+    return 0 if errors == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -14,40 +14,384 @@ J Nelson 30 June 2022
 add print to elog button
 
 """
-import subprocess
 import sys
-from datetime import datetime
+from datetime import datetime, timedelta
 from functools import partial
-from os import makedirs, path, system
+from os import cpu_count, environ, path, system
 
-import numpy as np
-import physicselog
 from PyQt5 import QtWidgets
 from PyQt5.QtWidgets import (QFileDialog, QWidget)
-from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg
-from matplotlib.figure import Figure
+import numpy as np
+import pyqtgraph as pg
+from PyQt5.QtCore import QDate, QProcess, QRectF, Qt, QTimer
+from PyQt5.QtGui import QFontDatabase, QKeySequence
 from pydm import Display
-from scipy.fftpack import fft, fftfreq
 
 # FFt_math has utility functions
 import FFt_math
+# AcqJobs runs res_data_acq.py
+import AcqJobs
+# physicselog, MicIndex and MicModes are imported where they're used, the
+#  elog, Find Data, Modes and Linac Survey buttons are rarely pressed and
+#  every import is slow from NFS
 
-BUFFER_LENGTH = 16384
-DEFAULT_SAMPLING_RATE = 2000
-
-LASTPATH = ''
-DATA_DIR_PATH = "/u1/lcls/physics/rf_lcls2/microphonics/"
+# MicTiming logs how long each step of a plot or acquisition takes
+import MicTiming
 
+BUFFER_LENGTH = FFt_math.BUFFER_LENGTH
+DEFAULT_SAMPLING_RATE = FFt_math.DEFAULT_SAMPLING_RATE
 
-class MplCanvas(FigureCanvasQTAgg):
-    """ MPLCanvas is the class for the 'canvas' that plots are drawn on and then mapped to the ui
-        They are Figure format described in matplotlib 2.2 documentation """
-
-    def __init__(self, parent=None, width=5, height=4, dpi=100):
-        fig = Figure(figsize=(width, height), dpi=dpi, tight_layout="true")
-        # one axis per layout
-        self.axes = fig.add_subplot(111)
-        super(MplCanvas, self).__init__(fig)
+LASTPATH = ''
+# ms between reads of the file being written during a live acquisition
+LIVE_INTERVAL = 1000
+# MB of loaded files, spectra and histograms kept for the session
+CACHE_MB = int(environ.get('MIC_CACHE_MB', FFt_math.CACHE_MAX_BYTES // 1024 ** 2))
+DATA_DIR_PATH = FFt_math.DATA_DIR_PATH
+# show the step timings under the messages, Ctrl+Shift+T toggles it
+SHOW_TIMINGS = environ.get('MIC_SHOW_TIMINGS', '0') == '1'
+
+# matplotlib's default colors, so the plots look like they used to
+PLOT_COLORS = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd', '#8c564b', '#e377c2', '#7f7f7f']
+
+
+class PgCanvas(pg.GraphicsLayoutWidget):
+    """ PgCanvas is the class for the pyqtgraph 'canvas' that plots are drawn on and then mapped to the ui
+        With downsample on, long curves are drawn min/max (peak) downsampled to the screen
+        resolution and clipped to the visible range, so zooming stays interactive """
+
+    def __init__(self, parent=None, downsample=False):
+        super(PgCanvas, self).__init__(parent)
+        self.setBackground('w')
+        self.downsample = downsample
+        self.resetPlots()
+
+    def resetPlots(self, numPlots=1):
+        # clear the canvas and lay out numPlots plots side by side,
+        #  self.plot is the first one
+        self.clear()
+        self.plots = [self.addPlot(row=0, col=idx) for idx in range(numPlots)]
+        for plot in self.plots:
+            plot.showGrid(x=True, y=True)
+            if self.downsample:
+                plot.setDownsampling(auto=True, mode='peak')
+                plot.setClipToView(True)
+        self.plot = self.plots[0]
+        self.legend = self.plot.addLegend(offset=(-10, 10))
+        self.curves = []
+        self.isImage = False
+        return self.plots
+
+    def setCurves(self, curves, names, pens=None, **kwargs):
+        # draw (x, y) curves on the single plot, updating the existing curves
+        #  with setData instead of rebuilding them. pens defaults to one
+        #  color per curve
+        if len(self.plots) != 1 or self.isImage:
+            self.resetPlots()
+        while len(self.curves) > len(curves):
+            self.plot.removeItem(self.curves.pop())
+        self.legend.clear()
+        if pens is None:
+            pens = [pg.mkPen(PLOT_COLORS[idx % len(PLOT_COLORS)], width=1) for idx in range(len(curves))]
+        for idx, ((x, y), name, pen) in enumerate(zip(curves, names, pens)):
+            if idx < len(self.curves):
+                self.curves[idx].setData(x, y, pen=pen, **kwargs)
+            else:
+                self.curves.append(self.plot.plot(x, y, pen=pen, **kwargs))
+            self.legend.addItem(self.curves[idx], name)
+
+
+# indexUpdate runs 'MicIndex.py update' on the data of startDate to endDate
+#  in a QProcess, so the display stays live through the walk of the data
+#  tree. Its progress goes to QLabel status and finished(exitCode,
+#  exitStatus) is called at the end. options are added to the update command
+
+def indexUpdate(parent, status, startDate, endDate, finished, *options):
+    import MicIndex
+    process = QProcess(parent)
+    process.setProcessChannelMode(QProcess.MergedChannels)
+
+    def showOutput():
+        # the file count is rewritten in place with \r
+        text = bytes(process.readAllStandardOutput()).decode(errors='replace')
+        lines = [line.strip() for line in text.replace('\r', '\n').splitlines() if line.strip()]
+        if len(lines) > 0:
+            status.setText(lines[-1])
+
+    process.readyReadStandardOutput.connect(showOutput)
+    process.finished.connect(finished)
+    process.start('python', ['-u', MicIndex.__file__, '--index', MicIndex.INDEX_PATH, 'update',
+                             '--root', DATA_DIR_PATH, '--start', startDate.isoformat(),
+                             '--end', endDate.isoformat()] + list(options))
+    return process
+
+
+class FindDataDialog(QtWidgets.QDialog):
+    """ FindDataDialog searches the MicIndex index of old data files by cryomodule, cavity,
+        decimation and date. Double clicking a file calls openFile with its path, the
+        overlay buttons call overlayFiles(paths, cavity, add) with the selected files """
+
+    COLUMNS = ['timestamp', 'cmid', 'cavities', 'decimation', 'buffers', 'path']
+
+    def __init__(self, cmids, decimations, openFile, overlayFiles, parent=None):
+        super(FindDataDialog, self).__init__(parent)
+        self.setWindowTitle('Find Microphonics Data')
+        self.resize(900, 500)
+        self.openFile = openFile
+        self.overlayFiles = overlayFiles
+
+        self.cmBox = QtWidgets.QComboBox()
+        self.cmBox.addItems(['Any CM'] + list(cmids))
+        self.cavBox = QtWidgets.QComboBox()
+        self.cavBox.addItems(['Any cavity'] + ['Cavity {}'.format(cav) for cav in range(1, 9)])
+        self.decBox = QtWidgets.QComboBox()
+        self.decBox.addItems(['Any decimation'] + list(decimations))
+        self.startEdit = QtWidgets.QDateEdit(QDate.currentDate().addMonths(-1))
+        self.endEdit = QtWidgets.QDateEdit(QDate.currentDate())
+        for dateEdit in (self.startEdit, self.endEdit):
+            dateEdit.setCalendarPopup(True)
+            dateEdit.setDisplayFormat('yyyy-MM-dd')
+        searchBut = QtWidgets.QPushButton('Search')
+        searchBut.clicked.connect(self.search)
+        self.updateBut = QtWidgets.QPushButton('Update Index')
+        self.updateBut.setToolTip('Scan the data directories of the chosen dates for new files')
+        self.updateBut.clicked.connect(self.updateIndex)
+        self.process = None
+
+        self.table = QtWidgets.QTableWidget(0, len(self.COLUMNS))
+        self.table.setHorizontalHeaderLabels(['Time', 'CM', 'Cavities', 'Decimation', 'Buffers', 'File'])
+        self.table.horizontalHeader().setStretchLastSection(True)
+        self.table.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        self.table.setSelectionBehavior(QtWidgets.QAbstractItemView.SelectRows)
+        self.table.setSelectionMode(QtWidgets.QAbstractItemView.ExtendedSelection)
+        self.table.cellDoubleClicked.connect(lambda row, col: self.openFile(self.table.item(row, 5).text()))
+        self.status = QtWidgets.QLabel()
+        overlayBut = QtWidgets.QPushButton('Overlay Selected')
+        overlayBut.setToolTip('Plot the selected files on top of each other, only the chosen cavity if there is one')
+        overlayBut.clicked.connect(partial(self.overlaySelected, False))
+        addBut = QtWidgets.QPushButton('Add to Overlay')
+        addBut.clicked.connect(partial(self.overlaySelected, True))
+
+        controls = QtWidgets.QHBoxLayout()
+        for widget in (self.cmBox, self.cavBox, self.decBox, self.startEdit, QtWidgets.QLabel('to'),
+                       self.endEdit, searchBut, self.updateBut):
+            controls.addWidget(widget)
+        layout = QtWidgets.QVBoxLayout(self)
+        layout.addLayout(controls)
+        layout.addWidget(self.table)
+        bottom = QtWidgets.QHBoxLayout()
+        bottom.addWidget(self.status, 1)
+        bottom.addWidget(overlayBut)
+        bottom.addWidget(addBut)
+        layout.addLayout(bottom)
+
+    def query(self):
+        return dict(cmid=self.cmBox.currentText() if self.cmBox.currentIndex() > 0 else None,
+                    cavity=self.cavBox.currentIndex() if self.cavBox.currentIndex() > 0 else None,
+                    decimation=int(self.decBox.currentText()) if self.decBox.currentIndex() > 0 else None,
+                    startDate=self.startEdit.date().toPyDate(), endDate=self.endEdit.date().toPyDate())
+
+    def overlaySelected(self, add):
+        rows = sorted({index.row() for index in self.table.selectedIndexes()})
+        if len(rows) > 0:
+            self.overlayFiles([self.table.item(row, 5).text() for row in rows], self.query()['cavity'], add)
+
+    def search(self):
+        import MicIndex
+        query = self.query()
+        db = MicIndex.openIndex()
+        try:
+            rows = MicIndex.find(db, **query)
+        finally:
+            db.close()
+        self.table.setRowCount(len(rows))
+        for idx, row in enumerate(rows):
+            for col, key in enumerate(self.COLUMNS):
+                self.table.setItem(idx, col, QtWidgets.QTableWidgetItem(str(row[key])))
+        self.table.resizeColumnsToContents()
+        self.status.setText('{} files'.format(len(rows)))
+
+    def updateIndex(self):
+        query = self.query()
+        self.updateBut.setEnabled(False)
+        self.status.setText('Scanning {} to {}...'.format(query['startDate'], query['endDate']))
+        # headers only, the per-cavity stats are left to 'MicIndex.py update'
+        self.process = indexUpdate(self, self.status, query['startDate'], query['endDate'], self.updateFinished,
+                                   '--no-stats')
+
+    def updateFinished(self, exitCode, exitStatus):
+        self.updateBut.setEnabled(True)
+        self.process = None
+        message = self.status.text()
+        if exitStatus != QProcess.NormalExit or exitCode != 0:
+            message = 'Index update failed (exit {}): {}'.format(exitCode, message)
+        self.search()
+        self.status.setText('{} {}'.format(message, self.status.text()))
+
+
+class ModesDialog(QtWidgets.QDialog):
+    """ ModesDialog tabulates the MicModes.analyzeModes results of the plotted file,
+        one row per mode and cavity. Double clicking a row calls showFreq with
+        the mode's frequency """
+
+    COLUMNS = ['cavity', 'mode', 'freq', 'amp', 'width', 'q', 'drift', 'freq_min', 'freq_max']
+    FORMATS = {'freq': '{:.3f}', 'amp': '{:.4g}', 'width': '{:.3f}', 'q': '{:.0f}', 'drift': '{:.3f}',
+               'freq_min': '{:.3f}', 'freq_max': '{:.3f}'}
+
+    def __init__(self, showFreq, parent=None):
+        super(ModesDialog, self).__init__(parent)
+        self.setWindowTitle('Cavity Modes')
+        self.resize(800, 400)
+        self.title = QtWidgets.QLabel()
+        self.table = QtWidgets.QTableWidget(0, len(self.COLUMNS))
+        self.table.setHorizontalHeaderLabels(['Cavity', 'Mode', 'Freq (Hz)', 'Amplitude', 'Width (Hz)', 'Q',
+                                              'Drift (Hz)', 'Min (Hz)', 'Max (Hz)'])
+        self.table.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        self.table.setSelectionBehavior(QtWidgets.QAbstractItemView.SelectRows)
+        # in cavity order until a column header is clicked
+        self.table.horizontalHeader().setSortIndicator(-1, Qt.AscendingOrder)
+        self.table.cellDoubleClicked.connect(lambda row, col: showFreq(float(self.table.item(row, 2).text())))
+        self.table.setToolTip('Q is a lower bound for lines as narrow as the frequency resolution. Drift, Min '
+                              'and Max are from following the mode buffer by buffer')
+        layout = QtWidgets.QVBoxLayout(self)
+        layout.addWidget(self.title)
+        layout.addWidget(self.table)
+
+    def setModes(self, title, leGend, cavModes):
+        self.title.setText(title)
+        rows = [(label, mode) for label, modes in zip(leGend, cavModes) for mode in modes]
+        self.table.setSortingEnabled(False)
+        self.table.setRowCount(len(rows))
+        for idx, (label, mode) in enumerate(rows):
+            for col, key in enumerate(self.COLUMNS):
+                value = label if key == 'cavity' else mode[key]
+                item = QtWidgets.QTableWidgetItem()
+                if key in self.FORMATS:
+                    # sorted by value, shown formatted
+                    item.setData(Qt.EditRole, float(self.FORMATS[key].format(value)))
+                else:
+                    item.setData(Qt.EditRole, value)
+                self.table.setItem(idx, col, item)
+        self.table.setSortingEnabled(True)
+        self.table.resizeColumnsToContents()
+
+
+class SurveyDialog(QtWidgets.QDialog):
+    """ SurveyDialog shows a statistic of the latest file of every cryomodule and cavity on
+        a day as a heatmap, one row per CM. New files are indexed first by 'MicIndex.py
+        update' in a QProcess with a worker per core, the statistics of files already in the
+        index aren't read again. Double clicking a cell calls openFile with its file """
+
+    def __init__(self, cmids, openFile, parent=None):
+        super(SurveyDialog, self).__init__(parent)
+        self.setWindowTitle('Linac Survey')
+        self.resize(900, 800)
+        self.cmids = list(cmids)
+        self.openFile = openFile
+        self.rows = []
+        self.process = None
+
+        self.dateEdit = QtWidgets.QDateEdit(QDate.currentDate())
+        self.dateEdit.setCalendarPopup(True)
+        self.dateEdit.setDisplayFormat('yyyy-MM-dd')
+        self.daysBox = QtWidgets.QSpinBox()
+        self.daysBox.setRange(1, 365)
+        self.daysBox.setSuffix(' day(s)')
+        self.daysBox.setToolTip('Also take files from this many days back, 1 is the day only')
+        self.fieldBox = QtWidgets.QComboBox()
+        # the labels are MicIndex.SURVEY_FIELDS, kept here so the index isn't imported until it's used
+        for field, label in (('rms', 'RMS detune (Hz)'), ('peak', 'Peak detune (Hz)'),
+                             ('mode_freq', 'Dominant mode (Hz)')):
+            self.fieldBox.addItem(label, field)
+        self.fieldBox.currentIndexChanged.connect(self.showGrid)
+        self.updateCheck = QtWidgets.QCheckBox('Index new files')
+        self.updateCheck.setChecked(True)
+        self.updateCheck.setToolTip('Read the files added since the last survey or index update first')
+        self.surveyBut = QtWidgets.QPushButton('Survey')
+        self.surveyBut.clicked.connect(self.survey)
+
+        self.table = QtWidgets.QTableWidget(len(self.cmids), 8)
+        self.table.setHorizontalHeaderLabels(['Cav {}'.format(cav) for cav in range(1, 9)])
+        self.table.setVerticalHeaderLabels(self.cmids)
+        self.table.horizontalHeader().setSectionResizeMode(QtWidgets.QHeaderView.Stretch)
+        self.table.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        self.table.cellDoubleClicked.connect(self.openCell)
+        self.status = QtWidgets.QLabel()
+
+        controls = QtWidgets.QHBoxLayout()
+        for widget in (self.dateEdit, self.daysBox, self.fieldBox, self.updateCheck, self.surveyBut):
+            controls.addWidget(widget)
+        layout = QtWidgets.QVBoxLayout(self)
+        layout.addLayout(controls)
+        layout.addWidget(self.table)
+        layout.addWidget(self.status)
+
+    def dates(self):
+        endDate = self.dateEdit.date().toPyDate()
+        return endDate - timedelta(days=self.daysBox.value() - 1), endDate
+
+    # survey starts the index update, or goes straight to the grid without it
+
+    def survey(self):
+        if not self.updateCheck.isChecked():
+            self.showSurvey()
+            return
+        startDate, endDate = self.dates()
+        self.surveyBut.setEnabled(False)
+        self.status.setText('Indexing new files from {} to {}...'.format(startDate, endDate))
+        self.process = indexUpdate(self, self.status, startDate, endDate, self.updateFinished,
+                                   '-j', str(cpu_count() or 1))
+
+    def updateFinished(self, exitCode, exitStatus):
+        self.surveyBut.setEnabled(True)
+        self.process = None
+        if exitStatus != QProcess.NormalExit or exitCode != 0:
+            self.status.setText('Index update failed (exit {}), showing what is indexed. {}'.format(
+                exitCode, self.status.text()))
+        self.showSurvey()
+
+    def showSurvey(self):
+        import MicIndex
+        startDate, endDate = self.dates()
+        db = MicIndex.openIndex()
+        try:
+            self.rows = MicIndex.survey(db, endDate, self.daysBox.value())
+        finally:
+            db.close()
+        self.showGrid()
+
+    # showGrid colors each cell by the chosen statistic, on one scale for the
+    #  whole linac
+
+    def showGrid(self):
+        import MicIndex
+        field = self.fieldBox.currentData()
+        grid = MicIndex.surveyGrid(self.rows, field, self.cmids)
+        files = {(row['cmid'], row['cavity']): row for row in self.rows}
+        valid = grid[~np.isnan(grid)]
+        low, high = (valid.min(), valid.max()) if valid.size > 0 else (0.0, 1.0)
+        scaled = (np.nan_to_num(grid, nan=low) - low) / ((high - low) or 1.0)
+        colors = pg.colormap.get('viridis').map(scaled.ravel(), mode='qcolor')
+        for idx, cmid in enumerate(self.cmids):
+            for col in range(8):
+                item = QtWidgets.QTableWidgetItem()
+                row = files.get((cmid, col + 1))
+                if row is not None and not np.isnan(grid[idx, col]):
+                    color = colors[idx * 8 + col]
+                    item.setText('{:.2f}'.format(grid[idx, col]))
+                    item.setBackground(color)
+                    # dark text on the light end of the map
+                    item.setForeground(Qt.black if color.lightness() > 128 else Qt.white)
+                    item.setData(Qt.UserRole, row['path'])
+                    item.setToolTip('{}\n{}'.format(row['timestamp'], row['path']))
+                item.setTextAlignment(Qt.AlignCenter)
+                self.table.setItem(idx, col, item)
+        self.status.setText('{} on {}: {} cavities, {:.2f} to {:.2f}'.format(
+            self.fieldBox.currentText(), self.dateEdit.date().toString('yyyy-MM-dd'), valid.size, low, high))
+
+    def openCell(self, row, col):
+        item = self.table.item(row, col)
+        if item is not None and item.data(Qt.UserRole):
+            self.openFile(item.data(Qt.UserRole))
 
 
 class MicDisp(Display):
@@ -56,29 +400,70 @@ class MicDisp(Display):
         super(MicDisp, self).__init__(parent=parent, args=args, ui_filename=ui_filename)
         self.pathHere = path.dirname(sys.modules[self.__module__].__file__)
 
-        def getPath(fileName):
-            return path.join(self.pathHere, fileName)
-
         # save the date
         self.startd = datetime.now()
 
-        # link up to the secondary display
-        self.xfDisp = Display(ui_filename=getPath("MicPlot.ui"))
-
-        # create plot canvases and link to GUI elements
-        topPlot = MplCanvas(self, width=20, height=40, dpi=100)
-        botPlot = MplCanvas(self, width=20, height=40, dpi=100)
-        self.xfDisp.ui.PlotTop.addWidget(topPlot)
-        self.xfDisp.ui.PlotBot.addWidget(botPlot)
+        # the secondary display with the plot canvases is built by canvases()
+        #  the first time something is plotted
+        self.xfDisp = None
+
+        # acquisitions run through the job queue, acqFinished plots the data
+        self.plotJob = None
+        # the two jobs of an entire CM acquisition
+        self.cmJobs = []
+        self.acqQueue = AcqJobs.AcqJobQueue(parent=self)
+        self.acqQueue.jobStarted.connect(lambda job: self.liveStart(*self.canvases(), job))
+        self.acqQueue.jobOutput.connect(self.acqOutput)
+        self.acqQueue.jobFinished.connect(lambda job: self.acqFinished(*self.canvases(), job))
+        self.acqQueue.allFinished.connect(self.acqDone)
+
+        # while a plotted acquisition runs, liveUpdate follows its file
+        self.liveTail = None
+        self.liveTimer = QTimer(self)
+        self.liveTimer.setInterval(LIVE_INTERVAL)
+        self.liveTimer.timeout.connect(lambda: self.liveUpdate(*self.canvases()))
 
         # call function setGOVal when strtBut is pressed
-        self.ui.StrtBut.clicked.connect(partial(self.setGOVal, topPlot, botPlot))
+        self.ui.StrtBut.clicked.connect(self.setGOVal)
 
-        # call function getOldData when OldDatBut is pressed
-        self.ui.OldDatBut.clicked.connect(partial(self.getOldData, topPlot, botPlot))
+        # call function sweepAll when SweepBut is pressed
+        self.ui.SweepBut.clicked.connect(self.sweepAll)
+
+        # call function cancelAcq when CancelBut is pressed
+        self.ui.CancelBut.clicked.connect(self.cancelAcq)
+        self.ui.CancelBut.setEnabled(False)
 
-        # call function plotWindow when printPushButton is pressed
-        self.xfDisp.ui.printPushButton.clicked.connect(self.plotWindow)
+        # call function getOldData when OldDatBut is pressed
+        self.ui.OldDatBut.clicked.connect(lambda: self.getOldData(*self.canvases()))
+
+        # call function findData when FindBut is pressed
+        self.findDialog = None
+        self.overlayList = []
+
+        # loaded files and the spectra, histograms and waterfalls made from
+        #  them stay in dataCache (up to CACHE_MB) so going back to a recent
+        #  file doesn't read it again. Ctrl+Shift+D shows the cache statistics
+        self.dataCache = FFt_math.CavDatCache(CACHE_MB * 1024 ** 2)
+        self.cacheDialog = None
+        QtWidgets.QShortcut(QKeySequence('Ctrl+Shift+D'), self, self.showCacheStats)
+
+        # every plot and acquisition is timed into MicTiming's log,
+        #  Ctrl+Shift+T shows the timings in label_message and Ctrl+Shift+P
+        #  profiles the next plot
+        self.showTimings = SHOW_TIMINGS
+        QtWidgets.QShortcut(QKeySequence('Ctrl+Shift+T'), self, self.toggleTimings)
+        QtWidgets.QShortcut(QKeySequence('Ctrl+Shift+P'), self, self.profileNext)
+        self.ui.FindBut.clicked.connect(lambda: self.findData(*self.canvases()))
+
+        # call function showModes when ModesBut is pressed, the table follows
+        #  the plotted file while it's open
+        self.modesDialog = None
+        self.plotted = None
+        self.ui.ModesBut.clicked.connect(self.showModes)
+
+        # call function showSurvey when SurveyBut is pressed
+        self.surveyDialog = None
+        self.ui.SurveyBut.clicked.connect(self.showSurvey)
 
         # get CM IDs from FFt_math
         self.CM_IDs = FFt_math.CM_IDs()
@@ -88,6 +473,7 @@ class MicDisp(Display):
             self.ui.CMComboBox.addItem(cmid)
         self.ui.CavComboBox.addItem('Cavities 1-4')
         self.ui.CavComboBox.addItem('Cavities 5-8')
+        self.ui.CavComboBox.addItem('Entire CM (1-8)')
 
         # start out with cavities 1-4 selected
         self.checkboxes = [self.ui.cb1, self.ui.cb2, self.ui.cb3, self.ui.cb4]
@@ -103,6 +489,24 @@ class MicDisp(Display):
         self.ui.spinBox_buffers.valueChanged.connect(self.update_daq_setting)
         self.update_daq_setting()
 
+    # canvases returns the top and bottom plot canvases, loading MicPlot.ui
+    #  and making them the first time
+
+    def canvases(self):
+        if self.xfDisp is None:
+            # link up to the secondary display
+            self.xfDisp = Display(ui_filename=path.join(self.pathHere, "MicPlot.ui"))
+
+            # create plot canvases and link to GUI elements
+            self.topPlot = PgCanvas(self)
+            self.botPlot = PgCanvas(self, downsample=True)
+            self.xfDisp.ui.PlotTop.addWidget(self.topPlot)
+            self.xfDisp.ui.PlotBot.addWidget(self.botPlot)
+
+            # call function plotWindow when printPushButton is pressed
+            self.xfDisp.ui.printPushButton.clicked.connect(self.plotWindow)
+        return self.topPlot, self.botPlot
+
     def update_daq_setting(self):
 
         number_of_buffers = int(self.ui.spinBox_buffers.value())
@@ -114,23 +518,121 @@ class MicDisp(Display):
 
     def ChangeCav(self):
         #   This function responds to a user changing the cavity combo box
-        #    from cavs 1-4 to cavs 5-8
+        #    from cavs 1-4 to cavs 5-8, or to the entire CM which takes
+        #    all 8 so the checkboxes are fixed
         cavs = self.ui.CavComboBox.currentIndex()
         if cavs == 0:
             delta = 1
         else:
             delta = 5
         for idx, cb in enumerate(self.checkboxes):
-            cb.setText(str(idx + delta))
-
-    # This function takes given data (cavUno) and axis handle (tPlot) and calculates FFT and plots
-    def FFTPlot(self, bPlot, cavUno):
-
-        num_points = len(cavUno)
-        sample_spacing = 1.0 / (DEFAULT_SAMPLING_RATE / int(self.ui.comboBox_decimation.currentText()))
-        yf1 = fft(cavUno)
-        xf = fftfreq(num_points, sample_spacing)[:num_points // 2]
-        bPlot.axes.plot(xf, 2.0 / num_points * np.abs(yf1[0:num_points // 2]))
+            if cavs == 2:
+                cb.setText('{}+{}'.format(idx + 1, idx + 5))
+                cb.setChecked(True)
+            else:
+                cb.setText(str(idx + delta))
+            cb.setEnabled(cavs != 2)
+
+    # This function takes given data (cavDataList) and canvas (bPlot) and calculates FFTs and plots
+    #  all cavities are transformed together in one call.
+    #  samplingRate comes from the file header, the decimation widget is only
+    #  used for files without one.
+    #  SpectrumComboBox picks one FFT of the whole record or a Welch average
+    #  of BUFFER_LENGTH segments
+    #  With fname the spectra are kept in dataCache
+    def FFTPlot(self, bPlot, cavDataList, leGend, samplingRate=None, fname=None):
+
+        if samplingRate is None:
+            samplingRate = DEFAULT_SAMPLING_RATE / int(self.ui.comboBox_decimation.currentText())
+        welchSegment = BUFFER_LENGTH if self.ui.SpectrumComboBox.currentIndex() == 1 else 0
+        with MicTiming.stage('fft', sum(cavData.nbytes for cavData in cavDataList)):
+            spectra = self.cached(fname, ('spectra', len(cavDataList), samplingRate, welchSegment),
+                                  lambda: FFt_math.cavListSpectra(cavDataList, samplingRate, welchSegment))
+        with MicTiming.stage('draw'):
+            bPlot.setCurves(spectra, leGend)
+
+    # This function takes given data (cavDataList) and canvas (tPlot) and plots detune histograms
+    #  the counts are binned in FFt_math with the same 140 bins for every
+    #  cavity, so only the step outlines are drawn here
+    def HistPlot(self, tPlot, cavDataList, leGend, fname=None):
+
+        with MicTiming.stage('histogram', sum(cavData.nbytes for cavData in cavDataList)):
+            hist = self.cached(fname, ('histogram', len(cavDataList), 140),
+                               lambda: FFt_math.cavHistograms(cavDataList, bins=140))
+        with MicTiming.stage('draw'):
+            # empty bins can't go on a log scale, they are drawn down at 0.1
+            counts = np.maximum(hist.counts, 0.1)
+            tPlot.setCurves([(hist.edges, counts[:, col]) for col in range(counts.shape[1])], leGend,
+                            stepMode='center')
+            tPlot.plot.setLogMode(y=True)
+
+    # This function takes given data (cavDataList) and the top canvas (tPlot) and draws a waterfall
+    #  (one spectrum per buffer, time going up) for each cavity side by side.
+    #  FFt_math averages neighbouring buffers so there are at most a few hundred rows
+    def WaterfallPlot(self, tPlot, cavDataList, leGend, samplingRate=None, fname=None):
+
+        if samplingRate is None:
+            samplingRate = DEFAULT_SAMPLING_RATE / int(self.ui.comboBox_decimation.currentText())
+        with MicTiming.stage('waterfall', sum(cavData.nbytes for cavData in cavDataList)):
+            spectrograms = self.cached(fname, ('waterfall', len(cavDataList), samplingRate),
+                                       lambda: FFt_math.cavListSpectrogram(cavDataList, samplingRate))
+        with MicTiming.stage('draw'):
+            self.drawWaterfall(tPlot, spectrograms, leGend, len(cavDataList[0]) / samplingRate)
+
+    def drawWaterfall(self, tPlot, spectrograms, leGend, duration):
+        plots = tPlot.resetPlots(len(spectrograms))
+        tPlot.isImage = True
+        for plot, label, (times, freqs, image) in zip(plots, leGend, spectrograms):
+            if len(times) == 0:
+                continue
+            rowTime = times[1] if len(times) > 1 else duration
+            # ImageItem wants [x, y], frequency across and time up
+            imageItem = pg.ImageItem(np.log10(image.T + 1e-6))
+            imageItem.setColorMap(pg.colormap.get('viridis'))
+            imageItem.setRect(QRectF(freqs[0], 0, freqs[-1] - freqs[0], times[-1] + rowTime))
+            plot.addItem(imageItem)
+            plot.setLabel('bottom', 'Frequency (Hz)')
+            plot.setTitle(label, size='8pt')
+        plots[0].setLabel('left', 'Time (s)')
+
+    # cached returns compute() through dataCache when the data is from file
+    #  fname, params are the settings the result depends on
+
+    def cached(self, fname, params, compute):
+        if fname is None:
+            return compute()
+        return self.dataCache.derived(fname, params, compute)
+
+    # showCacheStats opens the debug panel with the dataCache hits and misses,
+    #  it refreshes every second while it's open
+
+    def showCacheStats(self):
+        if self.cacheDialog is None:
+            self.cacheDialog = QtWidgets.QDialog(self)
+            self.cacheDialog.setWindowTitle('Data Cache')
+            label = QtWidgets.QLabel()
+            label.setFont(QFontDatabase.systemFont(QFontDatabase.FixedFont))
+            label.setTextInteractionFlags(Qt.TextSelectableByMouse)
+            clearBut = QtWidgets.QPushButton('Clear Cache')
+            clearBut.clicked.connect(self.dataCache.clear)
+            layout = QtWidgets.QVBoxLayout(self.cacheDialog)
+            layout.addWidget(label)
+            layout.addWidget(clearBut)
+
+            def refresh():
+                stats = self.dataCache.stats()
+                lines = ['{} entries, {:.1f} of {:.0f} MB'.format(stats['entries'], stats['bytes'] / 1024 ** 2,
+                                                                 stats['maxBytes'] / 1024 ** 2)]
+                for kind, (hits, misses) in sorted(stats['counts'].items()):
+                    lines.append('{:<10s} {:6d} hits {:6d} misses'.format(kind, hits, misses))
+                label.setText('\n'.join(lines))
+
+            timer = QTimer(self.cacheDialog)
+            timer.setInterval(1000)
+            timer.timeout.connect(refresh)
+            timer.start()
+            refresh()
+        self.showDisplay(self.cacheDialog)
 
     # This function gets info from the GUI, fills out LASTPATH,
     #  and returns liNac, cmNumStr, cavNumA, cavNumB
@@ -154,7 +656,7 @@ class MicDisp(Display):
         # grab the CM number
         cmNumStr = cmid.split(':')[2]
 
-        # read which rack - 0=A, 1=B
+        # read which rack - 0=A, 1=B, 2=both
         rack = self.ui.CavComboBox.currentIndex()
         if rack == 0:
             delta = 1
@@ -162,118 +664,236 @@ class MicDisp(Display):
             delta = 5
 
         # load up cavNumStr ('1234') and cavNumList (['1','2','3','4'])
+        if rack == 2:
+            cavNumStr = ''.join(AcqJobs.RACK_CAVITIES.values())
+            cavNumList = list(cavNumStr)
         for idx, cb in enumerate(self.checkboxes):
-            if cb.isChecked():
+            if cb.isChecked() and rack != 2:
                 cavNumStr += str(idx + delta)
                 cavNumList += str(idx + delta)
 
         # Make the path name to be nice
         #        LASTPATH=DATA_DIR_PATH+'ACCL_'+liNac+'_'+cmNumStr+cavNumStr[0]+'0'
-        LASTPATH = path.join(DATA_DIR_PATH, 'ACCL_' + linac + '_' + cmNumStr + '00')
-
-        # get today's date as 2- or 4-char strings
-        year = str(self.startd.year)
-        month = '%02d' % self.startd.month
-        day = '%02d' % self.startd.day
-        LASTPATH = path.join(LASTPATH, year, month, day)
+        # DATA_DIR_PATH/ACCL_LxB_CM00/yyyy/mm/dd for today's date
+        LASTPATH = AcqJobs.acqDataDir(linac, cmNumStr, self.startd)
 
         return linac, cmNumStr, cavNumStr
 
     # setGOVal is the response to the Get New Measurement button push
-    # it takes GUI settings and calls python script to fetch the data
-    #  then if Plotting is chosen, it calls getDataBack to make the plot
+    # it takes GUI settings and queues the python script to fetch the data.
+    #  The job queue runs it in a QProcess so the display keeps running during
+    #  the data acq, acqOutput streams the script output to label_message and
+    #  acqFinished calls getDataBack to make the plot if Plotting is chosen
 
-    def setGOVal(self, tPlot, bPlot):
+    def setGOVal(self):
         global LASTPATH
-        return_code = 2
+
+        if self.acqQueue.isRunning():
+            self.ui.label_message.setText("Data acquisition already running\n")
+            return ()
 
         # reads GUI inputs, fills out LASTPATH, and returns LxB, CMxx, and cav num
         linac, cmNumSt, cavNumStr = self.getUserVal()
 
-        self.ui.label_message.setText("Data acquisition started\n")
-        self.ui.label_message.repaint()
-
-        resScrptSrce = "/usr/local/lcls/package/lcls2_llrf/srf/software/res_ctl/res_data_acq.py"
-
-        # made the channel access spec for script call
-        rack = self.ui.CavComboBox.currentIndex()
-        AB = 'AB'
-        caCmd = "ca://ACCL:" + linac + ":" + str(cmNumSt) + "00:RES" + AB[rack] + ":"
-
         # LASTPATH in this case ultimately looks like:
-        #  /u1/lcls/physics/rf_lcls2/microphonics/ACCL_L0B_0110/ACCL_L0B_0110_20220329_151328
         # /u1/lcls/physics/rf_lcls2/microphonics/ACCL_L0B_0100/yyyy/mm/dd/
-        # LASTPATH =  path.join(morPath, botPath)
-        # get LASTPATH from getUserVal()
-        makedirs(LASTPATH, exist_ok=True)
-
-        numbWaveF = str(self.ui.spinBox_buffers.value())
+        # LASTPATH is the directory to put the datafile compliments of getUserVal()
+        numbWaveF = self.ui.spinBox_buffers.value()
+
+        # entire CM, both racks at once and merged by cmJobsFinished
+        if self.ui.CavComboBox.currentIndex() == 2:
+            self.cmJobs, self.cmMergedFile = AcqJobs.cryomoduleJobs(
+                self.ui.CMComboBox.currentText(), int(self.ui.comboBox_decimation.currentText()), numbWaveF,
+                self.ui.BinaryCheckBox.isChecked(), LASTPATH)
+            self.filNam = self.cmMergedFile
+            self.plotJob = None
+            with MicTiming.run('launch', self.cmMergedFile, profile=False), MicTiming.stage('launch'):
+                self.startQueue(self.cmJobs)
+            return ()
+
+        outFile = AcqJobs.acqFileName(cmNumSt, cavNumStr, numbWaveF, datetime.now())
+        self.filNam = outFile
 
-        decimation_str = str(self.ui.comboBox_decimation.currentText())
+        job = AcqJobs.AcqJob(self.ui.CMComboBox.currentText(), 'AB'[self.ui.CavComboBox.currentIndex()],
+                             cavNumStr, int(self.ui.comboBox_decimation.currentText()), numbWaveF,
+                             dataDir=LASTPATH, outFile=outFile, binary=self.ui.BinaryCheckBox.isChecked())
+        self.plotJob = job
+        self.cmJobs = []
+        with MicTiming.run('launch', outFile, profile=False), MicTiming.stage('launch'):
+            self.startQueue([job])
 
-        # LASTPATH is the directory to put the datafile compliments of getUserVal()
-        # Need to make output file name
-        # Sergio had res_cav#_c#_yyyymmdd_hhmmss
-        # Go to res_cm##_cav####_c#_yyyymmdd_hhmmss
+        return ()
 
-        timestamp = datetime.now().strftime("%Y%m%d" + "_" + "%H%M%S")
-        outFile = 'res_CM' + cmNumSt + '_cav' + cavNumStr + '_c' + str(numbWaveF) + '_' + timestamp
-        self.filNam = outFile
+    # sweepAll is the response to the Sweep All CMs button push, it queues
+    #  both racks of every cryomodule with the current decimation and buffers
 
-        cmdList = ['python', resScrptSrce, '-D', str(LASTPATH), '-a', caCmd, '-wsp', decimation_str, '-acav']
-        for cav in cavNumStr:
-            cmdList += cav
-        cmdList += ['-ch', 'DF', '-c', numbWaveF, '-F', outFile]
-        print(cmdList)
+    def sweepAll(self):
+        if self.acqQueue.isRunning():
+            self.ui.label_message.setText("Data acquisition already running\n")
+            return ()
 
-        try:
-            self.ui.label_message.setText("Data acquisition started\n")
-            self.ui.label_message.repaint()
-            process = subprocess.Popen(cmdList, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            out, err = process.communicate()
-            return_code = process.poll()
-            print('Return code {}'.format(return_code))
-            out = out.decode(sys.stdin.encoding)
-            err = err.decode(sys.stdin.encoding)
-            print('Out: {}'.format(out))
-            if len(err) > 0:
-                print('Err: {}'.format(err))
-            self.ui.label_message.setText("{}".format(out))
-            self.ui.label_message.repaint()
-
-            if return_code == 0:
-                self.ui.label_message.setText("File saved at \n" + LASTPATH)
-                self.ui.label_message.repaint()
-
-                # user requesting that plots be made
-                if self.ui.PlotComboBox.currentIndex() == 0:
-                    try:
-                        fname = path.join(LASTPATH, outFile)
-                        if path.exists(fname):
-                            self.getDataBack(fname, tPlot, bPlot)
-                        else:
-                            print('file doesnt exist {}'.format(fname))
-                    except:
-                        print('No data file found in {} to make plots from'.format(LASTPATH))
-
-            # unsuccess - if return_code != 0
-            else:
-                print('return code is not 0')
-
-                e = subprocess.CalledProcessError(return_code, cmdList, output=out)
-                e.stdout, e.stderr = out, err
-                self.ui.label_message.setText(
-                    "Call to microphonics script failed \nreturn code: {}\nstderr: {}".format(return_code,
-                                                                                              str(e.stderr)))
-                self.ui.label_message.repaint()
-                print('stdout {0} stderr {1} return_code {2}'.format(e.stdout, e.stderr, return_code))
-        except:
-            print('You are exceptional')
-            self.ui.label_message.setText("Call to microphonics script failed \n")
-            self.ui.label_message.repaint()
+        jobs = AcqJobs.sweepJobs(self.CM_IDs, int(self.ui.comboBox_decimation.currentText()),
+                                 self.ui.spinBox_buffers.value(), self.ui.BinaryCheckBox.isChecked())
+        self.plotJob = None
+        self.cmJobs = []
+        self.startQueue(jobs)
 
         return ()
 
+    def startQueue(self, jobs):
+        self.ui.label_message.setText("Data acquisition started\n")
+        self.ui.StrtBut.setEnabled(False)
+        self.ui.SweepBut.setEnabled(False)
+        self.ui.CancelBut.setEnabled(True)
+        self.acqQueue.submit(jobs)
+
+    def acqOutput(self, job, line):
+        # show the latest line from the script
+        if self.plotJob is None:
+            line = '{}: {}'.format(job, line)
+        self.ui.label_message.setText(line)
+
+    # cancelAcq is the response to the Cancel button push, it kills the script(s)
+
+    def cancelAcq(self):
+        self.acqQueue.cancel()
+
+    def acqDone(self):
+        self.ui.StrtBut.setEnabled(True)
+        self.ui.SweepBut.setEnabled(True)
+        self.ui.CancelBut.setEnabled(False)
+        # a sweep reports a total at the end
+        if self.plotJob is None and len(self.cmJobs) == 0:
+            counts = self.acqQueue.counts()
+            self.ui.label_message.setText("Sweep finished\n" + ', '.join(
+                '{} {}'.format(count, state) for state, count in sorted(counts.items())))
+
+    # liveStart starts following the data file of a single acquisition when
+    #  Plotting is chosen, the histogram and Welch spectrum are accumulated
+    #  buffer by buffer so each update only reads the new lines
+
+    def liveStart(self, tPlot, bPlot, job):
+        if job is not self.plotJob or self.ui.PlotComboBox.currentIndex() != 0:
+            return
+        self.liveTail = FFt_math.CavDatTail(job.fileName)
+        self.liveHist = FFt_math.DetuneHistogram(FFt_math.fixedHistEdges())
+        self.liveWelch = None
+        self.liveLegend = ['Cav' + cav for cav in job.cavities]
+        self.liveSamples = 0
+        self.liveTimer.start()
+
+    def liveStop(self):
+        self.liveTimer.stop()
+        if self.liveTail is not None:
+            self.liveTail.close()
+            self.liveTail = None
+
+    def liveUpdate(self, tPlot, bPlot):
+        cavDat = self.liveTail.read()
+        if cavDat is None:
+            return
+        if self.liveWelch is None:
+            samplingRate = self.liveTail.header.samplingRate
+            if samplingRate is None:
+                samplingRate = DEFAULT_SAMPLING_RATE / int(self.ui.comboBox_decimation.currentText())
+            self.liveWelch = FFt_math.WelchAccumulator(samplingRate, BUFFER_LENGTH)
+        self.liveHist.add(cavDat)
+        self.liveWelch.add(cavDat)
+        self.liveSamples += len(cavDat)
+
+        leGend = self.liveLegend[:cavDat.shape[1]]
+        counts = np.maximum(self.liveHist.counts, 0.1)
+        tPlot.setCurves([(self.liveHist.edges, counts[:, col]) for col in range(len(leGend))], leGend,
+                        stepMode='center')
+        tPlot.plot.setLogMode(y=True)
+        tPlot.plot.setLabel('bottom', 'Detune (Hz)')
+        tPlot.plot.setLabel('left', 'Counts')
+        tPlot.plot.setTitle('LIVE {} ({} samples)'.format(self.liveTail.fileName.split('/')[-1], self.liveSamples),
+                            size='8pt', justify='left')
+
+        # the first spectrum needs a whole buffer
+        freqs, spectrum = self.liveWelch.result()
+        if spectrum.shape[1] > 0 and self.liveWelch.counts.min() > 0:
+            bPlot.setCurves([(freqs, spectrum[:, col]) for col in range(len(leGend))], leGend)
+            bPlot.plot.setXRange(0, FFt_math.MAX_MODE_FREQ, padding=0)
+            bPlot.plot.setAutoVisible(y=True)
+            bPlot.plot.enableAutoRange(axis='y')
+            bPlot.plot.setLabel('bottom', 'Frequency (Hz)')
+            bPlot.plot.setLabel('left', 'Relative Amplitude')
+        self.showDisplay(self.xfDisp)
+
+    def acqFinished(self, tPlot, bPlot, job):
+        if job is self.plotJob:
+            self.liveStop()
+        print('{} {} return code {}'.format(job, job.state, job.return_code))
+        if len(job.errors) > 0:
+            print('Err: {}'.format(job.errors))
+        acqTimings = self.timeAcquisition(job)
+
+        if job in self.cmJobs:
+            if any(cmJob.state in ('queued', 'running') for cmJob in self.cmJobs):
+                self.ui.label_message.setText('{} {}, waiting for the other rack'.format(job, job.state))
+            else:
+                self.cmJobsFinished(tPlot, bPlot)
+
+        elif job is not self.plotJob:
+            counts = self.acqQueue.counts()
+            self.ui.label_message.setText('{} {} ({} of {} finished)'.format(
+                job, job.state, len(self.acqQueue.jobs) - counts.get('queued', 0) - counts.get('running', 0),
+                len(self.acqQueue.jobs)))
+
+        elif job.state == 'cancelled':
+            self.ui.label_message.setText("Data acquisition cancelled\n")
+
+        elif job.state == 'done':
+            self.ui.label_message.setText("File saved at \n" + job.dataDir)
+            self.reportTimings(acqTimings)
+
+            # user requesting that plots be made
+            if self.ui.PlotComboBox.currentIndex() == 0:
+                try:
+                    fname = job.fileName
+                    if path.exists(fname):
+                        self.getDataBack(fname, tPlot, bPlot)
+                    else:
+                        print('file doesnt exist {}'.format(fname))
+                except:
+                    print('No data file found in {} to make plots from'.format(job.dataDir))
+
+        # unsuccess - if return_code != 0
+        else:
+            print('return code is not 0')
+            self.ui.label_message.setText(
+                "Call to microphonics script failed \nreturn code: {}\nstderr: {}".format(job.return_code,
+                                                                                          job.errors))
+            print('stdout {0} stderr {1} return_code {2}'.format(job.output, job.errors, job.return_code))
+
+    # cmJobsFinished merges the RESA and RESB files of an entire CM
+    #  acquisition into one 8 cavity file, and plots it if Plotting is chosen
+
+    def cmJobsFinished(self, tPlot, bPlot):
+        failed = [job for job in self.cmJobs if job.state != 'done']
+        if len(failed) > 0:
+            self.ui.label_message.setText('Entire CM acquisition {}\n'.format(failed[0].state) + '\n'.join(
+                '{}: {}'.format(job, job.errors.strip() or job.state) for job in failed))
+            return
+
+        dataDir = self.cmJobs[0].dataDir
+        fname = path.join(dataDir, self.cmMergedFile)
+        QtWidgets.QApplication.setOverrideCursor(Qt.WaitCursor)
+        try:
+            cavDat, header_Data = FFt_math.mergeCavDat(self.dataCache.getMany([job.fileName for job in self.cmJobs]))
+            FFt_math.writeCavDatBinary(fname, cavDat, header_Data)
+        except (OSError, ValueError) as e:
+            self.ui.label_message.setText('Could not merge the rack files: {}'.format(e))
+            return
+        finally:
+            QtWidgets.QApplication.restoreOverrideCursor()
+        self.ui.label_message.setText("File saved at \n" + dataDir)
+
+        if self.ui.PlotComboBox.currentIndex() == 0:
+            self.getDataBack(fname, tPlot, bPlot)
+
     # This function prompts the user for a file with data to plot
     #  then calls getDataBack to plot it to axes tPlot and bPlot
     #  The inputs of tPlot and bPlot are passed through to getDataBack
@@ -302,63 +922,232 @@ class MicDisp(Display):
 
         return ()
 
+    # findData opens the index search dialog, files picked in it are plotted
+    #  like ones from getOldData
+
+    def findData(self, tPlot, bPlot):
+        if self.findDialog is None:
+            decimations = [self.ui.comboBox_decimation.itemText(idx)
+                           for idx in range(self.ui.comboBox_decimation.count())]
+            self.findDialog = FindDataDialog(self.CM_IDs, decimations,
+                                             partial(self.plotFoundFile, tPlot, bPlot),
+                                             partial(self.overlayFiles, tPlot, bPlot), self)
+            self.findDialog.cmBox.setCurrentText(self.ui.CMComboBox.currentText())
+        self.showDisplay(self.findDialog)
+
+    def plotFoundFile(self, tPlot, bPlot, fname):
+        self.filNam = path.basename(fname)
+        self.getDataBack(fname, tPlot, bPlot)
+
+    # overlayFiles plots the histograms and spectra of several files on top of
+    #  each other, one color per file and one line style per cavity. With add
+    #  the files join the ones already overlaid. The files are loaded in a
+    #  thread pool through dataCache, so files still in it aren't read again
+
+    def overlayFiles(self, tPlot, bPlot, fnames, cavity=None, add=False):
+        if add:
+            fnames = self.overlayList + [fname for fname in fnames if fname not in self.overlayList]
+        QtWidgets.QApplication.setOverrideCursor(Qt.WaitCursor)
+        try:
+            loaded = self.dataCache.getMany(fnames)
+        except (OSError, ValueError) as e:
+            self.ui.label_message.setText('Could not load overlay: {}'.format(e))
+            return
+        finally:
+            QtWidgets.QApplication.restoreOverrideCursor()
+        self.overlayList = fnames
+
+        styles = [Qt.SolidLine, Qt.DashLine, Qt.DotLine, Qt.DashDotLine]
+        plotData = []
+        names = []
+        pens = []
+        spectra = []
+        for fileIdx, (fname, (cavDataList, header_Data)) in enumerate(zip(fnames, loaded)):
+            header = FFt_math.parseCavHeader(header_Data)
+            cavities = FFt_math.cavityNumbers(fname, header, len(cavDataList))
+            # res_CM02_cav1234_c1_20220601_120000 -> CM02 06-01 12:00
+            label = path.basename(fname).split('.')[0]
+            if header.timestamp is not None:
+                label = '{} {}'.format(label.split('_cav')[0].replace('res_', ''),
+                                       header.timestamp.strftime('%m-%d %H:%M'))
+            fileData = []
+            for cavIdx, (cav, cavData) in enumerate(zip(cavities, cavDataList)):
+                if len(cavData) == 0 or (cavity is not None and cav != cavity):
+                    continue
+                fileData.append(cavData)
+                names.append('{} Cav{}'.format(label, cav))
+                pens.append(pg.mkPen(PLOT_COLORS[fileIdx % len(PLOT_COLORS)], width=1,
+                                     style=styles[cavIdx % len(styles)]))
+            if len(fileData) == 0:
+                continue
+            plotData += fileData
+            samplingRate = header.samplingRate
+            if samplingRate is None:
+                samplingRate = DEFAULT_SAMPLING_RATE / int(self.ui.comboBox_decimation.currentText())
+            welchSegment = BUFFER_LENGTH if self.ui.SpectrumComboBox.currentIndex() == 1 else 0
+            # the same key as FFTPlot when it's all the cavities of the file
+            which = len(fileData) if cavity is None else 'cav{}'.format(cavity)
+            spectra += self.cached(fname, ('spectra', which, samplingRate, welchSegment),
+                                   lambda: FFt_math.cavListSpectra(fileData, samplingRate, welchSegment))
+
+        if len(plotData) == 0:
+            self.ui.label_message.setText('No data to overlay')
+            return
+        # the same bins for every file so the histograms compare
+        hist = FFt_math.cavHistograms(plotData, bins=140)
+        counts = np.maximum(hist.counts, 0.1)
+        tPlot.setCurves([(hist.edges, counts[:, col]) for col in range(counts.shape[1])], names, pens,
+                        stepMode='center')
+        tPlot.plot.setLogMode(y=True)
+        tPlot.plot.setLabel('bottom', 'Detune (Hz)')
+        tPlot.plot.setLabel('left', 'Counts')
+        tPlot.plot.setTitle('Overlay of {} files'.format(len(fnames)), size='8pt', justify='left')
+
+        bPlot.setCurves(spectra, names, pens)
+        bPlot.plot.setXRange(0, FFt_math.MAX_MODE_FREQ, padding=0)
+        bPlot.plot.setAutoVisible(y=True)
+        bPlot.plot.enableAutoRange(axis='y')
+        bPlot.plot.setLabel('bottom', 'Frequency (Hz)')
+        bPlot.plot.setLabel('left', 'Relative Amplitude')
+        self.filNam = 'overlay of ' + ', '.join(path.basename(fname) for fname in fnames)
+        self.showDisplay(self.xfDisp)
+
     # This function eats the data from filename fname and plots
     #  a waterfall plot to axis tPlot and an FFT to axis bPlot
 
     def getDataBack(self, fname, tPlot, bPlot):
 
-        cavDataList = []
-
         if path.exists(fname):
-            dFDat, throwAway = FFt_math.readCavDat(fname)
-
-            # this returns a list of lists of data values
-            cavDataList = FFt_math.parseCavDat(dFDat)
-
-            # figure out cavities from filename for legend
-            fnameParts = fname.split('_')
-            # find the fnamePart that starts with cav
-            for part in fnameParts:
-                if part.startswith('cav'):
-                    cavnums = str(part[3:])
-
-            tPlot.axes.cla()
-            bPlot.axes.cla()
-            leGend = []
-            leGend2 = []
-
-            for idx, cavData in enumerate(cavDataList):
-                if len(cavData) > 0:
-                    leGend.append('Cav' + cavnums[idx])
-                    tPlot.axes.hist(cavData, bins=140,
-                                    histtype='step', log='True')
-
-                    leGend2.append('Cav' + cavnums[idx])
-                    self.FFTPlot(bPlot, cavData)
-
-            # put file name on the plot
-            parts = fname.split('/')
-            tPlot.axes.set_title(parts[-1], loc='left', fontsize='small')
-            # tPlot.axes.set_xlim(-200, 200)
-            tPlot.axes.set_ylim(bottom=1)
-            tPlot.axes.set_xlabel('Detune (Hz)')
-            tPlot.axes.set_ylabel('Counts')
-            tPlot.axes.grid(True)
-            tPlot.axes.legend(leGend)
-            tPlot.draw_idle()
-
-            bPlot.axes.set_xlim(0, 150)
-            bPlot.axes.set_xlabel('Frequency (Hz)')
-            bPlot.axes.set_ylabel('Relative Amplitude')
-            bPlot.axes.grid(True)
-            bPlot.axes.legend(leGend2)
-            bPlot.draw_idle()
-            self.showDisplay(self.xfDisp)
-
+            with MicTiming.run('plot', path.basename(fname)) as timings:
+                self.plotFile(fname, tPlot, bPlot)
+            self.reportTimings(timings)
         else:
             print("Couldn't find file {}".format(fname))
         return
 
+    # plotFile is the plotting for getDataBack, each step timed into its run
+
+    def plotFile(self, fname, tPlot, bPlot):
+        # this returns one array of data values per cavity, from a text
+        #  or binary (.npz) file. Text files are memory-mapped from the
+        #  sidecar if the file has been read before
+        with MicTiming.stage('load', path.getsize(fname)):
+            cavDataList, header_Data = self.dataCache.get(fname)
+        header = FFt_math.parseCavHeader(header_Data)
+
+        # figure out cavities for the legend, from the file name or
+        #  else the header's channels
+        cavnums = FFt_math.cavityNumbers(fname, header, len(cavDataList))
+
+        leGend = []
+        leGend2 = []
+
+        plotData = []
+        for idx, cavData in enumerate(cavDataList):
+            if len(cavData) > 0:
+                leGend.append('Cav' + str(cavnums[idx]))
+                leGend2.append('Cav' + str(cavnums[idx]))
+                plotData.append(cavData)
+
+        # put file name on the plot
+        parts = fname.split('/')
+
+        # TopPlotComboBox picks histograms or a waterfall per cavity
+        if self.ui.TopPlotComboBox.currentIndex() == 1 and len(plotData) > 0:
+            self.WaterfallPlot(tPlot, plotData, leGend, header.samplingRate, fname)
+        else:
+            if len(plotData) > 0:
+                self.HistPlot(tPlot, plotData, leGend, fname)
+            tPlot.plot.setLabel('bottom', 'Detune (Hz)')
+            tPlot.plot.setLabel('left', 'Counts')
+        tPlot.plot.setTitle(parts[-1], size='8pt', justify='left')
+
+        if len(plotData) > 0:
+            self.FFTPlot(bPlot, plotData, leGend2, header.samplingRate, fname)
+            self.plotted = (fname, plotData, leGend2, header.samplingRate)
+            if self.modesDialog is not None and self.modesDialog.isVisible():
+                self.updateModes()
+
+        bPlot.plot.setXRange(0, FFt_math.MAX_MODE_FREQ, padding=0)
+        # scale y to the 0-150 Hz part of the spectrum
+        bPlot.plot.setAutoVisible(y=True)
+        bPlot.plot.enableAutoRange(axis='y')
+        bPlot.plot.setLabel('bottom', 'Frequency (Hz)')
+        bPlot.plot.setLabel('left', 'Relative Amplitude')
+        with MicTiming.stage('draw'):
+            self.showDisplay(self.xfDisp)
+            # paint now rather than on return to the event loop, so the
+            #  time it takes is part of the draw
+            self.xfDisp.repaint()
+
+    # showModes opens the table of the modes of each cavity in the plotted file
+
+    def showModes(self):
+        if self.modesDialog is None:
+            self.modesDialog = ModesDialog(self.showFreq, self)
+        if self.plotted is None:
+            self.ui.label_message.setText('Plot a file first, the modes are of the plotted file')
+            return
+        self.updateModes()
+        self.showDisplay(self.modesDialog)
+
+    def updateModes(self):
+        import MicModes
+        fname, plotData, leGend, samplingRate = self.plotted
+        if samplingRate is None:
+            samplingRate = DEFAULT_SAMPLING_RATE / int(self.ui.comboBox_decimation.currentText())
+        QtWidgets.QApplication.setOverrideCursor(Qt.WaitCursor)
+        try:
+            with MicTiming.stage('modes', sum(cavData.nbytes for cavData in plotData)):
+                cavModes = self.cached(fname, ('modes', len(plotData), samplingRate),
+                                       lambda: MicModes.analyzeModes(plotData, samplingRate))
+        finally:
+            QtWidgets.QApplication.restoreOverrideCursor()
+        self.modesDialog.setModes(path.basename(fname), leGend, cavModes)
+
+    def showSurvey(self):
+        if self.surveyDialog is None:
+            self.surveyDialog = SurveyDialog(self.CM_IDs, lambda fname: self.plotFoundFile(*self.canvases(), fname),
+                                             self)
+        self.showDisplay(self.surveyDialog)
+
+    # showFreq zooms the spectrum to a few Hz either side of freq
+
+    def showFreq(self, freq):
+        tPlot, bPlot = self.canvases()
+        bPlot.plot.setXRange(max(0, freq - 5), freq + 5, padding=0)
+        self.showDisplay(self.xfDisp)
+
+    # timeAcquisition logs how long a finished job ran, and how big its file is
+
+    def timeAcquisition(self, job):
+        with MicTiming.run('acquisition', job.outFile or str(job), profile=False) as timings:
+            if job.startTime is not None and job.endTime is not None:
+                fileBytes = path.getsize(job.fileName) if job.state == 'done' and path.exists(job.fileName) else 0
+                timings.add('wait', job.endTime - job.startTime, fileBytes)
+        return timings
+
+    # reportTimings adds the step timings to label_message when they're shown,
+    #  and always says where a profile went
+
+    def reportTimings(self, timings):
+        lines = []
+        if self.showTimings:
+            lines.append('{}: {}'.format(timings.name, timings.summary()))
+        if len(timings.profileFiles) > 0:
+            lines.append('profile in ' + ', '.join(timings.profileFiles))
+        message = self.ui.label_message.text().strip()
+        if len(lines) > 0:
+            self.ui.label_message.setText('\n'.join([message] + lines if message else lines))
+
+    def toggleTimings(self):
+        self.showTimings = not self.showTimings
+        self.ui.label_message.setText('Timings {}'.format('shown' if self.showTimings else 'hidden'))
+
+    def profileNext(self):
+        MicTiming.profileNext()
+        self.ui.label_message.setText('The next plot will be profiled')
+
     def showDisplay(self, display):
         # type: (QWidget) -> None
         display.show()
@@ -368,6 +1157,7 @@ class MicDisp(Display):
         display.activateWindow()
 
     def plotWindow(self):
+        import physicselog
         screen = QtWidgets.QApplication.primaryScreen()
         screenshot = screen.grabWindow(self.xfDisp.ui.frame.winId())
         screenshot.save('/tmp/srf_micro.png', 'png')
@@ -7,23 +7,94 @@ Created on Wed Aug  4 09:39:20 2021
 # J Nelson 30 Mar 2022
 # Using this as a utils file for CommMicro.py
 
-from os import makedirs, path
+import json
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from datetime import datetime
+from functools import lru_cache
+from itertools import islice
+from os import getpid, listdir, makedirs, path, remove, rename, sep, stat, utime, walk
+from shutil import rmtree
+from tempfile import mkdtemp
+from threading import Lock
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 
 read_data = []
 
+# scipy.fft threads per transform, -1 is one per core
+FFT_WORKERS = -1
 
-def readCavDat(fileName):
+# spectra are only looked at up to here, mechanical modes are below 150 Hz
+MAX_MODE_FREQ = 150
+
+# fixed histogram bins, so histograms of different files can be added up
+DETUNE_HIST_LIMIT = 200
+DETUNE_HIST_BIN = 0.5
+
+# the waterfall never has more rows than this, longer runs average rows together
+MAX_WATERFALL_ROWS = 300
+
+# detune percentiles cavStats reports, as p01, p05, ...
+STAT_PERCENTILES = (1, 5, 50, 95, 99)
+
+# samples per waveform buffer from the resonance chassis
+BUFFER_LENGTH = 16384
+# chassis sampling rate before decimation (wave_samp_per)
+DEFAULT_SAMPLING_RATE = 2000
+
+DATA_DIR_PATH = "/u1/lcls/physics/rf_lcls2/microphonics/"
+
+# parsed data is cached in a hidden sidecar directory next to each data file,
+#  .<data file name>.npcache/ holding cav<n>.npy per cavity and meta.json.
+#  All sidecars under DATA_DIR_PATH together are kept below SIDECAR_MAX_BYTES
+SIDECAR_SUFFIX = '.npcache'
+SIDECAR_META = 'meta.json'
+SIDECAR_MAX_BYTES = 10 * 1024 ** 3
+
+# memory CavDatCache may use for loaded files and results computed from
+#  them, most entries it keeps, and the threads getMany loads files with
+CACHE_MAX_BYTES = 512 * 1024 ** 2
+CACHE_MAX_ENTRIES = 256
+CACHE_THREADS = 4
+
+# binary data files are .npz archives holding the header lines and the data
+#  as (n_samples, n_cavities) arrays of at most BINARY_CHUNK_ROWS rows each,
+#  and the data lines readCavHeader skips as 'skipped', so converting a text
+#  file loses nothing. float32 keeps the 3 decimals of the text files for
+#  detunes below 1000 Hz
+BINARY_SUFFIX = '.npz'
+BINARY_DTYPE = np.float32
+BINARY_CHUNK_ROWS = 64 * BUFFER_LENGTH
+
+
+def readCavHeader(f, skipped=None):
+    # reads the header from open file f and leaves f at the first data line
+    #  that is used, the lines before it are added to list skipped if given
     header_Data = []
-    with open(fileName) as f:
-        # watch for line to start with # ACCL
-        lini = f.readline()
-        while 'ACCL' not in lini:
-            header_Data.append(lini)
-            lini = f.readline()
-        next(f)
-        next(f)
-        # append the # ACCL line to the header
+    # watch for line to start with # ACCL
+    lini = f.readline()
+    while 'ACCL' not in lini:
+        if lini == '':
+            raise ValueError('No # ACCL line found in {}'.format(f.name))
         header_Data.append(lini)
+        lini = f.readline()
+    for skip in range(2):
+        # readline rather than next(f) so f.tell() still works
+        skipLine = f.readline()
+        if skipped is not None and skipLine != '':
+            skipped.append(skipLine)
+    # append the # ACCL line to the header
+    header_Data.append(lini)
+    return header_Data
+
+
+def readCavDat(fileName):
+    with open(fileName) as f:
+        header_Data = readCavHeader(f)
         read_data = f.readlines()
 
     f.close()
@@ -34,6 +105,219 @@ def readCavDat(fileName):
     return (read_data, header_Data)
 
 
+# The header res_data_acq.py writes looks like
+#   # 2021-06-17T12:27:30.380437
+#   # ## Cavity 1
+#   # wave_samp_per : 2
+#   # wave_shift : 1
+#   ...
+#   # ACCL:L1B:H110:PZT:DF:WF ACCL:L1B:H120:PZT:DF:WF ...
+#  with one block of settings per cavity and the PVs of the data columns last
+
+@dataclass(slots=True)
+class CavitySettings:
+    cavity: int
+    wave_samp_per: int = 1
+    wave_shift: int = 0
+    chan_keep: int = 0
+    chirp_en: int = 0
+    chirp_acq_per: int = 0
+    # any setting not listed above, as the raw string
+    other: dict = field(default_factory=dict)
+
+
+@dataclass(slots=True)
+class DataChannel:
+    # one column of the data section
+    pv: str
+    cavity: int
+    signal: str
+
+
+@dataclass(slots=True)
+class CavDatHeader:
+    timestamp: datetime = None
+    cavities: dict = field(default_factory=dict)
+    channels: list = field(default_factory=list)
+
+    # sample rate of the data in Hz, None if the header has no settings
+    @property
+    def samplingRate(self):
+        for settings in self.cavities.values():
+            return DEFAULT_SAMPLING_RATE / settings.wave_samp_per
+        return None
+
+    def cavityNumbers(self):
+        return [channel.cavity for channel in self.channels]
+
+
+def parseCavHeader(header_Data):
+    header = CavDatHeader()
+    settings = None
+    for lini in header_Data:
+        text = lini.lstrip('#').strip()
+        if text == '':
+            continue
+        if text.startswith('ACCL'):
+            # ACCL:L1B:H110:PZT:DF:WF - cavity number is the 3rd character of
+            #  the 3rd field, the signal is the 5th field
+            for pv in text.split():
+                fields = pv.split(':')
+                try:
+                    cavity = int(fields[2][2])
+                except (IndexError, ValueError):
+                    cavity = 0
+                signal = fields[4] if len(fields) > 4 else ''
+                header.channels.append(DataChannel(pv, cavity, signal))
+        elif text.startswith('## Cavity'):
+            cavity = int(text.split()[-1])
+            settings = CavitySettings(cavity)
+            header.cavities[cavity] = settings
+        elif ':' in text and settings is not None:
+            key, value = [part.strip() for part in text.split(':', 1)]
+            try:
+                if key in CavitySettings.__dataclass_fields__ and key != 'other':
+                    setattr(settings, key, int(value))
+                    continue
+            except ValueError:
+                pass
+            settings.other[key] = value
+        elif header.timestamp is None:
+            try:
+                header.timestamp = datetime.fromisoformat(text)
+            except ValueError:
+                pass
+    return header
+
+
+# readCavDatHeader only reads the header of a data file, not the data body
+
+def readCavDatHeader(fileName):
+    if isCavDatBinary(fileName):
+        with np.load(fileName) as npz:
+            return parseCavHeader(list(npz['header']))
+    with open(fileName) as f:
+        return parseCavHeader(readCavHeader(f))
+
+
+# iterCavDat is the streaming version of readCavDat + parseCavDatArray.
+#  It yields (blockSize, n_cavities) arrays, one BUFFER_LENGTH buffer at a time
+#  by default, so only one block of the file is ever held in memory.
+#  The last block is shorter if the file doesn't end on a block boundary.
+#  ioLock (a multiprocessing Lock or Semaphore) is held while each block is
+#  read, so processes sharing it cap how many read from the disk at once
+
+def iterCavDat(fileName, blockSize=BUFFER_LENGTH, dtype=np.float64, ioLock=None):
+    if isCavDatBinary(fileName):
+        yield from iterCavDatBinary(fileName, blockSize, dtype)
+        return
+    if ioLock is None:
+        ioLock = nullcontext()
+    with open(fileName) as f:
+        with ioLock:
+            readCavHeader(f)
+        numCavs = 0
+        while True:
+            with ioLock:
+                block = list(islice(f, blockSize))
+            if len(block) == 0:
+                break
+            cavDat = parseCavDatArray(block, dtype)
+            # keep the width of the first block if a later one is ragged
+            if numCavs == 0:
+                numCavs = cavDat.shape[1]
+            elif cavDat.shape[1] < numCavs:
+                cavDat = np.pad(cavDat, ((0, 0), (0, numCavs - cavDat.shape[1])),
+                                constant_values=np.nan)
+            yield cavDat
+
+
+# CavDatTail follows a data file while res_data_acq.py is still writing it.
+#  Each read() returns the complete lines added since the last call as an
+#  (n_samples, n_cavities) array, or None if there are none (yet). header is
+#  the parsed CavDatHeader once the # ACCL line has been written
+
+class CavDatTail:
+
+    def __init__(self, fileName, dtype=np.float64):
+        self.fileName = fileName
+        self.dtype = dtype
+        self.f = None
+        self.partial = ''
+        self.header_Data = []
+        self.header = None
+        # lines after the # ACCL line that readCavHeader skips
+        self.skip = 2
+
+    def read(self):
+        if self.f is None:
+            try:
+                self.f = open(self.fileName)
+            except FileNotFoundError:
+                return None
+        text = self.partial + self.f.read()
+        lines = text.split('\n')
+        # keep a half-written last line for the next read
+        self.partial = lines.pop()
+
+        start = 0
+        if self.header is None:
+            for start, lini in enumerate(lines, 1):
+                if 'ACCL' in lini:
+                    self.header_Data.append(lini + '\n')
+                    self.header = parseCavHeader(self.header_Data)
+                    break
+                self.header_Data.append(lini + '\n')
+            else:
+                return None
+        skipped = min(self.skip, len(lines) - start)
+        self.skip -= skipped
+        data = [lini + '\n' for lini in lines[start + skipped:] if lini.strip() != '']
+        if len(data) == 0:
+            return None
+        return parseCavDatArray(data, self.dtype)
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+
+# loadCavDat reads a whole file block by block with iterCavDat into one
+#  array, so the text lines of only one block are in memory next to it.
+#  The array is sized from the file size and the length of the first lines,
+#  grown in place if that was short and cut to the rows read at the end.
+#  Binary files are read straight into the array
+
+def loadCavDat(fileName, blockSize=BUFFER_LENGTH, dtype=np.float64, ioLock=None):
+    if isCavDatBinary(fileName):
+        return readCavDatBinary(fileName, dtype)
+    with open(fileName) as f:
+        header_Data = readCavHeader(f)
+        dataBytes = path.getsize(fileName) - f.tell()
+        sample = list(islice(f, 1000))
+    lineBytes = sum(len(line) for line in sample) / max(len(sample), 1)
+    rows = int(dataBytes / max(lineBytes, 1) * 1.02) + 1
+
+    cavDat = None
+    row = 0
+    for block in iterCavDat(fileName, blockSize, dtype, ioLock):
+        if cavDat is None:
+            cavDat = np.empty((rows, block.shape[1]), dtype=dtype)
+        if block.shape[1] > cavDat.shape[1]:
+            # a ragged later line with more columns, the earlier rows don't have them
+            cavDat = np.pad(cavDat, ((0, 0), (0, block.shape[1] - cavDat.shape[1])), constant_values=np.nan)
+        if row + len(block) > len(cavDat):
+            cavDat.resize((max(2 * len(cavDat), row + len(block)), cavDat.shape[1]), refcheck=False)
+        cavDat[row:row + len(block), :block.shape[1]] = block
+        cavDat[row:row + len(block), block.shape[1]:] = np.nan
+        row += len(block)
+    if cavDat is None:
+        return np.empty((0, 0), dtype=dtype), header_Data
+    cavDat.resize((row, cavDat.shape[1]), refcheck=False)
+    return cavDat, header_Data
+
+
 # Number of sample points
 
 
@@ -65,6 +349,872 @@ def parseCavDat(read_data):
     return ([cavDat1, cavDat2, cavDat3, cavDat4])
 
 
+# parseCavDatArray does the same job as parseCavDat but returns one
+#  (n_samples, n_cavities) ndarray built in bulk instead of python lists.
+#  A value missing from a line (ragged or short trailing columns) is NaN;
+#  cavDatColumns turns the array back into per-cavity data like parseCavDat
+
+def parseCavDatArray(read_data, dtype=np.float64):
+    if len(read_data) == 0:
+        return np.empty((0, 0), dtype=dtype)
+
+    # fast path - every line has the same number of columns
+    try:
+        return np.loadtxt(read_data, dtype=dtype, ndmin=2)
+    except ValueError:
+        pass
+
+    # slow path - ragged lines, split on whitespace as loadtxt does so a
+    #  value wider than its column reads the same either way. Blank lines
+    #  are skipped, as loadtxt skips them
+    rows = [fields for fields in (red.split() for red in read_data) if len(fields) > 0]
+    numCavs = max(len(fields) for fields in rows)
+    cavDat = np.full((len(rows), numCavs), np.nan, dtype=dtype)
+    for row, fields in enumerate(rows):
+        cavDat[row, 0] = float(fields[0])
+        for col, field in enumerate(fields[1:], 1):
+            try:
+                cavDat[row, col] = float(field)
+            except ValueError:
+                # parseCavDat gives up on the rest of a line it can't read
+                break
+
+    return cavDat
+
+
+# cavDatColumns splits the array from parseCavDatArray into one 1-D array per
+#  cavity with the missing (NaN) samples dropped
+
+def cavDatColumns(cavDat):
+    cavDataList = []
+    for col in range(cavDat.shape[1]):
+        cavData = cavDat[:, col]
+        missing = np.isnan(cavData)
+        if missing.any():
+            cavData = cavData[~missing]
+        cavDataList.append(cavData)
+    return cavDataList
+
+
+# cavityNumbers gives the cavity number of each data column, from the
+#  res_CM##_cav####_... file name if it matches, else from the header PVs
+
+def cavityNumbers(fileName, header, numCavs):
+    for part in path.basename(fileName).split('_'):
+        if part.startswith('cav') and len(part) - 3 == numCavs and part[3:].isdigit():
+            return [int(cav) for cav in part[3:]]
+    if len(header.channels) == numCavs:
+        return header.cavityNumbers()
+    return list(range(1, numCavs + 1))
+
+
+# scipy.fft takes longer to import than everything else here, so it is
+#  imported by the first transform rather than with the module
+
+def _scipyFft():
+    from scipy import fft
+    return fft
+
+
+# spectrumFreqs is the frequency axis of cavSpectra, cached since every
+#  cavity and every file of the same length and rate shares it
+
+@lru_cache(maxsize=32)
+def spectrumFreqs(num_points, samplingRate):
+    freqs = _scipyFft().rfftfreq(num_points, 1.0 / samplingRate)[:num_points // 2]
+    freqs.setflags(write=False)
+    return freqs
+
+
+# cavSpectra is the one-sided amplitude spectrum MicDisp.FFTPlot draws,
+#  2/N |FFT| for frequencies below Nyquist, for all the columns of an
+#  (n_samples, n_cavities) array in one rfft call. workers is the number of
+#  scipy.fft threads, -1 for one per core
+
+def cavSpectra(cavDat, samplingRate, workers=FFT_WORKERS):
+    cavDat = np.asarray(cavDat)
+    if cavDat.ndim == 1:
+        cavDat = cavDat[:, np.newaxis]
+    num_points = len(cavDat)
+    # transform along contiguous rows, a no-op for the stacked cavListSpectra data
+    rows = np.ascontiguousarray(cavDat.T)
+    amplitude = np.abs(_scipyFft().rfft(rows, axis=-1, workers=workers)[:, :num_points // 2])
+    amplitude *= 2.0 / num_points
+    return spectrumFreqs(num_points, samplingRate), amplitude.T
+
+
+def cavSpectrum(cavData, samplingRate, workers=FFT_WORKERS):
+    freqs, amplitude = cavSpectra(cavData, samplingRate, workers)
+    return freqs, amplitude[:, 0]
+
+
+# cavListSpectra gives (freqs, amplitude) for every cavity in cavDataList, as
+#  one batched transform when the cavities have the same number of samples.
+#  welchSegment > 0 uses Welch averaged spectra with segments that long
+
+def cavListSpectra(cavDataList, samplingRate, welchSegment=0, workers=FFT_WORKERS):
+    if len({len(cavData) for cavData in cavDataList}) == 1:
+        # (n_cavities, n_samples) stacked, passed on as an (n_samples, n_cavities) view
+        groups = [np.stack(cavDataList).T]
+    else:
+        groups = [np.asarray(cavData)[:, np.newaxis] for cavData in cavDataList]
+
+    spectra = []
+    for cavDat in groups:
+        if welchSegment > 0:
+            freqs, amplitude = welchSpectrum(cavDat, samplingRate, welchSegment, workers=workers)
+        else:
+            freqs, amplitude = cavSpectra(cavDat, samplingRate, workers)
+        spectra += [(freqs, amplitude[:, col]) for col in range(amplitude.shape[1])]
+    return spectra
+
+
+# WelchAccumulator builds a Welch (segmented, windowed, averaged) spectrum
+#  block by block, so it can be fed from iterCavDat with memory bounded by a
+#  block. Segments are segmentLength long and overlap by the overlap fraction,
+#  each has its mean removed and a Hann window applied. A segment where a
+#  cavity has missing (NaN) samples is left out of that cavity's average.
+
+class WelchAccumulator:
+    # segments transformed per rfft call, bounds the temporary arrays
+    SEGMENT_BATCH = 64
+
+    def __init__(self, samplingRate, segmentLength=BUFFER_LENGTH, overlap=0.5, window='hann',
+                 workers=FFT_WORKERS):
+        self.samplingRate = samplingRate
+        self.workers = workers
+        self.segmentLength = segmentLength
+        self.step = max(1, int(round(segmentLength * (1 - overlap))))
+        if window == 'hann':
+            # periodic Hann window
+            self.window = 0.5 - 0.5 * np.cos(2 * np.pi * np.arange(segmentLength) / segmentLength)
+        else:
+            self.window = np.ones(segmentLength)
+        self.tail = None
+        self.powerSum = None
+        self.counts = None
+
+    def add(self, block):
+        block = np.asarray(block, dtype=np.float64)
+        if block.ndim == 1:
+            block = block[:, np.newaxis]
+        if self.tail is not None and len(self.tail) > 0:
+            block = np.concatenate([self.tail, block])
+        if self.powerSum is None:
+            self.powerSum = np.zeros((self.segmentLength // 2 + 1, block.shape[1]))
+            self.counts = np.zeros(block.shape[1], dtype=np.int64)
+
+        numSegs = 0
+        if len(block) >= self.segmentLength:
+            numSegs = (len(block) - self.segmentLength) // self.step + 1
+            # (numSegs, n_cavities, segmentLength) view, no copy
+            segs = sliding_window_view(block, self.segmentLength, axis=0)[::self.step]
+            for start in range(0, numSegs, self.SEGMENT_BATCH):
+                batch = segs[start:start + self.SEGMENT_BATCH]
+                batch = (batch - batch.mean(axis=-1, keepdims=True)) * self.window
+                power = np.square(np.abs(_scipyFft().rfft(batch, axis=-1, workers=self.workers)))
+                valid = ~np.isnan(power).any(axis=-1)
+                self.powerSum += np.where(valid[:, :, np.newaxis], power, 0).sum(axis=0).T
+                self.counts += valid.sum(axis=0)
+        # keep what the next block needs to finish the next segment
+        self.tail = block[numSegs * self.step:].copy()
+
+    # result returns (freqs, spectrum) with spectrum (n_freqs, n_cavities).
+    #  scaling 'amplitude' is comparable to the 2/N |FFT| of cavSpectrum,
+    #  'density' is the one-sided power spectral density in Hz^2/Hz
+
+    def result(self, scaling='amplitude'):
+        freqs = _scipyFft().rfftfreq(self.segmentLength, 1.0 / self.samplingRate)
+        if self.powerSum is None:
+            return freqs, np.full((len(freqs), 0), np.nan)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            meanPower = self.powerSum / self.counts
+        if scaling == 'density':
+            spectrum = meanPower / (self.samplingRate * np.sum(np.square(self.window)))
+            spectrum[1:-1] *= 2
+        else:
+            spectrum = 2.0 * np.sqrt(meanPower) / np.sum(self.window)
+        return freqs, spectrum
+
+
+# welchSpectrum is the Welch spectrum of data already in memory, an
+#  (n_samples, n_cavities) array or one cavity. Records shorter than
+#  segmentLength get a single segment as long as the record
+
+def welchSpectrum(cavDat, samplingRate, segmentLength=BUFFER_LENGTH, overlap=0.5, scaling='amplitude',
+                  workers=FFT_WORKERS):
+    welch = WelchAccumulator(samplingRate, min(segmentLength, len(cavDat)), overlap, workers=workers)
+    welch.add(cavDat)
+    return welch.result(scaling)
+
+
+# welchCavDatFile streams a data file through iterCavDat into a Welch spectrum,
+#  using the sampling rate from the header unless one is given
+
+def welchCavDatFile(fileName, samplingRate=None, segmentLength=BUFFER_LENGTH, overlap=0.5,
+                    scaling='amplitude', workers=FFT_WORKERS):
+    if samplingRate is None:
+        samplingRate = readCavDatHeader(fileName).samplingRate
+    welch = WelchAccumulator(samplingRate, segmentLength, overlap, workers=workers)
+    for cavDat in iterCavDat(fileName):
+        welch.add(cavDat)
+    return welch.result(scaling)
+
+
+# SpectrogramAccumulator builds the waterfall (short-time FFT) of a run block
+#  by block: one Hann-windowed amplitude spectrum per segmentLength samples
+#  (one BUFFER_LENGTH buffer by default), cut at maxFreq. Rows are averaged in
+#  groups so there are never more than 2 * maxRows of them, the group size
+#  doubling each time the rows fill up, so a 999 buffer run costs the same
+#  to draw as a 300 buffer one
+
+class SpectrogramAccumulator:
+    SEGMENT_BATCH = 64
+
+    def __init__(self, samplingRate, segmentLength=BUFFER_LENGTH, maxFreq=MAX_MODE_FREQ,
+                 maxRows=MAX_WATERFALL_ROWS, workers=FFT_WORKERS):
+        self.samplingRate = samplingRate
+        self.segmentLength = segmentLength
+        self.maxRows = maxRows
+        self.workers = workers
+        self.window = 0.5 - 0.5 * np.cos(2 * np.pi * np.arange(segmentLength) / segmentLength)
+        freqs = _scipyFft().rfftfreq(segmentLength, 1.0 / samplingRate)
+        self.freqs = freqs[freqs <= maxFreq]
+        self.tail = None
+        self.rows = []
+        # segments averaged into each row, and the row being filled
+        self.rowGroup = 1
+        self.groupSum = None
+        self.groupCount = 0
+
+    def add(self, block):
+        block = np.asarray(block, dtype=np.float64)
+        if block.ndim == 1:
+            block = block[:, np.newaxis]
+        if self.tail is not None and len(self.tail) > 0:
+            block = np.concatenate([self.tail, block])
+
+        numSegs = len(block) // self.segmentLength
+        for start in range(0, numSegs, self.SEGMENT_BATCH):
+            stop = min(start + self.SEGMENT_BATCH, numSegs)
+            # (segments, n_cavities, segmentLength)
+            segs = block[start * self.segmentLength:stop * self.segmentLength]
+            segs = segs.reshape(stop - start, self.segmentLength, -1).transpose(0, 2, 1)
+            segs = (segs - segs.mean(axis=-1, keepdims=True)) * self.window
+            spectra = np.abs(_scipyFft().rfft(segs, axis=-1, workers=self.workers)[..., :len(self.freqs)])
+            spectra *= 2.0 / np.sum(self.window)
+            for spectrum in spectra.astype(np.float32):
+                self.addRow(spectrum)
+        self.tail = block[numSegs * self.segmentLength:].copy()
+
+    def addRow(self, spectrum):
+        if self.groupSum is None:
+            self.groupSum = spectrum
+        else:
+            self.groupSum += spectrum
+        self.groupCount += 1
+        if self.groupCount == self.rowGroup:
+            self.rows.append(self.groupSum / self.groupCount)
+            self.groupSum = None
+            self.groupCount = 0
+            if len(self.rows) >= 2 * self.maxRows:
+                # halve the rows by averaging neighbours
+                self.rows = [(self.rows[idx] + self.rows[idx + 1]) / 2 for idx in range(0, len(self.rows), 2)]
+                self.rowGroup *= 2
+
+    # result returns (times, freqs, image), times is the start of each row
+    #  in seconds and image is (n_cavities, n_rows, n_freqs)
+
+    def result(self):
+        rows = list(self.rows)
+        if self.groupCount > 0:
+            rows.append(self.groupSum / self.groupCount)
+        times = np.arange(len(rows)) * self.rowGroup * self.segmentLength / self.samplingRate
+        if len(rows) == 0:
+            return times, self.freqs, np.empty((0, 0, len(self.freqs)), dtype=np.float32)
+        return times, self.freqs, np.stack(rows, axis=1)
+
+
+# cavListSpectrogram gives (times, freqs, image) for each cavity in
+#  cavDataList, with one batched transform when the lengths agree
+
+def cavListSpectrogram(cavDataList, samplingRate, segmentLength=BUFFER_LENGTH, maxFreq=MAX_MODE_FREQ,
+                       maxRows=MAX_WATERFALL_ROWS, workers=FFT_WORKERS):
+    if len({len(cavData) for cavData in cavDataList}) == 1:
+        groups = [np.stack(cavDataList).T]
+    else:
+        groups = [np.asarray(cavData)[:, np.newaxis] for cavData in cavDataList]
+
+    spectrograms = []
+    for cavDat in groups:
+        spectrogram = SpectrogramAccumulator(samplingRate, min(segmentLength, len(cavDat)), maxFreq, maxRows,
+                                             workers)
+        spectrogram.add(cavDat)
+        times, freqs, image = spectrogram.result()
+        spectrograms += [(times, freqs, cavImage) for cavImage in image]
+    return spectrograms
+
+
+# spectrogramCavDatFile streams a data file through iterCavDat into a waterfall
+
+def spectrogramCavDatFile(fileName, samplingRate=None, segmentLength=BUFFER_LENGTH, maxFreq=MAX_MODE_FREQ,
+                          maxRows=MAX_WATERFALL_ROWS, workers=FFT_WORKERS):
+    if samplingRate is None:
+        samplingRate = readCavDatHeader(fileName).samplingRate
+    spectrogram = SpectrogramAccumulator(samplingRate, segmentLength, maxFreq, maxRows, workers)
+    for cavDat in iterCavDat(fileName):
+        spectrogram.add(cavDat)
+    return spectrogram.result()
+
+
+# DetuneHistogram counts detune values into the same bins for every cavity.
+#  Counts are added block by block (from iterCavDat, or a list of per-cavity
+#  arrays) and histograms with the same edges merge, across chunks of a file
+#  or across files. Values outside the edges are kept as underflow/overflow
+
+class DetuneHistogram:
+
+    def __init__(self, edges):
+        self.edges = np.asarray(edges, dtype=np.float64)
+        widths = np.diff(self.edges)
+        self.uniform = np.allclose(widths, widths[0])
+        self.counts = None
+        self.underflow = None
+        self.overflow = None
+
+    @property
+    def numBins(self):
+        return len(self.edges) - 1
+
+    def grow(self, numCavs):
+        # make room for numCavs cavities
+        if self.counts is None:
+            self.counts = np.zeros((self.numBins, 0), dtype=np.int64)
+            self.underflow = np.zeros(0, dtype=np.int64)
+            self.overflow = np.zeros(0, dtype=np.int64)
+        extra = numCavs - self.counts.shape[1]
+        if extra > 0:
+            self.counts = np.pad(self.counts, ((0, 0), (0, extra)))
+            self.underflow = np.pad(self.underflow, (0, extra))
+            self.overflow = np.pad(self.overflow, (0, extra))
+
+    def add(self, cavDat):
+        if isinstance(cavDat, np.ndarray):
+            cavDat = cavDat[np.newaxis, :] if cavDat.ndim == 1 else cavDat.T
+        self.grow(len(cavDat))
+        lo, hi = self.edges[0], self.edges[-1]
+        for col, cavData in enumerate(cavDat):
+            cavData = np.asarray(cavData, dtype=np.float64)
+            cavData = cavData[~np.isnan(cavData)]
+            if self.uniform:
+                idx = np.floor((cavData - lo) * (self.numBins / (hi - lo)))
+            else:
+                idx = np.searchsorted(self.edges, cavData, side='right') - 1
+            # the last bin includes its right edge, like np.histogram
+            idx[cavData == hi] = self.numBins - 1
+            under = idx < 0
+            over = idx >= self.numBins
+            self.underflow[col] += np.count_nonzero(under)
+            self.overflow[col] += np.count_nonzero(over)
+            inRange = idx[~(under | over)].astype(np.intp)
+            self.counts[:, col] += np.bincount(inRange, minlength=self.numBins)
+        return self
+
+    def merge(self, other):
+        if not np.array_equal(self.edges, other.edges):
+            raise ValueError('Histograms with different bin edges cannot be merged')
+        if other.counts is not None:
+            self.grow(other.counts.shape[1])
+            numCavs = other.counts.shape[1]
+            self.counts[:, :numCavs] += other.counts
+            self.underflow[:numCavs] += other.underflow
+            self.overflow[:numCavs] += other.overflow
+        return self
+
+    def save(self, fileName):
+        np.savez(fileName, edges=self.edges, counts=self.counts, underflow=self.underflow,
+                 overflow=self.overflow)
+
+    @classmethod
+    def load(cls, fileName):
+        with np.load(fileName) as saved:
+            hist = cls(saved['edges'])
+            hist.counts = saved['counts']
+            hist.underflow = saved['underflow']
+            hist.overflow = saved['overflow']
+        return hist
+
+
+# fixedHistEdges are the bins shared by every file, so their counts can merge
+
+def fixedHistEdges(limit=DETUNE_HIST_LIMIT, binWidth=DETUNE_HIST_BIN):
+    return np.linspace(-limit, limit, int(round(2 * limit / binWidth)) + 1)
+
+
+# dataHistEdges spans the data of all the cavities with the same bins, like
+#  hist(bins=140) but shared across cavities
+
+def dataHistEdges(cavDataList, bins=140):
+    lo = min(np.nanmin(cavData) for cavData in cavDataList)
+    hi = max(np.nanmax(cavData) for cavData in cavDataList)
+    if lo == hi:
+        lo, hi = lo - 0.5, hi + 0.5
+    return np.linspace(lo, hi, bins + 1)
+
+
+def cavHistograms(cavDataList, edges=None, bins=140):
+    if edges is None:
+        edges = dataHistEdges(cavDataList, bins)
+    return DetuneHistogram(edges).add(cavDataList)
+
+
+# cavStats summarizes the detune of one cavity
+
+def cavStats(cavData):
+    cavData = np.asarray(cavData)
+    stats = {'samples': len(cavData),
+             'mean': float(np.mean(cavData)),
+             'std': float(np.std(cavData)),
+             'rms': float(np.sqrt(np.mean(np.square(cavData)))),
+             'peak': float(np.max(np.abs(cavData))),
+             'min': float(np.min(cavData)),
+             'max': float(np.max(cavData))}
+    for pct, value in zip(STAT_PERCENTILES, np.percentile(cavData, STAT_PERCENTILES)):
+        stats['p{:02d}'.format(pct)] = float(value)
+    return stats
+
+
+# dominantMode is the strongest line of a spectrum between DC and maxFreq
+
+def dominantMode(freqs, amplitude, maxFreq=MAX_MODE_FREQ):
+    inBand = (freqs > 0) & (freqs <= maxFreq)
+    if not inBand.any():
+        return float('nan'), float('nan')
+    idx = np.argmax(np.where(inBand, amplitude, -np.inf))
+    return float(freqs[idx]), float(amplitude[idx])
+
+
+# findCavDatFiles walks rootDir/ACCL_LxB_CM00/yyyy/mm/dd/ and yields the path of
+#  every data file with a date from startDate to endDate (datetime.date or None).
+#  With preferBinary a text file that has a binary version is left out
+
+def findCavDatFiles(rootDir=DATA_DIR_PATH, startDate=None, endDate=None, preferBinary=True):
+    first = (startDate.year, startDate.month, startDate.day) if startDate is not None else None
+    last = (endDate.year, endDate.month, endDate.day) if endDate is not None else None
+
+    def inRange(parts):
+        # parts is (yyyy,), (yyyy, mm) or (yyyy, mm, dd), so a whole year or
+        #  month outside the range is never walked
+        return ((first is None or parts >= first[:len(parts)]) and
+                (last is None or parts <= last[:len(parts)]))
+
+    for cmDir in sorted(listdir(rootDir)):
+        cmPath = path.join(rootDir, cmDir)
+        if not cmDir.startswith('ACCL_') or not path.isdir(cmPath):
+            continue
+        for dirPath, dirNames, fileNames in walk(cmPath):
+            relPath = path.relpath(dirPath, cmPath)
+            parts = () if relPath == '.' else tuple(int(part) for part in relPath.split(sep))
+            # only walk the yyyy/mm/dd directories, not the sidecars
+            if len(parts) < 3:
+                dirNames[:] = sorted(d for d in dirNames if d.isdigit() and inRange(parts + (int(d),)))
+                continue
+            dirNames[:] = []
+            for fileName in sorted(fileNames):
+                # a text file that has been converted is only listed once, as binary
+                if preferBinary and binaryPath(fileName) != fileName and binaryPath(fileName) in fileNames:
+                    continue
+                if fileName.startswith('res_') or fileName.endswith(('_microphonics.dat', '_microphonics.npz')):
+                    yield path.join(dirPath, fileName)
+
+
+def sidecarPath(fileName):
+    dirName, baseName = path.split(path.abspath(fileName))
+    return path.join(dirName, '.' + baseName + SIDECAR_SUFFIX)
+
+
+# readSidecar returns (cavDataList, header_Data) with each cavity memory-mapped
+#  from the sidecar, or None if there is no sidecar or the data file has
+#  changed (mtime or size) since the sidecar was written
+
+def readSidecar(fileName):
+    sidecar = sidecarPath(fileName)
+    metaFile = path.join(sidecar, SIDECAR_META)
+    try:
+        with open(metaFile) as f:
+            meta = json.load(f)
+        fileStat = stat(fileName)
+        if meta['mtime_ns'] != fileStat.st_mtime_ns or meta['size'] != fileStat.st_size:
+            return None
+        cavDataList = [np.load(path.join(sidecar, 'cav{}.npy'.format(col)), mmap_mode='r')
+                       for col in range(meta['numCavs'])]
+    except (OSError, ValueError, KeyError):
+        return None
+
+    # the meta file mtime is the last use for evictSidecars
+    try:
+        utime(metaFile)
+    except OSError:
+        pass
+    return cavDataList, meta['header']
+
+
+def writeSidecar(fileName, cavDataList, header_Data):
+    fileStat = stat(fileName)
+    sidecar = sidecarPath(fileName)
+    # write into a temporary directory and rename it into place so a reader
+    #  never sees half a sidecar
+    tmpDir = mkdtemp(prefix=path.basename(sidecar) + '.', dir=path.dirname(sidecar))
+    try:
+        for col, cavData in enumerate(cavDataList):
+            np.save(path.join(tmpDir, 'cav{}.npy'.format(col)), np.ascontiguousarray(cavData))
+        meta = {'mtime_ns': fileStat.st_mtime_ns, 'size': fileStat.st_size,
+                'numCavs': len(cavDataList), 'header': header_Data}
+        with open(path.join(tmpDir, SIDECAR_META), 'w') as f:
+            json.dump(meta, f)
+        if path.exists(sidecar):
+            rmtree(sidecar)
+        rename(tmpDir, sidecar)
+    except OSError:
+        rmtree(tmpDir, ignore_errors=True)
+        raise
+    return sidecar
+
+
+# bytes of sidecars under each cache root, from its last evictSidecars walk
+#  plus the sidecars written since, so the tree is only walked once per
+#  session and again when the total goes over the limit
+_sidecarBytes = {}
+
+
+# evictSidecars removes the least recently used sidecars under rootDir
+#  (DATA_DIR_PATH by default) until they take up no more than maxBytes.
+#  Returns the number of bytes freed
+
+def evictSidecars(rootDir=None, maxBytes=SIDECAR_MAX_BYTES):
+    if rootDir is None:
+        rootDir = DATA_DIR_PATH
+    sidecars = []
+    totalBytes = 0
+    for dirPath, dirNames, fileNames in walk(rootDir):
+        for dirName in [d for d in dirNames if d.endswith(SIDECAR_SUFFIX)]:
+            # don't walk into the sidecars themselves
+            dirNames.remove(dirName)
+            sidecar = path.join(dirPath, dirName)
+            try:
+                lastUsed = stat(path.join(sidecar, SIDECAR_META)).st_mtime
+            except OSError:
+                # unfinished or broken, evict first
+                lastUsed = 0
+            size = sum(path.getsize(fileName) for fileName in _listFiles(sidecar))
+            sidecars.append((lastUsed, size, sidecar))
+            totalBytes += size
+
+    freed = 0
+    for lastUsed, size, sidecar in sorted(sidecars):
+        if totalBytes - freed <= maxBytes:
+            break
+        rmtree(sidecar, ignore_errors=True)
+        freed += size
+    _sidecarBytes[rootDir] = totalBytes - freed
+    return freed
+
+
+def _listFiles(dirName):
+    for dirPath, dirNames, fileNames in walk(dirName):
+        for fileName in fileNames:
+            yield path.join(dirPath, fileName)
+
+
+# loadCavDatCached is the cached version of loadCavDat + cavDatColumns.
+#  The first load parses the text file and writes the sidecar, later loads
+#  memory-map the sidecar as long as the data file hasn't changed. The
+#  sidecars under cacheRoot (DATA_DIR_PATH by default) are kept below maxBytes
+
+def loadCavDatCached(fileName, dtype=np.float64, cacheRoot=None, maxBytes=SIDECAR_MAX_BYTES):
+    if cacheRoot is None:
+        cacheRoot = DATA_DIR_PATH
+    # binary files load about as fast as a sidecar, they don't get one
+    if isCavDatBinary(fileName):
+        cavDat, header_Data = readCavDatBinary(fileName, dtype)
+        return cavDatColumns(cavDat), header_Data
+
+    cached = readSidecar(fileName)
+    if cached is not None:
+        return cached
+
+    cavDat, header_Data = loadCavDat(fileName, dtype=dtype)
+    cavDataList = cavDatColumns(cavDat)
+    try:
+        sidecar = writeSidecar(fileName, cavDataList, header_Data)
+        if cacheRoot in _sidecarBytes:
+            _sidecarBytes[cacheRoot] += sum(path.getsize(name) for name in _listFiles(sidecar))
+        if path.isdir(cacheRoot) and _sidecarBytes.get(cacheRoot, maxBytes + 1) > maxBytes:
+            evictSidecars(cacheRoot, maxBytes)
+    except OSError as e:
+        # read-only data directory or full disk, the data is still good
+        print('Could not cache {}: {}'.format(fileName, e))
+    return cavDataList, header_Data
+
+
+# binaryPath is the name of the binary version of a text data file,
+#  res_CM01_cav1234_c1_20220601_120000.npz or ..._microphonics.npz
+
+def binaryPath(fileName):
+    if fileName.endswith(BINARY_SUFFIX):
+        return fileName
+    if fileName.endswith('.dat'):
+        fileName = fileName[:-len('.dat')]
+    return fileName + BINARY_SUFFIX
+
+
+def isCavDatBinary(fileName):
+    # .npz files are zip archives
+    with open(fileName, 'rb') as f:
+        return f.read(4) == b'PK\x03\x04'
+
+
+# writeCavDatBinary writes (n_samples, n_cavities) data and the header lines
+#  of a text file to a binary file. compress deflates the arrays (slower to
+#  read, about half the size again). The file is written under a temporary
+#  name and renamed, so readers never see half a file
+
+def writeCavDatBinary(fileName, cavDat, header_Data, compress=False, dtype=BINARY_DTYPE,
+                      chunkRows=BINARY_CHUNK_ROWS, skipped=None):
+    cavDat = np.asarray(cavDat, dtype=dtype)
+    arrays = {'header': np.array(header_Data, dtype=str)}
+    if skipped is not None:
+        arrays['skipped'] = np.array(skipped, dtype=str)
+    for idx, start in enumerate(range(0, max(len(cavDat), 1), chunkRows)):
+        arrays['data{:05d}'.format(idx)] = cavDat[start:start + chunkRows]
+
+    dirName, baseName = path.split(path.abspath(fileName))
+    tmpName = path.join(dirName, '.{}.{}.tmp'.format(baseName, getpid()))
+    try:
+        with open(tmpName, 'wb') as f:
+            if compress:
+                np.savez_compressed(f, **arrays)
+            else:
+                np.savez(f, **arrays)
+        rename(tmpName, fileName)
+    except BaseException:
+        remove(tmpName)
+        raise
+    return fileName
+
+
+# iterCavDatBinary yields a binary file in blockSize blocks like iterCavDat,
+#  loading one chunk of the file at a time
+
+def iterCavDatBinary(fileName, blockSize=BUFFER_LENGTH, dtype=np.float64):
+    with np.load(fileName) as npz:
+        for name in sorted(name for name in npz.files if name.startswith('data')):
+            chunk = npz[name]
+            for start in range(0, len(chunk), blockSize):
+                yield chunk[start:start + blockSize].astype(dtype)
+
+
+def readCavDatBinary(fileName, dtype=np.float64):
+    with np.load(fileName) as npz:
+        header_Data = list(npz['header'])
+        chunks = [npz[name] for name in sorted(name for name in npz.files if name.startswith('data'))]
+    if len(chunks) == 1:
+        return chunks[0].astype(dtype, copy=False), header_Data
+    return np.concatenate(chunks).astype(dtype, copy=False), header_Data
+
+
+# convertCavDat writes the binary version of text data file fileName and
+#  checks it reads back the values of the text file, to the precision of
+#  dtype. Returns the binary file name.
+#  ioLock is held for the reads and the write, as in iterCavDat
+
+def convertCavDat(fileName, outName=None, compress=False, dtype=BINARY_DTYPE, ioLock=None):
+    if outName is None:
+        outName = binaryPath(fileName)
+    skipped = []
+    with ioLock if ioLock is not None else nullcontext():
+        with open(fileName) as f:
+            readCavHeader(f, skipped)
+    # the text values at full precision, to check the binary against
+    textDat, header_Data = loadCavDat(fileName, dtype=np.float64, ioLock=ioLock)
+    with ioLock if ioLock is not None else nullcontext():
+        writeCavDatBinary(outName, textDat, header_Data, compress, dtype, skipped=skipped)
+        check, checkHeader = readCavDatBinary(outName, np.float64)
+        with np.load(outName) as npz:
+            checkSkipped = list(npz['skipped'])
+    # dtype rounds each value by at most half its eps
+    if (checkHeader != header_Data or checkSkipped != skipped or check.shape != textDat.shape or
+            not np.allclose(check, textDat, rtol=np.finfo(dtype).eps, atol=0, equal_nan=True)):
+        remove(outName)
+        raise ValueError('{} did not read back the same as {}'.format(outName, fileName))
+    return outName
+
+
+# CavDatCache keeps the most recently used files as loaded by
+#  loadCavDatCached, (cavDataList, header_Data), and results computed from
+#  them (spectra, histograms...) with derived(). Entries are keyed by path,
+#  mtime and size, so a file that has been rewritten is read again, and the
+#  least recently used are dropped to stay within maxBytes and maxEntries.
+#  Arrays memory-mapped from a sidecar don't count towards maxBytes, the OS
+#  can drop those pages itself.
+#  get() can be called from several threads, getMany() loads the files it
+#  doesn't have in a thread pool
+
+class CavDatCache:
+
+    def __init__(self, maxBytes=CACHE_MAX_BYTES, maxEntries=CACHE_MAX_ENTRIES, loader=loadCavDatCached):
+        self.maxBytes = maxBytes
+        self.maxEntries = maxEntries
+        self.loader = loader
+        # key -> (value, bytes)
+        self.entries = OrderedDict()
+        self.totalBytes = 0
+        self.lock = Lock()
+        # kind ('data', 'spectra', ...) -> [hits, misses]
+        self.counts = {}
+
+    @staticmethod
+    def fileKey(fileName):
+        fileStat = stat(fileName)
+        return path.abspath(fileName), fileStat.st_mtime_ns, fileStat.st_size
+
+    def lookup(self, key, kind):
+        with self.lock:
+            counts = self.counts.setdefault(kind, [0, 0])
+            if key in self.entries:
+                counts[0] += 1
+                self.entries.move_to_end(key)
+                return True, self.entries[key][0]
+            counts[1] += 1
+            return False, None
+
+    def store(self, key, value):
+        numBytes = residentBytes(value)
+        with self.lock:
+            if key in self.entries:
+                self.totalBytes -= self.entries.pop(key)[1]
+            # something bigger than the whole budget isn't kept at all
+            if numBytes > self.maxBytes:
+                return value
+            self.entries[key] = (value, numBytes)
+            self.totalBytes += numBytes
+            while self.totalBytes > self.maxBytes or len(self.entries) > self.maxEntries:
+                self.totalBytes -= self.entries.popitem(last=False)[1][1]
+        return value
+
+    def get(self, fileName):
+        key = (self.fileKey(fileName), 'data')
+        found, value = self.lookup(key, 'data')
+        if found:
+            return value
+        return self.store(key, self.loader(fileName))
+
+    # derived returns compute() for fileName, computed once while it stays in
+    #  the cache. params is a tuple naming the result and everything it
+    #  depends on besides the file, its first item counts as the kind
+
+    def derived(self, fileName, params, compute):
+        key = (self.fileKey(fileName), params)
+        found, value = self.lookup(key, params[0])
+        if found:
+            return value
+        return self.store(key, compute())
+
+    def getMany(self, fileNames, threads=CACHE_THREADS):
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            return list(pool.map(self.get, fileNames))
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'bytes': self.totalBytes, 'maxBytes': self.maxBytes,
+                    'counts': {kind: tuple(counts) for kind, counts in self.counts.items()}}
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.totalBytes = 0
+
+
+# residentBytes is the memory the arrays in value (nested in tuples, lists
+#  and dicts) take up, not counting memory-mapped ones
+
+def residentBytes(value):
+    if isinstance(value, np.memmap):
+        return 0
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (tuple, list)):
+        return sum(residentBytes(item) for item in value)
+    if isinstance(value, dict):
+        return sum(residentBytes(item) for item in value.values())
+    if hasattr(value, '__slots__') or hasattr(value, '__dict__'):
+        # DetuneHistogram and the like
+        return sum(residentBytes(getattr(value, name, None))
+                   for name in getattr(value, '__slots__', None) or vars(value))
+    return 0
+
+
+# mergeCavDat lines up files taken at the same time on different chassis
+#  (RESA and RESB of a cryomodule) and puts their cavities side by side.
+#  parts are (cavDataList, header_Data) of each file. The files are aligned
+#  on their header timestamps and cut to the samples they all have.
+#  Returns (cavDat, header_Data) with the cavities in the order of parts
+
+def mergeCavDat(parts):
+    headers = [parseCavHeader(header_Data) for cavDataList, header_Data in parts]
+    samplingRates = {header.samplingRate for header in headers}
+    if len(samplingRates) != 1 or None in samplingRates:
+        raise ValueError('Files to merge need the same sampling rate, not {}'.format(samplingRates))
+    samplingRate = samplingRates.pop()
+    if any(header.timestamp is None for header in headers):
+        raise ValueError('Files to merge need timestamps in their headers')
+
+    # the file that started last sets the start, the others skip ahead to it
+    start = max(header.timestamp for header in headers)
+    columns = []
+    for (cavDataList, header_Data), header in zip(parts, headers):
+        skip = int(round((start - header.timestamp).total_seconds() * samplingRate))
+        columns += [np.asarray(cavData)[skip:] for cavData in cavDataList]
+    numSamples = min(len(cavData) for cavData in columns)
+    cavDat = np.column_stack([cavData[:numSamples] for cavData in columns])
+
+    # one timestamp, every file's cavity settings, then all the PVs
+    header_Data = ['# ' + start.isoformat() + '\n']
+    pvs = []
+    for cavDataList, fileHeader in parts:
+        inSettings = False
+        for lini in fileHeader[:-1]:
+            text = lini.lstrip('#').strip()
+            inSettings = inSettings or text.startswith('## Cavity')
+            if inSettings and text != '':
+                header_Data.append(lini)
+        pvs.append(fileHeader[-1].lstrip('#').strip())
+    header_Data += ['# \n', '\n', '# ' + ' '.join(pvs) + '\n']
+    return cavDat, header_Data
+
+
+# writeCavHeader writes a header laid out like the one res_data_acq.py writes,
+#  cmPrefix is like 'ACCL:L1B:02' and cavities like '1234'
+
+def writeCavHeader(f, cmPrefix, cavities, decimation, timestamp=None, channel='DF'):
+    if timestamp is None:
+        timestamp = datetime.now()
+    f.write('# ' + timestamp.isoformat() + '\n')
+    for cav in cavities:
+        f.write('# ## Cavity {}\n'.format(cav))
+        f.write('# wave_samp_per : {}\n'.format(decimation))
+        f.write('# wave_shift : 1\n# chan_keep : 300\n# chirp_en : 0\n# chirp_acq_per : 0\n')
+    f.write('# \n\n')
+    f.write('# ' + ' '.join('{}{}0:PZT:{}:WF'.format(cmPrefix, cav, channel) for cav in cavities) + '\n')
+
+
+# writeCavDat writes (n_samples, n_cavities) data in the fixed width columns
+#  parseCavDat reads
+
+def writeCavDat(f, cavDat):
+    np.savetxt(f, np.atleast_2d(cavDat), fmt='%8.3f', delimiter='  ')
+
+
 def dummyFileCreator(pathToDatafile):
     #    print(pathToDatafile)
     data, Header = readCavDat("1234_20210617_1227")
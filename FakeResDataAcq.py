@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+Stand-in for res_data_acq.py on dev machines
+
+Takes the same arguments as the real script, prints a line per buffer and
+writes a synthetic data file one buffer at a time at the real acquisition
+pace (or --speed times faster), so the live view and the job queue can be
+tried without a resonance chassis:
+
+    RES_DATA_ACQ_SCRIPT=$PWD/FakeResDataAcq.py pydm CommMicro.py
+"""
+import argparse
+import sys
+import time
+from os import path
+
+import numpy as np
+
+import FFt_math
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Fake resonance chassis data acquisition')
+    parser.add_argument('-D', dest='dataDir', required=True)
+    parser.add_argument('-a', dest='chassis', required=True, help='ca://ACCL:L1B:0200:RESA:')
+    parser.add_argument('-wsp', dest='decimation', type=int, default=1)
+    parser.add_argument('-acav', dest='cavities', nargs='+', required=True)
+    parser.add_argument('-ch', dest='channel', default='DF')
+    parser.add_argument('-c', dest='buffers', type=int, default=1)
+    parser.add_argument('-F', dest='outFile', required=True)
+    parser.add_argument('--speed', type=float, default=1.0, help='run this many times faster than real time')
+    parser.add_argument('--fail', action='store_true', help='exit with an error half way through')
+    args = parser.parse_args(argv)
+
+    # ca://ACCL:L1B:0200:RESA: -> ACCL:L1B:02
+    fields = args.chassis.replace('ca://', '').split(':')
+    cmPrefix = ':'.join(fields[:2] + [fields[2][:2]])
+    cavities = ''.join(args.cavities)
+
+    samplingRate = FFt_math.DEFAULT_SAMPLING_RATE / args.decimation
+    bufferTime = FFt_math.BUFFER_LENGTH / samplingRate / args.speed
+    rng = np.random.default_rng()
+    t = np.arange(FFt_math.BUFFER_LENGTH) / samplingRate
+
+    fileName = path.join(args.dataDir, args.outFile)
+    print('Writing {}'.format(fileName))
+    with open(fileName, 'w') as f:
+        FFt_math.writeCavHeader(f, cmPrefix, cavities, args.decimation, channel=args.channel)
+        f.flush()
+        for buf in range(args.buffers):
+            time.sleep(bufferTime)
+            if args.fail and buf >= args.buffers // 2:
+                print('Lost connection to chassis', file=sys.stderr)
+                return 1
+            tBuf = t + buf * FFt_math.BUFFER_LENGTH / samplingRate
+            # a 60 Hz pump line and a mechanical mode per cavity over noise
+            cavDat = np.column_stack([
+                3 * np.sin(2 * np.pi * 60 * tBuf) + 5 * np.sin(2 * np.pi * (20 + 3 * idx) * tBuf) +
+                rng.normal(0.0, 2.0, len(tBuf)) for idx in range(len(cavities))])
+            FFt_math.writeCavDat(f, cavDat)
+            f.flush()
+            print('Buffer {} of {}'.format(buf + 1, args.buffers))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""
+Headless batch analysis of the microphonics data tree
+
+Walks DATA_DIR_PATH/ACCL_LxB_CM00/yyyy/mm/dd/, and for every data file in
+the date range computes per-cavity detune statistics and the dominant mode
+of the spectrum in a process pool. Writes a CSV summary with one row per
+cavity, and optionally a PNG (histogram + spectrum) and an .npz spectrum
+per file. --modes writes the MicModes modes of every cavity (frequency,
+amplitude, Q and drift) to a second CSV with one row per mode.
+
+    python MicBatch.py --start 2022-06-01 --end 2022-06-30 -o june.csv --png june_png
+    python MicBatch.py --start 2022-06-01 --end 2022-06-30 --modes june_modes.csv
+"""
+import argparse
+import csv
+import sys
+from datetime import datetime
+from functools import partial
+from multiprocessing import Pool, cpu_count
+from os import makedirs, path
+
+import numpy as np
+
+# FFt_math has the readers and the math
+import FFt_math
+import MicModes
+
+SUMMARY_FIELDS = ['file', 'cm', 'timestamp', 'cavity', 'sampling_rate', 'samples', 'mean', 'std', 'rms',
+                  'peak', 'min', 'max'] + ['p{:02d}'.format(pct) for pct in FFt_math.STAT_PERCENTILES] + \
+                 ['mode_freq', 'mode_amp', 'error']
+MODES_FIELDS = ['file', 'cm', 'timestamp', 'cavity'] + MicModes.MODE_FIELDS
+
+
+# analyzeFile runs in the pool workers, it returns the summary rows of one file.
+#  welchSegment > 0 uses Welch averaged spectra instead of one full-length FFT.
+#  fftWorkers is 1 by default since the pool already keeps every core busy.
+#  With histEdges each row also carries the cavity's DetuneHistogram, and
+#  with numModes > 0 the list of the cavity's modes
+
+def analyzeFile(fileName, decimation=2, useCache=False, pngDir=None, spectraDir=None, welchSegment=0,
+                fftWorkers=1, histEdges=None, numModes=0):
+    # the cryomodule is the ACCL_ directory the file is in, not its own name
+    cm = ''
+    for part in fileName.split(path.sep)[:-1]:
+        if part.startswith('ACCL_'):
+            cm = part
+    try:
+        if useCache:
+            cavDataList, header_Data = FFt_math.loadCavDatCached(fileName)
+        else:
+            cavDat, header_Data = FFt_math.loadCavDat(fileName)
+            cavDataList = FFt_math.cavDatColumns(cavDat)
+        header = FFt_math.parseCavHeader(header_Data)
+    except (OSError, ValueError) as e:
+        return [{'file': fileName, 'cm': cm, 'error': str(e)}]
+    if not any(len(cavData) > 0 for cavData in cavDataList):
+        return [{'file': fileName, 'cm': cm, 'error': 'no data'}]
+    try:
+        return analyzeData(fileName, cm, cavDataList, header, decimation, pngDir, spectraDir, welchSegment,
+                           fftWorkers, histEdges, numModes)
+    except Exception as e:
+        # one bad file goes on its row rather than stopping the whole run
+        return [{'file': fileName, 'cm': cm, 'error': '{}: {}'.format(type(e).__name__, e)}]
+
+
+# analyzeData makes the summary rows of the loaded cavDataList of fileName
+
+def analyzeData(fileName, cm, cavDataList, header, decimation, pngDir, spectraDir, welchSegment, fftWorkers,
+                histEdges, numModes):
+    samplingRate = header.samplingRate
+    if samplingRate is None:
+        samplingRate = FFt_math.DEFAULT_SAMPLING_RATE / decimation
+    timestamp = header.timestamp.isoformat() if header.timestamp is not None else ''
+    cavities = FFt_math.cavityNumbers(fileName, header, len(cavDataList))
+
+    # all cavities of the file go through one FFT call
+    hasData = [len(cavData) > 0 for cavData in cavDataList]
+    cavities = [cavity for cavity, keep in zip(cavities, hasData) if keep]
+    cavDataList = [cavData for cavData, keep in zip(cavDataList, hasData) if keep]
+    spectra = dict(zip(cavities, FFt_math.cavListSpectra(cavDataList, samplingRate, welchSegment, fftWorkers)))
+    cavModes = {}
+    if numModes > 0 and len(cavDataList) > 0:
+        cavModes = dict(zip(cavities, MicModes.analyzeModes(cavDataList, samplingRate, numModes,
+                                                            workers=fftWorkers)))
+
+    rows = []
+    for cavity, cavData in zip(cavities, cavDataList):
+        freqs, amplitude = spectra[cavity]
+        modeFreq, modeAmp = FFt_math.dominantMode(freqs, amplitude)
+        row = {'file': fileName, 'cm': cm, 'timestamp': timestamp, 'cavity': cavity,
+               'sampling_rate': samplingRate, 'mode_freq': modeFreq, 'mode_amp': modeAmp, 'error': ''}
+        row.update(FFt_math.cavStats(cavData))
+        if histEdges is not None:
+            # counts on the shared bins, merged per cavity by main()
+            row['hist'] = FFt_math.DetuneHistogram(histEdges).add(cavData)
+        if cavity in cavModes:
+            row['modes'] = cavModes[cavity]
+        rows.append(row)
+
+    baseName = path.basename(fileName)
+    if spectraDir is not None and len(spectra) > 0:
+        arrays = {}
+        for cavity, (freqs, amplitude) in spectra.items():
+            inBand = freqs <= FFt_math.MAX_MODE_FREQ
+            arrays['freq_cav{}'.format(cavity)] = freqs[inBand]
+            arrays['amp_cav{}'.format(cavity)] = amplitude[inBand]
+        np.savez(path.join(spectraDir, baseName + '.npz'), **arrays)
+    if pngDir is not None and len(spectra) > 0:
+        savePlot(path.join(pngDir, baseName + '.png'), baseName, cavities, cavDataList, spectra)
+    return rows
+
+
+# savePlot draws the same two plots as MicDisp.getDataBack into a PNG
+
+def savePlot(pngName, title, cavities, cavDataList, spectra):
+    # imported here so runs without --png don't need matplotlib
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(10, 8), dpi=100, tight_layout=True)
+    FigureCanvasAgg(fig)
+    tAxes = fig.add_subplot(211)
+    bAxes = fig.add_subplot(212)
+    leGend = []
+    for cavity, cavData in zip(cavities, cavDataList):
+        leGend.append('Cav' + str(cavity))
+        freqs, amplitude = spectra[cavity]
+        bAxes.plot(freqs, amplitude)
+    hist = FFt_math.cavHistograms(cavDataList, bins=140)
+    for col in range(hist.counts.shape[1]):
+        tAxes.stairs(hist.counts[:, col], hist.edges)
+    tAxes.set_yscale('log')
+
+    tAxes.set_title(title, loc='left', fontsize='small')
+    tAxes.set_ylim(bottom=1)
+    tAxes.set_xlabel('Detune (Hz)')
+    tAxes.set_ylabel('Counts')
+    tAxes.grid(True)
+    tAxes.legend(leGend)
+    bAxes.set_xlim(0, FFt_math.MAX_MODE_FREQ)
+    bAxes.set_xlabel('Frequency (Hz)')
+    bAxes.set_ylabel('Relative Amplitude')
+    bAxes.grid(True)
+    bAxes.legend(leGend)
+    fig.savefig(pngName)
+
+
+# saveHistograms merges the per-file histograms into one per CM and cavity and
+#  saves them as counts_<cm>_cav<n> arrays next to the shared edges
+
+def saveHistograms(fileName, rows):
+    merged = {}
+    for row in rows:
+        if 'hist' in row:
+            key = '{}_cav{}'.format(row['cm'], row['cavity'])
+            if key in merged:
+                merged[key].merge(row['hist'])
+            else:
+                merged[key] = row['hist']
+    arrays = {'edges': FFt_math.fixedHistEdges()}
+    for key, hist in merged.items():
+        arrays['counts_' + key] = hist.counts[:, 0]
+        arrays['outside_' + key] = np.array([hist.underflow[0], hist.overflow[0]])
+    np.savez(fileName, **arrays)
+
+
+# saveModes writes one row per mode of every cavity
+
+def saveModes(fileName, rows):
+    with open(fileName, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=MODES_FIELDS)
+        writer.writeheader()
+        for row in rows:
+            for mode in row.get('modes', []):
+                writer.writerow(dict({key: row[key] for key in ('file', 'cm', 'timestamp', 'cavity')}, **mode))
+
+
+def parseDate(text):
+    return datetime.strptime(text, '%Y-%m-%d').date()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Batch analysis of microphonics data files')
+    parser.add_argument('files', nargs='*', help='data files to analyze instead of walking --root')
+    parser.add_argument('--root', default=FFt_math.DATA_DIR_PATH, help='top of the data tree')
+    parser.add_argument('--start', type=parseDate, help='first day to include, yyyy-mm-dd')
+    parser.add_argument('--end', type=parseDate, help='last day to include, yyyy-mm-dd')
+    parser.add_argument('-o', '--output', default='microphonics_summary.csv', help='summary CSV file')
+    parser.add_argument('--png', metavar='DIR', help='write a histogram/spectrum PNG per file to DIR')
+    parser.add_argument('--spectra', metavar='DIR', help='write the 0-150 Hz spectra per file to DIR as .npz')
+    parser.add_argument('--decimation', type=int, default=2,
+                        help='decimation for files without wave_samp_per in the header')
+    parser.add_argument('--welch', action='store_true', help='use Welch averaged spectra instead of one FFT')
+    parser.add_argument('--welch-segment', type=int, default=FFt_math.BUFFER_LENGTH, metavar='SAMPLES',
+                        help='samples per Welch segment (default one buffer)')
+    parser.add_argument('--fft-workers', type=int, default=1, help='scipy.fft threads per worker process')
+    parser.add_argument('--hist', metavar='FILE',
+                        help='add up the detune histograms of every CM/cavity into FILE (.npz)')
+    parser.add_argument('--modes', metavar='FILE', help='write the modes of every cavity to FILE (.csv)')
+    parser.add_argument('--num-modes', type=int, default=MicModes.NUM_MODES, help='modes per cavity for --modes')
+    parser.add_argument('--cache', action='store_true', help='read and write the .npcache sidecars')
+    parser.add_argument('-j', '--processes', type=int, default=cpu_count(), help='worker processes')
+    args = parser.parse_args(argv)
+
+    if len(args.files) > 0:
+        fileNames = args.files
+    else:
+        fileNames = list(FFt_math.findCavDatFiles(args.root, args.start, args.end))
+    print('{} files to analyze with {} processes'.format(len(fileNames), args.processes))
+
+    for outDir in (args.png, args.spectra):
+        if outDir is not None:
+            makedirs(outDir, exist_ok=True)
+
+    worker = partial(analyzeFile, decimation=args.decimation, useCache=args.cache,
+                     pngDir=args.png, spectraDir=args.spectra, welchSegment=args.welch_segment if args.welch else 0,
+                     fftWorkers=args.fft_workers,
+                     histEdges=FFt_math.fixedHistEdges() if args.hist is not None else None,
+                     numModes=args.num_modes if args.modes is not None else 0)
+    rows = []
+    errors = 0
+    with Pool(args.processes) as pool:
+        for done, fileRows in enumerate(pool.imap_unordered(worker, fileNames), 1):
+            rows += fileRows
+            for row in fileRows:
+                if row.get('error'):
+                    errors += 1
+                    print('{}: {}'.format(row['file'], row['error']), file=sys.stderr)
+            print('\r{}/{} files'.format(done, len(fileNames)), end='', flush=True)
+    print()
+
+    rows.sort(key=lambda row: (row['file'], row.get('cavity', 0)))
+    if args.hist is not None:
+        saveHistograms(args.hist, rows)
+    if args.modes is not None:
+        saveModes(args.modes, rows)
+    with open(args.output, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=SUMMARY_FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(rows)
+    print('{} rows written to {}, {} files failed'.format(len(rows), args.output, errors))
+    return 0 if errors == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,492 @@
+# -*- coding: utf-8 -*-
+"""
+SQLite index of the microphonics data files
+
+update() walks DATA_DIR_PATH/ACCL_LxB_CM00/yyyy/mm/dd/ and records one row
+per data file: cryomodule, cavities, buffers and time from the file name
+(res_CM<cm>_cav<cavs>_c<buffers>_<yyyymmdd>_<hhmmss>, or the older
+ACCL_<linac>_<cm><cav>0_<yyyymmdd>_<hhmmss>_microphonics.dat) plus the
+decimation and sampling rate from the header. Files whose mtime and size
+haven't changed since the last update are skipped, so only new data is read.
+
+Unless update() is told not to, it also reads the data once and stores a
+summary per cavity in cavity_stats: the FFt_math.cavStats statistics and
+percentiles, the modes MicModes.findPeaks finds below MAX_MODE_FREQ and the
+detune histogram on the fixed bins. Trending a cavity or ranking all of them is then
+a query instead of re-reading the data.
+
+find() queries the files, e.g. all runs of CM16 cavity 3 at decimation 2 in May,
+trend() and rank() query the summaries, and survey() takes the latest file of
+every cryomodule and cavity on a day for a linac-wide grid of one statistic:
+
+    python MicIndex.py update --start 2022-05-01 -j 8
+    python MicIndex.py find --cm ACCL:L3B:16 --cavity 3 --decimation 2 --start 2022-05-01 --end 2022-05-31
+    python MicIndex.py trend --cm ACCL:L3B:16 --cavity 3 --field rms --start 2022-01-01
+    python MicIndex.py rank --field peak --start 2022-05-01 -n 20
+    python MicIndex.py survey --date 2022-05-31 --field rms -j 8
+"""
+import argparse
+import json
+import re
+import sqlite3
+import sys
+from datetime import datetime, timedelta
+from functools import partial
+from multiprocessing import Pool, cpu_count
+from os import environ, path, stat
+
+import numpy as np
+
+import FFt_math
+import MicModes
+
+# the index is a local file, SQLite locking isn't reliable over NFS
+INDEX_PATH = environ.get('MIC_INDEX_PATH', path.join(path.expanduser('~'), '.microphonics_index.sqlite'))
+
+# res_CM02_cav1234_c5_20220601_120000(.npz)
+RES_NAME = re.compile(r'res_CM(?P<cm>[^_]+)_cav(?P<cavities>\d+)_c(?P<buffers>\d+)_(?P<stamp>\d{8}_\d{6})')
+# ACCL_L3B_1680_20210624_202608_microphonics.dat
+OLD_NAME = re.compile(r'ACCL_(?P<linac>L\dB)_(?P<cm>\w\w)(?P<cavities>\d)0_(?P<stamp>\d{8}_\d{6})_microphonics')
+# the CM directory, ACCL_L1B_0200
+CM_DIR = re.compile(r'ACCL_(?P<linac>L\dB)_(?P<cm>\w\w)00$')
+
+# most spectral peaks kept per cavity
+NUM_PEAKS = MicModes.NUM_MODES
+
+# cavity_stats columns that trend() and rank() accept
+STAT_FIELDS = ['samples', 'mean', 'std', 'rms', 'peak', 'min', 'max'] + \
+              ['p{:02d}'.format(pct) for pct in FFt_math.STAT_PERCENTILES] + ['mode_freq', 'mode_amp']
+
+# the statistics the survey shows by default, and their names
+SURVEY_FIELDS = {'rms': 'RMS detune (Hz)', 'peak': 'Peak detune (Hz)', 'mode_freq': 'Dominant mode (Hz)'}
+CAVITIES_PER_CM = 8
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    cmid TEXT,
+    linac TEXT,
+    cm TEXT,
+    cavities TEXT,
+    buffers INTEGER,
+    timestamp TEXT,
+    decimation INTEGER,
+    sampling_rate REAL,
+    format TEXT,
+    size INTEGER,
+    mtime_ns INTEGER,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS files_cm_time ON files (cmid, timestamp);
+CREATE INDEX IF NOT EXISTS files_time ON files (timestamp);
+CREATE TABLE IF NOT EXISTS cavity_stats (
+    path TEXT,
+    cavity INTEGER,
+    {},
+    -- up to NUM_PEAKS peaks from MicModes.findPeaks as JSON lists, strongest first
+    peak_freqs TEXT,
+    peak_amps TEXT,
+    -- int64 counts on FFt_math.fixedHistEdges(), and the samples outside them
+    hist_counts BLOB,
+    hist_under INTEGER,
+    hist_over INTEGER,
+    PRIMARY KEY (path, cavity)
+);
+'''.format(',\n    '.join(field + ' REAL' for field in STAT_FIELDS))
+
+
+def openIndex(indexPath=INDEX_PATH):
+    db = sqlite3.connect(indexPath)
+    db.row_factory = sqlite3.Row
+    db.executescript(SCHEMA)
+    return db
+
+
+# parseFileName returns the fields the file name and its CM directory give,
+#  or an empty dict if neither follows the naming convention
+
+def parseFileName(fileName):
+    fields = {}
+    for part in fileName.split(path.sep)[:-1]:
+        match = CM_DIR.match(part)
+        if match:
+            fields.update(linac=match['linac'], cm=match['cm'])
+
+    baseName = path.basename(fileName)
+    match = RES_NAME.match(baseName) or OLD_NAME.match(baseName)
+    if match is None:
+        return fields
+    fields.update(match.groupdict())
+    fields['timestamp'] = datetime.strptime(fields.pop('stamp'), '%Y%m%d_%H%M%S').isoformat()
+    if 'buffers' in fields:
+        fields['buffers'] = int(fields['buffers'])
+    if 'linac' in fields:
+        fields['cmid'] = 'ACCL:{}:{}'.format(fields['linac'], fields['cm'])
+    return fields
+
+
+# fileRecord reads the header of fileName and returns its row for the files table
+
+def fileRecord(fileName, fileStat):
+    record = {'path': fileName, 'cmid': None, 'linac': None, 'cm': None, 'cavities': None, 'buffers': None,
+              'timestamp': None, 'decimation': None, 'sampling_rate': None, 'format': 'text',
+              'size': fileStat.st_size, 'mtime_ns': fileStat.st_mtime_ns, 'error': None}
+    record.update(parseFileName(fileName))
+    try:
+        if FFt_math.isCavDatBinary(fileName):
+            record['format'] = 'binary'
+        header = FFt_math.readCavDatHeader(fileName)
+    except (OSError, ValueError) as e:
+        record['error'] = str(e)
+        return record
+
+    if header.timestamp is not None:
+        record['timestamp'] = header.timestamp.isoformat()
+    # a cavity can have more than one channel (DAC and DF), each is listed once
+    cavities = list(dict.fromkeys(header.cavityNumbers()))
+    if record['cavities'] is None and len(cavities) > 0:
+        record['cavities'] = ''.join(str(cav) for cav in cavities)
+    settings = [header.cavities[cav] for cav in cavities if cav in header.cavities]
+    if len(settings) > 0:
+        record['decimation'] = settings[0].wave_samp_per
+    record['sampling_rate'] = header.samplingRate
+    return record
+
+
+# statsRecords reads the data of a file and returns its cavity_stats rows
+
+def statsRecords(fileName, decimation=2):
+    cavDat, header_Data = FFt_math.loadCavDat(fileName)
+    header = FFt_math.parseCavHeader(header_Data)
+    samplingRate = header.samplingRate
+    if samplingRate is None:
+        samplingRate = FFt_math.DEFAULT_SAMPLING_RATE / decimation
+    cavities = FFt_math.cavityNumbers(fileName, header, cavDat.shape[1])
+    cavDataList = [cavData[~np.isnan(cavData)] for cavData in FFt_math.cavDatColumns(cavDat)]
+    keep = [len(cavData) > 0 for cavData in cavDataList]
+    cavities = [cavity for cavity, ok in zip(cavities, keep) if ok]
+    cavDataList = [cavData for cavData, ok in zip(cavDataList, keep) if ok]
+
+    # Welch averaged spectra, the peaks stand out of the noise better
+    spectra = FFt_math.cavListSpectra(cavDataList, samplingRate, FFt_math.BUFFER_LENGTH)
+    hist = FFt_math.DetuneHistogram(FFt_math.fixedHistEdges()).add(cavDataList)
+    records = []
+    for col, (cavity, cavData, (freqs, amplitude)) in enumerate(zip(cavities, cavDataList, spectra)):
+        record = {'path': fileName, 'cavity': cavity}
+        record.update(FFt_math.cavStats(cavData))
+        record['mode_freq'], record['mode_amp'] = FFt_math.dominantMode(freqs, amplitude)
+        peaks = MicModes.findPeaks(freqs, amplitude, NUM_PEAKS)
+        found = peaks['bin'][:, 0] >= 0
+        record['peak_freqs'] = json.dumps(peaks['freq'][found, 0].tolist())
+        record['peak_amps'] = json.dumps(peaks['amp'][found, 0].tolist())
+        record['hist_counts'] = hist.counts[:, col].astype(np.int64).tobytes()
+        record['hist_under'] = int(hist.underflow[col])
+        record['hist_over'] = int(hist.overflow[col])
+        records.append(record)
+    return records
+
+
+# indexFile runs in the pool workers with update(processes > 1), it returns
+#  the files row and the cavity_stats rows of one file
+
+def indexFile(fileName, withStats=True):
+    try:
+        record = fileRecord(fileName, stat(fileName))
+    except OSError:
+        return None, []
+    statRows = []
+    if withStats and record['error'] is None:
+        try:
+            statRows = statsRecords(fileName, record['decimation'] or 2)
+        except (OSError, ValueError) as e:
+            record['error'] = str(e)
+        else:
+            # a file with only its header would otherwise be read again on every update
+            if len(statRows) == 0:
+                record['error'] = 'no data'
+    return record, statRows
+
+
+def insertRow(db, table, record):
+    db.execute('INSERT OR REPLACE INTO {} ({}) VALUES ({})'.format(
+        table, ', '.join(record), ', '.join('?' * len(record))), tuple(record.values()))
+
+
+# update brings the index up to date with the data files under rootDir from
+#  startDate to endDate, and drops the rows of files that are gone.
+#  withStats also reads the data of new and changed files for cavity_stats,
+#  and of indexed files that don't have their stats yet. processes > 1 does
+#  that in a process pool. Returns the number of files added or changed, and removed
+
+def update(db, rootDir=FFt_math.DATA_DIR_PATH, startDate=None, endDate=None, progress=None,
+           withStats=True, processes=1):
+    known = {row['path']: (row['size'], row['mtime_ns'], row['error'] is not None or row['has_stats'] == 1)
+             for row in db.execute('SELECT path, size, mtime_ns, error, '
+                                   'EXISTS (SELECT 1 FROM cavity_stats WHERE cavity_stats.path = files.path) '
+                                   'AS has_stats FROM files WHERE path LIKE ?', (path.join(rootDir, '') + '%',))}
+    seen = set()
+    todo = []
+    for fileName in FFt_math.findCavDatFiles(rootDir, startDate, endDate):
+        seen.add(fileName)
+        try:
+            fileStat = stat(fileName)
+        except OSError:
+            continue
+        size, mtime_ns, hasStats = known.get(fileName, (None, None, False))
+        if (size, mtime_ns) == (fileStat.st_size, fileStat.st_mtime_ns) and (hasStats or not withStats):
+            continue
+        todo.append(fileName)
+
+    worker = partial(indexFile, withStats=withStats)
+    pool = Pool(processes) if processes > 1 and len(todo) > 1 else None
+    changed = 0
+    try:
+        for record, statRows in (pool.imap_unordered(worker, todo) if pool is not None else map(worker, todo)):
+            if record is None:
+                continue
+            db.execute('DELETE FROM cavity_stats WHERE path = ?', (record['path'],))
+            insertRow(db, 'files', record)
+            for statRow in statRows:
+                insertRow(db, 'cavity_stats', statRow)
+            changed += 1
+            if progress is not None:
+                progress(changed, record['path'])
+            # commit now and then so a long first scan isn't lost if it's stopped
+            if changed % 100 == 0:
+                db.commit()
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+    # gone, or converted to binary since the last update
+    removed = [fileName for fileName in known if fileName not in seen and
+               (not path.exists(fileName) or FFt_math.binaryPath(fileName) in seen)]
+    for table in ('files', 'cavity_stats'):
+        db.executemany('DELETE FROM {} WHERE path = ?'.format(table), ((fileName,) for fileName in removed))
+    db.commit()
+    return changed, len(removed)
+
+
+# find returns the indexed files matching every argument given, oldest first.
+#  cmid is like 'ACCL:L1B:02', startDate and endDate are datetime.date
+
+def find(db, cmid=None, cavity=None, decimation=None, startDate=None, endDate=None, linac=None):
+    where = ['error IS NULL']
+    params = []
+    if cmid is not None:
+        where.append('cmid = ?')
+        params.append(cmid)
+    if linac is not None:
+        where.append('linac = ?')
+        params.append(linac)
+    if cavity is not None:
+        # cavities are single digits, '1234'
+        where.append('instr(cavities, ?) > 0')
+        params.append(str(cavity))
+    if decimation is not None:
+        where.append('decimation = ?')
+        params.append(decimation)
+    if startDate is not None:
+        where.append('timestamp >= ?')
+        params.append(startDate.isoformat())
+    if endDate is not None:
+        where.append('timestamp < ?')
+        params.append((endDate + timedelta(days=1)).isoformat())
+    return db.execute('SELECT * FROM files WHERE {} ORDER BY timestamp'.format(' AND '.join(where)),
+                      params).fetchall()
+
+
+def checkField(field):
+    # field goes into the SQL, so only known column names
+    if field not in STAT_FIELDS:
+        raise ValueError('Unknown statistic {}, one of {}'.format(field, ', '.join(STAT_FIELDS)))
+    return field
+
+
+# trend returns (timestamp, value) of statistic field for one cavity, oldest first
+
+def trend(db, cmid, cavity, field='rms', startDate=None, endDate=None):
+    rows = find(db, cmid, cavity, None, startDate, endDate)
+    query = 'SELECT {} FROM cavity_stats WHERE path = ? AND cavity = ?'.format(checkField(field))
+    points = []
+    for row in rows:
+        value = db.execute(query, (row['path'], cavity)).fetchone()
+        if value is not None:
+            points.append((row['timestamp'], value[0]))
+    return points
+
+
+# rank returns the limit cavities with the highest maximum of statistic field
+#  over the files from startDate to endDate, as rows of cmid, cavity, value,
+#  the number of files, and the file the maximum is from
+
+def rank(db, field='peak', startDate=None, endDate=None, limit=20):
+    field = checkField(field)
+    where = ['files.error IS NULL']
+    params = []
+    if startDate is not None:
+        where.append('files.timestamp >= ?')
+        params.append(startDate.isoformat())
+    if endDate is not None:
+        where.append('files.timestamp < ?')
+        params.append((endDate + timedelta(days=1)).isoformat())
+    # SQLite takes path from the row with the max()
+    return db.execute('SELECT files.cmid AS cmid, cavity, max(s.{0}) AS value, count(*) AS files, '
+                      'files.path AS path FROM cavity_stats s JOIN files ON files.path = s.path '
+                      'WHERE {1} GROUP BY files.cmid, cavity ORDER BY value DESC LIMIT ?'.format(
+                          field, ' AND '.join(where)), params + [limit]).fetchall()
+
+
+# survey returns the cavity_stats of the latest file of every cryomodule and
+#  cavity from days - 1 days before date to the end of date, as rows with the
+#  cmid, timestamp and path of the file and every STAT_FIELDS column
+
+def survey(db, date, days=1):
+    start = date - timedelta(days=days - 1)
+    # SQLite takes the other columns from the row with the max()
+    return db.execute('SELECT files.cmid AS cmid, s.cavity AS cavity, max(files.timestamp) AS timestamp, '
+                      'files.path AS path, {} FROM cavity_stats s JOIN files ON files.path = s.path '
+                      'WHERE files.error IS NULL AND files.timestamp >= ? AND files.timestamp < ? '
+                      'GROUP BY files.cmid, s.cavity'.format(', '.join('s.' + field for field in STAT_FIELDS)),
+                      (start.isoformat(), (date + timedelta(days=1)).isoformat())).fetchall()
+
+
+# surveyGrid puts statistic field of the survey rows in a (len(cmids), 8)
+#  array, cryomodules in the order of cmids and NaN where there's no data
+
+def surveyGrid(rows, field='rms', cmids=None):
+    field = checkField(field)
+    if cmids is None:
+        cmids = FFt_math.CM_IDs()
+    cmRows = {cmid: idx for idx, cmid in enumerate(cmids)}
+    grid = np.full((len(cmids), CAVITIES_PER_CM), np.nan)
+    for row in rows:
+        if row['cmid'] in cmRows and 1 <= row['cavity'] <= CAVITIES_PER_CM and row[field] is not None:
+            grid[cmRows[row['cmid']], row['cavity'] - 1] = row[field]
+    return grid
+
+
+# saveSurveyPlot draws the survey grid as a heatmap into a PNG
+
+def saveSurveyPlot(pngName, grid, cmids, title):
+    # imported here so the index doesn't need matplotlib
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(6, 0.25 * len(cmids) + 1.5), dpi=100, tight_layout=True)
+    FigureCanvasAgg(fig)
+    axes = fig.add_subplot(111)
+    image = axes.imshow(np.ma.masked_invalid(grid), aspect='auto', cmap='viridis', interpolation='nearest')
+    axes.set_xticks(range(grid.shape[1]))
+    axes.set_xticklabels(['Cav{}'.format(cav) for cav in range(1, grid.shape[1] + 1)])
+    axes.set_yticks(range(len(cmids)))
+    axes.set_yticklabels(cmids, fontsize='small')
+    axes.set_title(title, fontsize='small')
+    fig.colorbar(image, ax=axes)
+    fig.savefig(pngName)
+
+
+# statsHistogram adds up the stored histograms of cavity_stats rows into one
+#  FFt_math.DetuneHistogram
+
+def statsHistogram(rows):
+    hist = FFt_math.DetuneHistogram(FFt_math.fixedHistEdges())
+    hist.grow(1)
+    for row in rows:
+        hist.counts[:, 0] += np.frombuffer(row['hist_counts'], dtype=np.int64)
+        hist.underflow[0] += row['hist_under']
+        hist.overflow[0] += row['hist_over']
+    return hist
+
+
+def parseDate(text):
+    return datetime.strptime(text, '%Y-%m-%d').date()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Index of microphonics data files')
+    parser.add_argument('--index', default=INDEX_PATH, help='SQLite index file')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    updateParser = commands.add_parser('update', help='scan the data tree for new and changed files')
+    updateParser.add_argument('--root', default=FFt_math.DATA_DIR_PATH, help='top of the data tree')
+    updateParser.add_argument('--start', type=parseDate, help='first day to scan, yyyy-mm-dd')
+    updateParser.add_argument('--end', type=parseDate, help='last day to scan, yyyy-mm-dd')
+    updateParser.add_argument('--no-stats', action='store_true', help="only read the headers, not the data")
+    updateParser.add_argument('-j', '--processes', type=int, default=1, help='worker processes for the stats')
+
+    findParser = commands.add_parser('find', help='list the indexed files matching the options')
+    findParser.add_argument('--cm', help='cryomodule, ACCL:L1B:02')
+    findParser.add_argument('--linac', help='L0B, L1B, L2B or L3B')
+    findParser.add_argument('--cavity', type=int)
+    findParser.add_argument('--decimation', type=int)
+    findParser.add_argument('--start', type=parseDate, help='first day, yyyy-mm-dd')
+    findParser.add_argument('--end', type=parseDate, help='last day, yyyy-mm-dd')
+    findParser.add_argument('-l', '--long', action='store_true', help='show the fields, not just the path')
+
+    trendParser = commands.add_parser('trend', help='one statistic of a cavity over time')
+    trendParser.add_argument('--cm', required=True, help='cryomodule, ACCL:L1B:02')
+    trendParser.add_argument('--cavity', type=int, required=True)
+    trendParser.add_argument('--field', default='rms', choices=STAT_FIELDS)
+    trendParser.add_argument('--start', type=parseDate, help='first day, yyyy-mm-dd')
+    trendParser.add_argument('--end', type=parseDate, help='last day, yyyy-mm-dd')
+
+    rankParser = commands.add_parser('rank', help='cavities with the highest value of a statistic')
+    rankParser.add_argument('--field', default='peak', choices=STAT_FIELDS)
+    rankParser.add_argument('--start', type=parseDate, help='first day, yyyy-mm-dd')
+    rankParser.add_argument('--end', type=parseDate, help='last day, yyyy-mm-dd')
+    rankParser.add_argument('-n', '--limit', type=int, default=20, help='cavities to list')
+
+    surveyParser = commands.add_parser('survey', help='a statistic of every cavity in the linac on one day')
+    surveyParser.add_argument('--date', type=parseDate, default=datetime.now().date(), help='the day, yyyy-mm-dd')
+    surveyParser.add_argument('--days', type=int, default=1, help='also look this many days back, 1 is the day only')
+    surveyParser.add_argument('--field', default='rms', choices=STAT_FIELDS)
+    surveyParser.add_argument('--root', default=FFt_math.DATA_DIR_PATH, help='top of the data tree')
+    surveyParser.add_argument('--no-update', action='store_true', help="don't index new files first")
+    surveyParser.add_argument('-j', '--processes', type=int, default=cpu_count(), help='worker processes')
+    surveyParser.add_argument('--png', help='also draw the grid as a heatmap into this file')
+    args = parser.parse_args(argv)
+
+    db = openIndex(args.index)
+    if args.command == 'update':
+        changed, removed = update(db, args.root, args.start, args.end,
+                                  lambda count, fileName: print('\r{} files indexed'.format(count), end='',
+                                                                flush=True),
+                                  withStats=not args.no_stats, processes=args.processes)
+        if changed > 0:
+            print()
+        print('{} files added or changed, {} removed, {} in the index'.format(
+            changed, removed, db.execute('SELECT count(*) FROM files').fetchone()[0]))
+    elif args.command == 'trend':
+        for timestamp, value in trend(db, args.cm, args.cavity, args.field, args.start, args.end):
+            print('{}  {:g}'.format(timestamp, value))
+    elif args.command == 'survey':
+        if not args.no_update:
+            # only files that are new or changed since the last update are read
+            update(db, args.root, args.date - timedelta(days=args.days - 1), args.date,
+                   processes=args.processes)
+        cmids = FFt_math.CM_IDs()
+        grid = surveyGrid(survey(db, args.date, args.days), args.field, cmids)
+        print('{:<12s}'.format(args.field) + ''.join('{:>9s}'.format('cav{}'.format(cav))
+                                                     for cav in range(1, CAVITIES_PER_CM + 1)))
+        for cmid, values in zip(cmids, grid):
+            print('{:<12s}'.format(cmid) + ''.join('{:9.2f}'.format(value) if not np.isnan(value) else
+                                                   '{:>9s}'.format('-') for value in values))
+        if args.png:
+            saveSurveyPlot(args.png, grid, cmids, '{} on {}'.format(SURVEY_FIELDS.get(args.field, args.field),
+                                                                    args.date))
+    elif args.command == 'rank':
+        for row in rank(db, args.field, args.start, args.end, args.limit):
+            print('{cmid}  cav{cavity}  {value:10.3f}  ({files} files, max in {path})'.format(**row))
+    else:
+        for row in find(db, args.cm, args.cavity, args.decimation, args.start, args.end, args.linac):
+            if args.long:
+                print('{timestamp}  {cmid}  cav{cavities}  dec {decimation}  {buffers} buffers  {path}'.format(**row))
+            else:
+                print(row['path'])
+    db.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
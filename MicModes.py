@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+Mechanical modes of each cavity from its detune spectrum
+
+findPeaks picks the strongest local maxima of an averaged (Welch) spectrum
+between DC and MAX_MODE_FREQ that stand out of the noise floor, for every
+cavity at once, leaving out bumps on the side of a bigger peak. Each peak's
+frequency and amplitude are refined by a parabola through the log amplitude
+of the peak bin and its neighbours, and its Q is the frequency over the half
+power (amplitude / sqrt 2) width. For a line as narrow as the frequency
+resolution, e.g. a pump at 60 Hz, the width is the window's and the Q is a
+lower bound.
+
+ModeTracker then follows each mode segment by segment (one buffer by default)
+through a short time Fourier transform, taking the strongest bin within
+trackWidth of the mode in every segment, so drifting modes show up as a
+spread of frequencies.
+
+analyzeModes does both and returns one dict per mode and cavity, with the
+MODE_FIELDS keys. MicDisp shows them in its Modes table and
+`MicBatch.py --modes` writes them for a whole date range.
+"""
+import numpy as np
+from scipy.signal import peak_prominences
+
+import FFt_math
+
+# modes reported per cavity
+NUM_MODES = 5
+# a peak has to be this many times the median of the band
+MIN_SNR = 4.0
+# and drop by this fraction of its amplitude before a higher peak, so the
+#  ripple on the sides of a broad mode isn't taken for more modes
+MIN_PROMINENCE = 0.5
+# Hz either side of a mode that ModeTracker searches in each segment
+TRACK_WIDTH = 1.0
+# bins either side of a peak searched for its half power points
+WIDTH_SEARCH_BINS = 128
+
+MODE_FIELDS = ['mode', 'freq', 'amp', 'width', 'q', 'drift', 'freq_min', 'freq_max']
+
+
+# refinePeaks fits a parabola through the log amplitude at idx and the bins
+#  either side, spectrum is (n_freqs, n_cavities) and idx (n_peaks, n_cavities).
+#  Returns the interpolated frequencies and amplitudes, NaN where idx is -1.
+#  A spectrum of fewer than 3 bins has nothing to fit, its bins are returned
+
+def refinePeaks(freqs, spectrum, idx):
+    valid = idx >= 0
+    if len(freqs) < 3:
+        return (np.where(valid, freqs[np.maximum(idx, 0)], np.nan),
+                np.where(valid, np.take_along_axis(spectrum, np.maximum(idx, 0), axis=0), np.nan))
+    center = np.clip(idx, 1, len(freqs) - 2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        logs = [np.log(np.take_along_axis(spectrum, center + offset, axis=0)) for offset in (-1, 0, 1)]
+        curvature = logs[0] - 2 * logs[1] + logs[2]
+        delta = np.where(curvature < 0, 0.5 * (logs[0] - logs[2]) / curvature, 0.0)
+    # the first and last bins have only one neighbour, they aren't moved
+    delta = np.where(center == idx, np.clip(np.nan_to_num(delta), -0.5, 0.5), 0.0)
+    binWidth = freqs[1] - freqs[0]
+    peakFreqs = freqs[center] + (idx - center + delta) * binWidth
+    peakAmps = np.exp(logs[1] - 0.25 * (logs[0] - logs[2]) * delta)
+    peakAmps = np.where(center == idx, peakAmps, np.take_along_axis(spectrum, np.maximum(idx, 0), axis=0))
+    return np.where(valid, peakFreqs, np.nan), np.where(valid, peakAmps, np.nan)
+
+
+# halfPowerWidth is the width in Hz between the points either side of each
+#  peak where the amplitude drops below peakAmps / sqrt 2, interpolated
+#  between bins. NaN where a side doesn't drop within WIDTH_SEARCH_BINS
+
+def halfPowerWidth(freqs, spectrum, idx, peakAmps):
+    if len(freqs) < 2:
+        return np.full(idx.shape, np.nan)
+    offsets = np.arange(-WIDTH_SEARCH_BINS, WIDTH_SEARCH_BINS + 1)
+    # (n_peaks, n_cavities, 2 WIDTH_SEARCH_BINS + 1) around each peak
+    window = np.clip(np.maximum(idx, 0)[..., np.newaxis] + offsets, 0, len(freqs) - 1)
+    cavIdx = np.arange(spectrum.shape[1])[np.newaxis, :, np.newaxis]
+    amps = spectrum[window, cavIdx]
+    # bins outside the spectrum count as not below, so no crossing is made up there
+    inside = (window == np.maximum(idx, 0)[..., np.newaxis] + offsets)
+    threshold = (peakAmps / np.sqrt(2))[..., np.newaxis]
+    below = (amps < threshold) & inside
+
+    center = WIDTH_SEARCH_BINS
+    right = below[..., center + 1:]
+    left = below[..., center - 1::-1]
+    rightStep = np.argmax(right, axis=-1) + 1
+    leftStep = np.argmax(left, axis=-1) + 1
+
+    def crossing(step, sign):
+        # fraction of the last step before the amplitude is below the threshold
+        outer = np.take_along_axis(amps, (center + sign * step)[..., np.newaxis], -1)[..., 0]
+        inner = np.take_along_axis(amps, (center + sign * (step - 1))[..., np.newaxis], -1)[..., 0]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            fraction = (inner - threshold[..., 0]) / (inner - outer)
+        return step - 1 + np.clip(np.nan_to_num(fraction), 0, 1)
+
+    binWidth = freqs[1] - freqs[0]
+    width = (crossing(rightStep, 1) + crossing(leftStep, -1)) * binWidth
+    found = right.any(axis=-1) & left.any(axis=-1) & (idx >= 0)
+    return np.where(found, width, np.nan)
+
+
+# findPeaks finds up to numPeaks modes in each column of spectrum
+#  (n_freqs, n_cavities, or one cavity). Returns a dict of (numPeaks, n_cavities)
+#  arrays: bin, freq, amp, width and q, strongest first, with NaN (bin -1)
+#  where a cavity has fewer peaks
+
+def findPeaks(freqs, spectrum, numPeaks=NUM_MODES, maxFreq=FFt_math.MAX_MODE_FREQ, minSnr=MIN_SNR):
+    spectrum = np.asarray(spectrum, dtype=np.float64)
+    if spectrum.ndim == 1:
+        spectrum = spectrum[:, np.newaxis]
+    numCavs = spectrum.shape[1]
+    inBand = np.flatnonzero((freqs > 0) & (freqs <= maxFreq))
+    if len(inBand) < 3:
+        idx = np.full((numPeaks, numCavs), -1)
+    else:
+        # -inf on both ends so a peak at the edge of the spectrum counts
+        padded = np.pad(spectrum, ((1, 1), (0, 0)), constant_values=-np.inf)
+        amp = spectrum[inBand]
+        isPeak = (amp > padded[inBand]) & (amp >= padded[inBand + 2])
+        isPeak &= amp >= minSnr * np.nanmedian(amp, axis=0)
+        for col in range(numCavs):
+            rows = np.flatnonzero(isPeak[:, col])
+            if len(rows) > 0:
+                prominence = peak_prominences(np.nan_to_num(spectrum[:, col]), inBand[rows])[0]
+                isPeak[rows, col] = prominence >= MIN_PROMINENCE * amp[rows, col]
+        score = np.where(isPeak, amp, -np.inf)
+        order = np.argsort(-score, axis=0, kind='stable')[:numPeaks]
+        found = np.take_along_axis(score, order, axis=0) > -np.inf
+        idx = np.where(found, inBand[order], -1)
+        if len(idx) < numPeaks:
+            idx = np.concatenate([idx, np.full((numPeaks - len(idx), numCavs), -1)])
+
+    peakFreqs, peakAmps = refinePeaks(freqs, spectrum, idx)
+    width = halfPowerWidth(freqs, spectrum, idx, peakAmps)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        q = peakFreqs / width
+    return {'bin': idx, 'freq': peakFreqs, 'amp': peakAmps, 'width': width, 'q': q}
+
+
+class ModeTracker(FFt_math.SpectrogramAccumulator):
+    """ ModeTracker follows modes through the segments of a record. modeFreqs is
+        (n_modes, n_cavities) with NaN for no mode, and each segment gives the
+        interpolated frequency and amplitude of the strongest bin within
+        trackWidth Hz of each mode. Fed block by block like SpectrogramAccumulator,
+        only the tracked values are kept """
+
+    def __init__(self, samplingRate, modeFreqs, segmentLength=FFt_math.BUFFER_LENGTH, trackWidth=TRACK_WIDTH,
+                 workers=FFt_math.FFT_WORKERS):
+        self.modeFreqs = np.atleast_2d(np.asarray(modeFreqs, dtype=np.float64))
+        maxFreq = np.nanmax(self.modeFreqs, initial=0.0) + trackWidth
+        super(ModeTracker, self).__init__(samplingRate, segmentLength, maxFreq, workers=workers)
+        binWidth = samplingRate / segmentLength
+        halfWidth = max(1, int(np.ceil(trackWidth / binWidth)))
+        center = np.round(np.nan_to_num(self.modeFreqs, nan=0.0) / binWidth).astype(int)
+        # (n_modes, n_cavities, 2 halfWidth + 1) bins searched for each mode
+        self.searchBins = np.clip(center[..., np.newaxis] + np.arange(-halfWidth, halfWidth + 1),
+                                  0, len(self.freqs) - 1)
+        self.tracked = ~np.isnan(self.modeFreqs)
+        self.trackFreqs = []
+        self.trackAmps = []
+
+    def addRow(self, spectrum):
+        # spectrum is (n_cavities, n_freqs) for one segment
+        cavIdx = np.arange(spectrum.shape[0])[np.newaxis, :, np.newaxis]
+        amps = spectrum[cavIdx, self.searchBins]
+        idx = np.take_along_axis(self.searchBins, np.argmax(amps, axis=-1)[..., np.newaxis], -1)[..., 0]
+        freqs, amps = refinePeaks(self.freqs, spectrum.T.astype(np.float64), np.where(self.tracked, idx, -1))
+        self.trackFreqs.append(freqs)
+        self.trackAmps.append(amps)
+
+    # result returns (times, freqs, amps), the start of each segment in seconds
+    #  and the (n_segments, n_modes, n_cavities) tracked values
+
+    def result(self):
+        times = np.arange(len(self.trackFreqs)) * self.segmentLength / self.samplingRate
+        shape = (0,) + self.modeFreqs.shape
+        if len(self.trackFreqs) == 0:
+            return times, np.empty(shape), np.empty(shape)
+        return times, np.stack(self.trackFreqs), np.stack(self.trackAmps)
+
+
+# cavListModes finds the modes of each cavity in cavDataList on its Welch
+#  spectrum, and tracks them through segments of segmentLength. Returns the
+#  findPeaks dict and (times, freqs, amps) from ModeTracker for each cavity
+
+def cavListModes(cavDataList, samplingRate, numModes=NUM_MODES, segmentLength=FFt_math.BUFFER_LENGTH,
+                 trackWidth=TRACK_WIDTH, minSnr=MIN_SNR, workers=FFt_math.FFT_WORKERS):
+    if len({len(cavData) for cavData in cavDataList}) == 1:
+        groups = [np.stack(cavDataList).T]
+    else:
+        groups = [np.asarray(cavData)[:, np.newaxis] for cavData in cavDataList]
+
+    results = []
+    for cavDat in groups:
+        length = min(segmentLength, len(cavDat))
+        freqs, spectrum = FFt_math.welchSpectrum(cavDat, samplingRate, length, workers=workers)
+        peaks = findPeaks(freqs, spectrum, numModes, minSnr=minSnr)
+        if (peaks['bin'] >= 0).any():
+            tracker = ModeTracker(samplingRate, peaks['freq'], length, trackWidth, workers)
+            tracker.add(cavDat)
+            times, trackFreqs, trackAmps = tracker.result()
+        else:
+            # nothing to track, e.g. a record too short to have a mode
+            times = np.empty(0)
+            trackFreqs = trackAmps = np.empty((0,) + peaks['freq'].shape)
+        for col in range(cavDat.shape[1]):
+            results.append(({key: value[:, col] for key, value in peaks.items()},
+                             (times, trackFreqs[:, :, col], trackAmps[:, :, col])))
+    return results
+
+
+# analyzeModes returns, for each cavity in cavDataList, a list of dicts with
+#  the MODE_FIELDS of each mode found, strongest first. drift is the standard
+#  deviation of the tracked frequency, freq_min and freq_max its range
+
+def analyzeModes(cavDataList, samplingRate, numModes=NUM_MODES, segmentLength=FFt_math.BUFFER_LENGTH,
+                 trackWidth=TRACK_WIDTH, minSnr=MIN_SNR, workers=FFt_math.FFT_WORKERS):
+    cavModes = []
+    for peaks, (times, trackFreqs, trackAmps) in cavListModes(cavDataList, samplingRate, numModes, segmentLength,
+                                                              trackWidth, minSnr, workers):
+        modes = []
+        for idx in np.flatnonzero(peaks['bin'] >= 0):
+            track = trackFreqs[:, idx]
+            track = track[~np.isnan(track)]
+            mode = {'mode': len(modes) + 1}
+            for key in ('freq', 'amp', 'width', 'q'):
+                mode[key] = float(peaks[key][idx])
+            mode['drift'] = float(np.std(track)) if len(track) > 1 else float('nan')
+            mode['freq_min'] = float(track.min()) if len(track) > 0 else float('nan')
+            mode['freq_max'] = float(track.max()) if len(track) > 0 else float('nan')
+            modes.append(mode)
+        cavModes.append(modes)
+    return cavModes
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""
+Timing of the display's hot paths
+
+A run is one thing the operator waits for, e.g. plotting a file or an
+acquisition. Inside it, stage() times the steps (load, fft, histogram,
+draw ...) and counts the bytes each one went through:
+
+    with MicTiming.run('plot', fileName) as timings:
+        with MicTiming.stage('load', path.getsize(fileName)):
+            ...
+
+When the run ends it is written as one line to a rotating log,
+~/.microphonics_timing.log or $MIC_TIMING_LOG, e.g.
+
+    2022-06-01 12:00:00 plot res_CM02_cav1234_c100_20220601_115900 total=1.234s load=0.800s/48.1MB fft=0.120s/26.2MB
+
+stage() outside a run does nothing, so functions with stages in them can be
+called from anywhere. profileNext() arms a cProfile and tracemalloc capture
+of the next run that allows it, written to $MIC_PROFILE_DIR (the temp
+directory by default). Acquisitions run in another process, so their runs
+don't profile.
+"""
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from os import environ, path
+
+LOG_PATH = environ.get('MIC_TIMING_LOG', path.join(path.expanduser('~'), '.microphonics_timing.log'))
+LOG_MAX_BYTES = 1024 ** 2
+LOG_BACKUPS = 3
+# the temp directory if not set
+PROFILE_DIR = environ.get('MIC_PROFILE_DIR')
+# functions and allocation sites listed in the profile report
+PROFILE_LINES = 30
+
+_logger = None
+# the run stages are timed into, None outside a run
+_current = None
+_profileArmed = False
+
+
+class Timings:
+    """ Timings holds the stages of one run, a stage timed twice adds up """
+
+    def __init__(self, name, detail=''):
+        self.name = name
+        self.detail = detail
+        self.stages = {}
+        self.start = time.perf_counter()
+        self.seconds = None
+        self.profileFiles = []
+
+    def add(self, stageName, seconds, nbytes=0):
+        before = self.stages.get(stageName, (0.0, 0))
+        self.stages[stageName] = (before[0] + seconds, before[1] + nbytes)
+
+    # total is the time the run took, or the time of its stages if they were
+    #  added afterwards, like the wait for an acquisition
+
+    @property
+    def total(self):
+        seconds = self.seconds if self.seconds is not None else time.perf_counter() - self.start
+        return max(seconds, sum(stageSeconds for stageSeconds, nbytes in self.stages.values()))
+
+    def summary(self, sep=', '):
+        parts = []
+        for stageName, (seconds, nbytes) in self.stages.items():
+            part = '{} {:.3f} s'.format(stageName, seconds)
+            if nbytes > 0:
+                part += ' ({:.1f} MB)'.format(nbytes / 1e6)
+            parts.append(part)
+        parts.append('total {:.3f} s'.format(self.total))
+        return sep.join(parts)
+
+    def logLine(self):
+        fields = ['total={:.3f}s'.format(self.total)]
+        for stageName, (seconds, nbytes) in self.stages.items():
+            field = '{}={:.3f}s'.format(stageName, seconds)
+            if nbytes > 0:
+                field += '/{:.1f}MB'.format(nbytes / 1e6)
+            fields.append(field)
+        return ' '.join([self.name, self.detail or '-'] + fields)
+
+
+# getLogger sets up the log on first use, the logging and profiling modules
+#  are only imported when they're needed so they don't slow down startup
+
+def getLogger():
+    global _logger
+    if _logger is None:
+        import logging
+        from logging.handlers import RotatingFileHandler
+        _logger = logging.getLogger('microphonics.timing')
+        _logger.setLevel(logging.INFO)
+        _logger.propagate = False
+        try:
+            handler = RotatingFileHandler(LOG_PATH, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS)
+            handler.setFormatter(logging.Formatter('%(asctime)s %(message)s', '%Y-%m-%d %H:%M:%S'))
+        except OSError:
+            # no log rather than no display
+            handler = logging.NullHandler()
+        _logger.addHandler(handler)
+    return _logger
+
+
+# profileNext makes the next run capture a cProfile and tracemalloc profile
+
+def profileNext():
+    global _profileArmed
+    _profileArmed = True
+
+
+@contextmanager
+def run(name, detail='', profile=True):
+    global _current, _profileArmed
+    timings = Timings(name, detail)
+    outer = _current
+    _current = timings
+    profiler = None
+    if profile and _profileArmed:
+        import cProfile
+        import tracemalloc
+        _profileArmed = False
+        profiler = cProfile.Profile()
+        tracemalloc.start()
+        profiler.enable()
+    try:
+        yield timings
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            try:
+                timings.profileFiles = writeProfile(timings, profiler)
+            except OSError as e:
+                getLogger().info('{} profile not written: {}'.format(name, e))
+        timings.seconds = time.perf_counter() - timings.start
+        _current = outer
+        getLogger().info(timings.logLine())
+
+
+@contextmanager
+def stage(stageName, nbytes=0):
+    timings = _current
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(stageName, time.perf_counter() - start, nbytes)
+
+
+# writeProfile saves the cProfile stats (for snakeviz or pstats) and a text
+#  report with the slowest functions and the biggest allocations, and
+#  returns their names
+
+def writeProfile(timings, profiler):
+    import io
+    import pstats
+    import tempfile
+    import tracemalloc
+
+    snapshot = tracemalloc.take_snapshot()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    base = path.join(PROFILE_DIR or tempfile.gettempdir(),
+                     'mic_{}_{}'.format(timings.name, datetime.now().strftime('%Y%m%d_%H%M%S')))
+    profiler.dump_stats(base + '.prof')
+
+    report = io.StringIO()
+    report.write('{} {}\n\n'.format(timings.name, timings.detail))
+    pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(PROFILE_LINES)
+    report.write('traced memory {:.1f} MB at the end, {:.1f} MB peak\n\n'.format(current / 1e6, peak / 1e6))
+    for statistic in snapshot.statistics('lineno')[:PROFILE_LINES]:
+        report.write('{}\n'.format(statistic))
+    with open(base + '.txt', 'w') as f:
+        f.write(report.getvalue())
+    return [base + '.prof', base + '.txt']
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark FFt_math.parseCavDat against FFt_math.parseCavDatArray
+
+Writes a synthetic _microphonics.dat file (999 buffers of BUFFER_LENGTH
+samples for 4 cavities by default), reads it with readCavDat and times
+both parsers on the same lines.
+
+    python benchmarks/bench_parse.py --buffers 999 --cavities 4
+"""
+import argparse
+import sys
+import tempfile
+import time
+from os import path, remove
+
+import numpy as np
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+import FFt_math  # noqa: E402
+from synthetic import writeSyntheticCavDat  # noqa: E402
+
+
+def timeIt(label, func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    print('{:<28s} {:8.2f} s'.format(label, time.perf_counter() - start))
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--buffers', type=int, default=999)
+    parser.add_argument('--cavities', type=int, default=4)
+    parser.add_argument('--skip-old', action='store_true',
+                        help="don't time parseCavDat (it needs several GB at 999 buffers)")
+    args = parser.parse_args(argv)
+
+    fileName = path.join(tempfile.gettempdir(), 'bench_{}buf_microphonics.dat'.format(args.buffers))
+    timeIt('write synthetic file', writeSyntheticCavDat, fileName, args.buffers, args.cavities)
+    print('file size {:.1f} MB'.format(path.getsize(fileName) / 1e6))
+    try:
+        read_data, header = timeIt('readCavDat', FFt_math.readCavDat, fileName)
+        cavDat = timeIt('parseCavDatArray', FFt_math.parseCavDatArray, read_data)
+        cavDat32 = timeIt('parseCavDatArray float32', FFt_math.parseCavDatArray, read_data, np.float32)
+        print('array {} {:.1f} MB, float32 {:.1f} MB'.format(cavDat.shape, cavDat.nbytes / 1e6,
+                                                             cavDat32.nbytes / 1e6))
+        if not args.skip_old:
+            cavDataList = timeIt('parseCavDat', FFt_math.parseCavDat, read_data)
+            for col in range(cavDat.shape[1]):
+                if not np.array_equal(np.asarray(cavDataList[col]), cavDat[:, col]):
+                    print('column {} does not match parseCavDat'.format(col + 1))
+    finally:
+        remove(fileName)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark the read -> parse -> analyze -> plot pipeline
+
+For every combination of --buffers, --cavities and --decimation a synthetic
+_microphonics.dat file is written and each stage the display goes through is
+timed on it: reading and parsing the text file, the binary file, the spectra,
+histograms and waterfall, and drawing them with MicDisp's own plot methods
+(offscreen, --no-plot leaves them out). Each combination runs in a fresh
+process so the peak RSS is its own.
+
+Results go to a JSON file, --compare prints the change against an earlier one.
+
+    python benchmarks/bench_pipeline.py --buffers 1 10 100 999 --cavities 1 4 8 -o results.json
+    python benchmarks/bench_pipeline.py --buffers 1 10 100 999 --cavities 1 4 8 --compare results.json
+"""
+import argparse
+import json
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from os import cpu_count, environ, path, remove
+
+import numpy as np
+
+ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import FFt_math  # noqa: E402
+from synthetic import writeSyntheticCavDat  # noqa: E402
+
+# parseCavDat keeps every value as a python float, past this many samples
+#  (cavities x rows) it's left out unless --old is given
+OLD_PARSER_MAX_SAMPLES = 4 * 100 * FFt_math.BUFFER_LENGTH
+
+
+def rssMB():
+    # current resident size, from /proc where there is one
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize() / 1024 ** 2
+    except OSError:
+        return float('nan')
+
+
+def peakRssMB():
+    # ru_maxrss is kB on linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+
+
+class StageTimer:
+    """ StageTimer times the stages of one run and keeps the memory after each """
+
+    def __init__(self):
+        self.stages = []
+
+    def __call__(self, name, func, *args, **kwargs):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        seconds = time.perf_counter() - start
+        self.stages.append({'stage': name, 'seconds': round(seconds, 4),
+                            'rss_mb': round(rssMB(), 1), 'peak_rss_mb': round(peakRssMB(), 1)})
+        return result
+
+
+class PlotHost:
+    """ PlotHost stands in for a MicDisp so its plot methods can be called
+        without the rest of the display. Nothing is cached, as on the
+        first plot of a file """
+
+    class ui:
+        class SpectrumComboBox:
+            @staticmethod
+            def currentIndex():
+                return 0
+
+    @staticmethod
+    def cached(fname, params, compute):
+        return compute()
+
+    def drawWaterfall(self, tPlot, spectrograms, leGend, duration):
+        import CommMicro
+        CommMicro.MicDisp.drawWaterfall(self, tPlot, spectrograms, leGend, duration)
+
+
+def plotStages(timer, cavDataList, samplingRate):
+    environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    try:
+        from PyQt5 import QtWidgets
+        import CommMicro
+    except ImportError as e:
+        # a run without its plot stages isn't comparable, so it fails
+        raise RuntimeError('plot stages need CommMicro, {} (--no-plot leaves them out)'.format(e))
+
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication(sys.argv)
+    host = PlotHost()
+    leGend = ['Cav {}'.format(cav) for cav in range(1, len(cavDataList) + 1)]
+    tPlot = CommMicro.PgCanvas(downsample=True)
+    bPlot = CommMicro.PgCanvas(downsample=True)
+    for canvas in (tPlot, bPlot):
+        canvas.resize(1200, 500)
+        canvas.show()
+
+    def draw(canvas):
+        app.processEvents()
+        canvas.grab()
+
+    timer('FFTPlot', CommMicro.MicDisp.FFTPlot, host, bPlot, cavDataList, leGend, samplingRate)
+    timer('draw spectra', draw, bPlot)
+    timer('HistPlot', CommMicro.MicDisp.HistPlot, host, tPlot, cavDataList, leGend)
+    timer('draw histograms', draw, tPlot)
+    timer('WaterfallPlot', CommMicro.MicDisp.WaterfallPlot, host, tPlot, cavDataList, leGend, samplingRate)
+    timer('draw waterfall', draw, tPlot)
+
+
+# runOne times every stage on one synthetic file, it is what the child
+#  process runs
+
+def runOne(buffers, numCavs, decimation, tmpDir, old=False, plot=True):
+    timer = StageTimer()
+    fileName = path.join(tmpDir, 'bench_c{}_cav{}_d{}_microphonics.dat'.format(buffers, numCavs, decimation))
+    binName = FFt_math.binaryPath(fileName)
+    samplingRate = FFt_math.DEFAULT_SAMPLING_RATE / decimation
+    notes = []
+    timer.stages.append({'stage': 'start', 'seconds': 0.0,
+                         'rss_mb': round(rssMB(), 1), 'peak_rss_mb': round(peakRssMB(), 1)})
+    try:
+        timer('write synthetic file', writeSyntheticCavDat, fileName, buffers, numCavs, decimation)
+        fileBytes = path.getsize(fileName)
+
+        read_data, header_Data = timer('readCavDat', FFt_math.readCavDat, fileName)
+        cavDat = timer('parseCavDatArray', FFt_math.parseCavDatArray, read_data)
+        if old or cavDat.size <= OLD_PARSER_MAX_SAMPLES:
+            timer('parseCavDat', FFt_math.parseCavDat, read_data)
+        else:
+            notes.append('parseCavDat skipped, {} samples'.format(cavDat.size))
+        del read_data, cavDat
+        cavDat, header_Data = timer('loadCavDat', FFt_math.loadCavDat, fileName)
+
+        timer('writeCavDatBinary', FFt_math.writeCavDatBinary, binName, cavDat, header_Data)
+        binaryBytes = path.getsize(binName)
+        del cavDat
+        cavDat, header_Data = timer('readCavDatBinary', FFt_math.readCavDatBinary, binName)
+        cavDataList = FFt_math.cavDatColumns(cavDat)
+
+        timer('cavListSpectra', FFt_math.cavListSpectra, cavDataList, samplingRate)
+        timer('cavListSpectra welch', FFt_math.cavListSpectra, cavDataList, samplingRate,
+              FFt_math.BUFFER_LENGTH)
+        timer('cavHistograms', FFt_math.cavHistograms, cavDataList)
+        timer('cavListSpectrogram', FFt_math.cavListSpectrogram, cavDataList, samplingRate)
+        if plot:
+            plotStages(timer, cavDataList, samplingRate)
+    finally:
+        for name in (fileName, binName):
+            if path.exists(name):
+                remove(name)
+
+    return {'buffers': buffers, 'cavities': numCavs, 'decimation': decimation,
+            'samples': buffers * FFt_math.BUFFER_LENGTH, 'file_mb': round(fileBytes / 1e6, 2),
+            'binary_mb': round(binaryBytes / 1e6, 2),
+            'total_seconds': round(sum(stage['seconds'] for stage in timer.stages), 4),
+            'peak_rss_mb': round(peakRssMB(), 1), 'stages': timer.stages, 'notes': notes}
+
+
+def gitCommit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, timeout=10).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ''
+
+
+def metadata():
+    import scipy
+    meta = {'date': datetime.now().isoformat(timespec='seconds'), 'commit': gitCommit(),
+            'python': platform.python_version(), 'numpy': np.__version__, 'scipy': scipy.__version__,
+            'platform': platform.platform(), 'machine': platform.node(), 'cpus': cpu_count()}
+    try:
+        import pyqtgraph
+        meta['pyqtgraph'] = pyqtgraph.__version__
+    except ImportError:
+        pass
+    return meta
+
+
+def runChild(buffers, numCavs, decimation, tmpDir, old, plot):
+    cmdList = [sys.executable, path.abspath(__file__), '--child', str(buffers), str(numCavs), str(decimation),
+               '--tmp', tmpDir]
+    if old:
+        cmdList.append('--old')
+    if not plot:
+        cmdList.append('--no-plot')
+    proc = subprocess.run(cmdList, capture_output=True, text=True)
+    if proc.returncode != 0:
+        return {'buffers': buffers, 'cavities': numCavs, 'decimation': decimation,
+                'error': proc.stderr.strip().splitlines()[-1:] or ['exit {}'.format(proc.returncode)]}
+    # the result is the last line, anything printed before it is chatter
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def runKey(run):
+    return run['buffers'], run['cavities'], run['decimation']
+
+
+def printRun(run, previous=None):
+    print('\n{} buffers, {} cavities, decimation {}'.format(*runKey(run)))
+    if 'error' in run:
+        print('  failed: {}'.format(' '.join(run['error'])))
+        return
+    print('  text {} MB, binary {} MB, peak RSS {} MB'.format(run['file_mb'], run['binary_mb'], run['peak_rss_mb']))
+    before = {}
+    if previous is not None and 'stages' in previous:
+        before = {stage['stage']: stage for stage in previous['stages']}
+    for stage in run['stages']:
+        if stage['stage'] == 'start':
+            continue
+        line = '  {:<24s} {:9.3f} s {:9.1f} MB'.format(stage['stage'], stage['seconds'], stage['peak_rss_mb'])
+        old = before.get(stage['stage'])
+        if old is not None and old['seconds'] > 0:
+            line += '   {:+6.0f}%'.format(100 * (stage['seconds'] / old['seconds'] - 1))
+        print(line)
+    for note in run['notes']:
+        print('  ' + note)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--buffers', type=int, nargs='+', default=[1, 10, 100], help='buffers per file, 1-999')
+    parser.add_argument('--cavities', type=int, nargs='+', default=[1, 4, 8], help='cavities per file, 1-8')
+    parser.add_argument('--decimation', type=int, nargs='+', default=[2], help='decimation of the file')
+    parser.add_argument('-o', '--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare against')
+    parser.add_argument('--old', action='store_true', help='time parseCavDat at every size')
+    parser.add_argument('--no-plot', action='store_true', help='leave out the plot stages')
+    parser.add_argument('--tmp', default=tempfile.gettempdir(), help='where the synthetic files go')
+    parser.add_argument('--child', type=int, nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child is not None:
+        print(json.dumps(runOne(*args.child, args.tmp, args.old, not args.no_plot)))
+        return 0
+
+    for buffers in args.buffers:
+        if not 1 <= buffers <= 999:
+            parser.error('buffers must be 1-999')
+    for numCavs in args.cavities:
+        if not 1 <= numCavs <= 8:
+            parser.error('cavities must be 1-8')
+
+    previous = {}
+    if args.compare:
+        with open(args.compare) as f:
+            compared = json.load(f)
+        previous = {runKey(run): run for run in compared['runs']}
+        print('comparing with {} ({})'.format(args.compare, compared['meta'].get('commit', '')))
+
+    results = {'meta': metadata(), 'runs': []}
+    for buffers in args.buffers:
+        for numCavs in args.cavities:
+            for decimation in args.decimation:
+                run = runChild(buffers, numCavs, decimation, args.tmp, args.old, not args.no_plot)
+                results['runs'].append(run)
+                printRun(run, previous.get(runKey(run)))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1)
+        print('\nresults in {}'.format(args.output))
+    return 0 if all('error' not in run for run in results['runs']) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark the startup of the CommMicro display against a time budget
+
+Each repeat starts a fresh interpreter that creates the PyDMApplication,
+imports CommMicro, builds MicDisp and shows it, like `pydm CommMicro.py`
+does. The median of each step is printed, and the exit status is 1 if the
+median total (interpreter start included) is over --budget seconds, so it
+can run after changes or on the console machines themselves.
+
+    python benchmarks/bench_startup.py --repeat 5 --budget 2.0 --imports 15
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+from os import environ, path
+
+ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+
+# seconds from launch to the display showing
+STARTUP_BUDGET = 2.0
+
+STEPS = ['application', 'import CommMicro', 'MicDisp', 'show']
+
+# modules that shouldn't be loaded until the display is used
+DEFERRED = ['scipy', 'physicselog', 'MicIndex', 'pstats', 'tracemalloc']
+
+
+# child runs in the fresh interpreter and prints the seconds of each step
+
+def child():
+    environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    sys.path.insert(0, ROOT)
+    steps = {}
+    start = time.perf_counter()
+    from pydm import PyDMApplication
+    app = PyDMApplication(hide_nav_bar=True, hide_menu_bar=True, hide_status_bar=True)
+    steps['application'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    import CommMicro
+    steps['import CommMicro'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    display = CommMicro.MicDisp()
+    steps['MicDisp'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    display.show()
+    app.processEvents()
+    steps['show'] = time.perf_counter() - start
+    modules = sorted(sys.modules)
+    print(json.dumps({'steps': steps, 'modules': len(modules),
+                      'loaded': [name for name in DEFERRED if name in modules]}))
+
+
+def runChild():
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, path.abspath(__file__), '--child'], cwd=ROOT,
+                          capture_output=True, text=True)
+    seconds = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else
+                           'exit {}'.format(proc.returncode))
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result['total'] = seconds
+    return result
+
+
+# slowestImports runs `python -X importtime -c "import CommMicro"` and
+#  returns the modules CommMicro imports itself by their cumulative time
+
+def slowestImports(count):
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import CommMicro'], cwd=ROOT,
+                          capture_output=True, text=True)
+    imports = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        selfTime, cumulative, name = line[len('import time:'):].split('|')
+        # each level of nesting is indented two more spaces
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if cumulative.strip().isdigit() and depth == 1:
+            imports.append((int(cumulative) / 1e6, name.strip()))
+    return sorted(imports, reverse=True)[:count]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5, help='fresh interpreters to time')
+    parser.add_argument('--budget', type=float, default=STARTUP_BUDGET, help='seconds allowed for the median total')
+    parser.add_argument('--imports', type=int, default=0, help='also list this many of the slowest imports')
+    parser.add_argument('-o', '--output', help='write the results to this JSON file')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        child()
+        return 0
+
+    try:
+        runs = [runChild() for _ in range(args.repeat)]
+    except RuntimeError as e:
+        print('startup failed: {}'.format(e), file=sys.stderr)
+        return 2
+
+    medians = {step: statistics.median(run['steps'][step] for run in runs) for step in STEPS}
+    medians['total'] = statistics.median(run['total'] for run in runs)
+    for step in STEPS + ['total']:
+        print('{:<20s} {:7.3f} s'.format(step, medians[step]))
+    print('{} modules loaded, of the deferred ones: {}'.format(runs[-1]['modules'],
+                                                               ', '.join(runs[-1]['loaded']) or 'none'))
+
+    if args.imports > 0:
+        print('\nslowest imports of CommMicro')
+        for seconds, name in slowestImports(args.imports):
+            print('  {:<30s} {:7.3f} s'.format(name, seconds))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'date': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': sys.version.split()[0],
+                       'budget': args.budget, 'median': medians, 'runs': runs}, f, indent=1)
+
+    over = medians['total'] > args.budget
+    print('\n{:.3f} s is {} the {:.1f} s budget'.format(medians['total'], 'OVER' if over else 'within',
+                                                      args.budget))
+    return 1 if over else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic data files for the benchmarks
+
+writeSyntheticCavDat writes a file laid out like the ones res_data_acq.py
+writes (the header from FFt_math.writeCavHeader, then the fixed width
+columns), with a few mechanical modes per cavity over noise so the spectra
+and histograms have something in them.
+"""
+import sys
+from datetime import datetime
+from os import path
+
+import numpy as np
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+import FFt_math  # noqa: E402
+
+BUFFER_LENGTH = FFt_math.BUFFER_LENGTH
+# lines written per np.savetxt call so the generator itself stays small
+WRITE_CHUNK = 1 << 20
+# Hz and amplitude of the lines every cavity has
+MODES = [(60.0, 3.0), (41.5, 1.5)]
+
+
+def writeSyntheticCavDat(fileName, buffers, numCavs, decimation=2, seed=0):
+    rng = np.random.default_rng(seed)
+    samplingRate = FFt_math.DEFAULT_SAMPLING_RATE / decimation
+    with open(fileName, 'w') as f:
+        FFt_math.writeCavHeader(f, 'ACCL:L1B:H1', ''.join(str(cav) for cav in range(1, numCavs + 1)),
+                                decimation, datetime(2021, 6, 17, 12, 27, 30, 380437))
+        numSamples = buffers * BUFFER_LENGTH
+        for start in range(0, numSamples, WRITE_CHUNK):
+            rows = min(WRITE_CHUNK, numSamples - start)
+            t = (start + np.arange(rows))[:, np.newaxis] / samplingRate
+            cavDat = rng.normal(0.0, 5.0, (rows, numCavs))
+            for freq, amp in MODES:
+                cavDat += amp * np.sin(2 * np.pi * freq * t)
+            # each cavity's own mode, 20, 27, 34 ... Hz
+            cavDat += 4.0 * np.sin(2 * np.pi * (20.0 + 7 * np.arange(numCavs)) * t)
+            FFt_math.writeCavDat(f, cavDat)
+    return fileName
@@ -0,0 +1,15 @@
+import sys
+from os import path
+
+import pytest
+
+ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# the acquisition that comes with the repo, one column of 16843 samples
+SAMPLE_FILE = path.join(ROOT, '1234_20210617_1227')
+
+
+@pytest.fixture
+def sampleFile():
+    return SAMPLE_FILE
@@ -0,0 +1,38 @@
+import shutil
+from os import makedirs, path
+
+import MicBatch
+
+
+def dataDir(tmp_path):
+    dirName = path.join(str(tmp_path), 'ACCL_L1B_0200', '2021', '06', '17')
+    makedirs(dirName)
+    return dirName
+
+
+def testRowsOfSample(tmp_path, sampleFile):
+    fileName = path.join(dataDir(tmp_path), 'ACCL_L1B_0210_20210617_122730_microphonics.dat')
+    shutil.copy(sampleFile, fileName)
+    rows = MicBatch.analyzeFile(fileName)
+    assert len(rows) == 1
+    row = rows[0]
+    assert row['error'] == ''
+    # the CM directory, not the file's own ACCL_ name
+    assert row['cm'] == 'ACCL_L1B_0200'
+    assert row['cavity'] == 1
+    assert row['samples'] == 16843
+    assert row['timestamp'] == '2021-06-17T12:27:30.380437'
+
+
+def testFileWithoutDataIsReported(tmp_path, sampleFile):
+    fileName = path.join(dataDir(tmp_path), 'ACCL_L1B_0210_20210617_122731_microphonics.dat')
+    with open(sampleFile) as f:
+        lines = f.readlines()
+    # the header and the two lines after it that are always skipped
+    numLines = next(num for num, line in enumerate(lines) if 'ACCL' in line) + 3
+    with open(fileName, 'w') as f:
+        f.writelines(lines[:numLines])
+    rows = MicBatch.analyzeFile(fileName)
+    assert len(rows) == 1
+    assert rows[0]['cm'] == 'ACCL_L1B_0200'
+    assert rows[0]['error'] == 'no data'
@@ -0,0 +1,108 @@
+import shutil
+from datetime import date
+from os import makedirs, path, remove, stat
+
+import pytest
+
+import MicIndex
+
+
+@pytest.fixture
+def db():
+    db = MicIndex.openIndex(':memory:')
+    yield db
+    db.close()
+
+
+# dataTree lays out copies of the sample like DATA_DIR_PATH,
+#  ACCL_L1B_0200/2021/06/17/..., and returns the root and the files
+
+def dataTree(tmp_path, sampleFile, baseNames=('ACCL_L1B_0210_20210617_122730_microphonics.dat',
+                                             'res_CM02_cav3_c1_20210617_130000')):
+    rootDir = str(tmp_path)
+    dirName = path.join(rootDir, 'ACCL_L1B_0200', '2021', '06', '17')
+    makedirs(dirName)
+    fileNames = []
+    for baseName in baseNames:
+        fileNames.append(path.join(dirName, baseName))
+        shutil.copy(sampleFile, fileNames[-1])
+    return rootDir, fileNames
+
+
+def testParseOldFileName():
+    fields = MicIndex.parseFileName('/data/ACCL_L1B_0200/2021/06/17/ACCL_L1B_0230_20210617_122730_microphonics.dat')
+    assert fields == {'linac': 'L1B', 'cm': '02', 'cavities': '3', 'timestamp': '2021-06-17T12:27:30',
+                      'cmid': 'ACCL:L1B:02'}
+
+
+def testParseResFileName():
+    fields = MicIndex.parseFileName('/data/ACCL_L2B_H100/2022/06/01/res_CMH1_cav5678_c12_20220601_120000.npz')
+    assert fields == {'linac': 'L2B', 'cm': 'H1', 'cavities': '5678', 'buffers': 12,
+                      'timestamp': '2022-06-01T12:00:00', 'cmid': 'ACCL:L2B:H1'}
+    # without its CM directory there's no linac
+    fields = MicIndex.parseFileName('res_CM02_cav1_c5_20220601_120000')
+    assert 'linac' not in fields and 'cmid' not in fields
+    assert fields['cm'] == '02' and fields['buffers'] == 5
+
+
+def testParseOtherFileName():
+    assert MicIndex.parseFileName('/data/1234_20210617_1227') == {}
+    assert MicIndex.parseFileName('/data/ACCL_L1B_0200/notes.txt') == {'linac': 'L1B', 'cm': '02'}
+
+
+def testFileRecordFromHeader(sampleFile):
+    record = MicIndex.fileRecord(sampleFile, stat(sampleFile))
+    assert record['error'] is None
+    # the header has a DAC and a DF channel for each cavity
+    assert record['cavities'] == '1234'
+    assert record['decimation'] == 2
+    assert record['format'] == 'text'
+    assert record['timestamp'] == '2021-06-17T12:27:30.380437'
+
+
+def testUpdate(tmp_path, sampleFile, db):
+    rootDir, fileNames = dataTree(tmp_path, sampleFile)
+    assert MicIndex.update(db, rootDir) == (2, 0)
+    # nothing changed, nothing read again
+    assert MicIndex.update(db, rootDir) == (0, 0)
+
+    rows = MicIndex.find(db, cmid='ACCL:L1B:02')
+    assert [row['path'] for row in rows] == fileNames
+    # the file name's cavities, not the header's
+    assert [row['cavities'] for row in rows] == ['1', '3']
+    assert [row['path'] for row in MicIndex.find(db, cavity=3)] == fileNames[1:]
+    assert MicIndex.find(db, startDate=date(2021, 6, 18)) == []
+
+    remove(fileNames[0])
+    assert MicIndex.update(db, rootDir) == (0, 1)
+    assert [row['path'] for row in MicIndex.find(db)] == fileNames[1:]
+
+
+def testUpdateStats(tmp_path, sampleFile, db):
+    rootDir, fileNames = dataTree(tmp_path, sampleFile)
+    assert MicIndex.update(db, rootDir, withStats=False) == (2, 0)
+    assert db.execute('SELECT COUNT(*) FROM cavity_stats').fetchone()[0] == 0
+    # the files are the same but their stats are still to read
+    assert MicIndex.update(db, rootDir) == (2, 0)
+    assert MicIndex.update(db, rootDir) == (0, 0)
+
+    rows = db.execute('SELECT * FROM cavity_stats ORDER BY path').fetchall()
+    assert [(row['path'], row['cavity']) for row in rows] == [(fileNames[0], 1), (fileNames[1], 3)]
+    assert rows[0]['samples'] == 16843
+    assert rows[0]['rms'] == pytest.approx(rows[1]['rms'])
+    assert MicIndex.trend(db, 'ACCL:L1B:02', 3) == [('2021-06-17T12:27:30.380437', rows[1]['rms'])]
+
+
+def testFileWithoutDataIsNotReadAgain(tmp_path, sampleFile, db):
+    rootDir, fileNames = dataTree(tmp_path, sampleFile, ('res_CM02_cav1_c1_20210617_130000',))
+    with open(sampleFile) as f:
+        lines = f.readlines()
+    # the header and the two lines after it that are always skipped
+    numLines = next(num for num, line in enumerate(lines) if 'ACCL' in line) + 3
+    with open(fileNames[0], 'w') as f:
+        f.writelines(lines[:numLines])
+
+    assert MicIndex.update(db, rootDir) == (1, 0)
+    row = db.execute('SELECT * FROM files').fetchone()
+    assert row['error'] == 'no data'
+    assert MicIndex.update(db, rootDir) == (0, 0)
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+import FFt_math
+import MicModes
+
+SAMPLING_RATE = 1000.
+
+
+def modesSpectrum(modes, numSamples=64 * 4096, segmentLength=4096):
+    times = np.arange(numSamples) / SAMPLING_RATE
+    cavData = np.random.default_rng(0).normal(scale=0.05, size=numSamples)
+    for freq, amplitude in modes:
+        cavData += amplitude * np.sin(2 * np.pi * freq * times)
+    return FFt_math.welchSpectrum(cavData, SAMPLING_RATE, segmentLength)
+
+
+def testPeaksStrongestFirst():
+    modes = [(20.3, 1.), (45.6, 4.), (90.1, 2.)]
+    freqs, spectrum = modesSpectrum(modes)
+    peaks = MicModes.findPeaks(freqs, spectrum, numPeaks=5)
+    assert peaks['bin'].shape == (5, 1)
+    # refined between bins, a quarter of a 0.24 Hz bin is plenty
+    np.testing.assert_allclose(peaks['freq'][:3, 0], [45.6, 90.1, 20.3], atol=0.06)
+    np.testing.assert_allclose(peaks['amp'][:3, 0], [4., 2., 1.], rtol=0.2)
+    # the Hann window's main lobe is 4 bins, half power at about 1.44 bins
+    np.testing.assert_allclose(peaks['width'][:3, 0], 1.44 * freqs[1], rtol=0.2)
+    np.testing.assert_allclose(peaks['q'][:3, 0], peaks['freq'][:3, 0] / peaks['width'][:3, 0])
+    # nothing else stands out of the noise
+    assert peaks['bin'][3:, 0].tolist() == [-1, -1]
+    assert np.isnan(peaks['freq'][3:, 0]).all()
+
+
+def testPeaksOnlyInBand():
+    freqs, spectrum = modesSpectrum([(30., 1.), (200., 5.)])
+    peaks = MicModes.findPeaks(freqs, spectrum, numPeaks=2)
+    assert peaks['freq'][0, 0] == pytest.approx(30., abs=0.06)
+    assert peaks['bin'][1, 0] == -1
+
+
+def testPeaksPerCavity():
+    freqs, first = modesSpectrum([(25., 1.)])
+    second = modesSpectrum([(60., 1.), (75., 3.)])[1]
+    peaks = MicModes.findPeaks(freqs, np.hstack([first, second]), numPeaks=2)
+    np.testing.assert_allclose(peaks['freq'], [[25., 75.], [np.nan, 60.]], atol=0.06)
+
+
+def testPeaksOfSample(sampleFile):
+    cavDat, header_Data = FFt_math.loadCavDat(sampleFile)
+    freqs, spectrum = FFt_math.welchSpectrum(cavDat, FFt_math.parseCavHeader(header_Data).samplingRate)
+    peaks = MicModes.findPeaks(freqs, spectrum[:, 0])
+    found = peaks['bin'][:, 0] >= 0
+    assert found[0]
+    # the found peaks come first, each in band and no stronger than the one before
+    assert found.tolist() == sorted(found.tolist(), reverse=True)
+    assert ((peaks['freq'][found, 0] > 0) & (peaks['freq'][found, 0] <= FFt_math.MAX_MODE_FREQ)).all()
+    assert (np.diff(spectrum[peaks['bin'][found, 0], 0]) <= 0).all()
+
+
+def testShortSpectrum():
+    peaks = MicModes.findPeaks(np.array([0., 1.]), np.array([1., 2.]), numPeaks=3)
+    assert peaks['bin'][:, 0].tolist() == [-1, -1, -1]
+    assert np.isnan(peaks['freq']).all()
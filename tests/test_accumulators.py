@@ -0,0 +1,96 @@
+import numpy as np
+import pytest
+
+import FFt_math
+
+SAMPLING_RATE = 1000.
+
+
+def sampleData(sampleFile):
+    cavDat, header_Data = FFt_math.loadCavDat(sampleFile)
+    return cavDat, FFt_math.parseCavHeader(header_Data).samplingRate
+
+
+def sine(freq, amplitude, numSamples, samplingRate=SAMPLING_RATE):
+    return amplitude * np.sin(2 * np.pi * freq * np.arange(numSamples) / samplingRate)
+
+
+def testWelchBlocksMatchWholeRecord(sampleFile):
+    cavDat, samplingRate = sampleData(sampleFile)
+    welch = FFt_math.WelchAccumulator(samplingRate, 1024)
+    for start, stop in ((0, 1000), (1000, 4333), (4333, len(cavDat))):
+        welch.add(cavDat[start:stop])
+    freqs, spectrum = welch.result()
+    wholeFreqs, whole = FFt_math.welchSpectrum(cavDat, samplingRate, 1024)
+    np.testing.assert_array_equal(freqs, wholeFreqs)
+    np.testing.assert_allclose(spectrum, whole, rtol=1e-10)
+
+
+def testWelchFileMatchesMemory(sampleFile):
+    cavDat, samplingRate = sampleData(sampleFile)
+    freqs, spectrum = FFt_math.welchCavDatFile(sampleFile, segmentLength=4096)
+    np.testing.assert_allclose(spectrum, FFt_math.welchSpectrum(cavDat, samplingRate, 4096)[1], rtol=1e-10)
+    assert freqs[1] == pytest.approx(samplingRate / 4096)
+
+
+def testWelchSineAmplitude():
+    # 125 Hz falls on a bin, so the Hann window gives back the amplitude
+    freqs, spectrum = FFt_math.welchSpectrum(sine(125., 3., 20 * 1024), SAMPLING_RATE, 1024)
+    peak = np.argmax(spectrum[:, 0])
+    assert freqs[peak] == pytest.approx(125.)
+    assert spectrum[peak, 0] == pytest.approx(3., rel=1e-6)
+
+
+def testWelchDensityIsVariance():
+    noise = np.random.default_rng(0).normal(scale=2., size=64 * 1024)
+    freqs, density = FFt_math.welchSpectrum(noise, SAMPLING_RATE, 1024, scaling='density')
+    assert np.sum(density[:, 0]) * freqs[1] == pytest.approx(4., rel=0.05)
+
+
+def testWelchLeavesOutMissingSegments():
+    # every segment of a 125 Hz sine is the same, so leaving some out changes nothing
+    cavDat = np.stack([sine(125., 1., 8192), sine(125., 1., 8192)], axis=1)
+    cavDat[3000, 0] = np.nan
+    welch = FFt_math.WelchAccumulator(SAMPLING_RATE, 1024)
+    welch.add(cavDat)
+    freqs, spectrum = welch.result()
+    # the NaN is in two of the 15 half-overlapping segments
+    assert welch.counts.tolist() == [13, 15]
+    np.testing.assert_allclose(spectrum[:, 0], spectrum[:, 1], rtol=1e-6, atol=1e-12)
+
+
+def testSpectrogramBlocksMatchWholeRecord(sampleFile):
+    cavDat, samplingRate = sampleData(sampleFile)
+    spectrogram = FFt_math.SpectrogramAccumulator(samplingRate, 1024)
+    for start, stop in ((0, 1000), (1000, 4333), (4333, len(cavDat))):
+        spectrogram.add(cavDat[start:stop])
+    times, freqs, image = spectrogram.result()
+    (wholeTimes, wholeFreqs, whole), = FFt_math.cavListSpectrogram(FFt_math.cavDatColumns(cavDat), samplingRate,
+                                                                    1024)
+    assert image.shape == (1, len(cavDat) // 1024, len(freqs))
+    np.testing.assert_array_equal(times, wholeTimes)
+    np.testing.assert_array_equal(freqs, wholeFreqs)
+    np.testing.assert_allclose(image[0], whole, rtol=1e-5)
+
+
+def testSpectrogramFileMatchesMemory(sampleFile):
+    cavDat, samplingRate = sampleData(sampleFile)
+    times, freqs, image = FFt_math.spectrogramCavDatFile(sampleFile, segmentLength=1024)
+    (wholeTimes, wholeFreqs, whole), = FFt_math.cavListSpectrogram(FFt_math.cavDatColumns(cavDat), samplingRate,
+                                                                    1024)
+    np.testing.assert_array_equal(times, wholeTimes)
+    np.testing.assert_allclose(image[0], whole, rtol=1e-5)
+
+
+def testSpectrogramRowsAreAveraged():
+    # 100 segments into at most 2 * 8 rows, each the average of 8 segments
+    spectrogram = FFt_math.SpectrogramAccumulator(SAMPLING_RATE, 1024, maxRows=8)
+    spectrogram.add(sine(125., 3., 100 * 1024))
+    times, freqs, image = spectrogram.result()
+    assert spectrogram.rowGroup == 8
+    assert image.shape == (1, 13, len(freqs))
+    np.testing.assert_allclose(np.diff(times), 8 * 1024 / SAMPLING_RATE)
+    assert freqs[-1] <= FFt_math.MAX_MODE_FREQ
+    peaks = np.argmax(image[0], axis=1)
+    assert np.all(freqs[peaks] == pytest.approx(125.))
+    np.testing.assert_allclose(image[0, :, peaks[0]], 3., rtol=1e-5)
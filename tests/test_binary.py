@@ -0,0 +1,64 @@
+import shutil
+from os import path
+
+import numpy as np
+
+import FFt_math
+
+
+def textCopy(tmp_path, sampleFile):
+    fileName = path.join(str(tmp_path), 'ACCL_L1B_0210_20210617_122730_microphonics.dat')
+    shutil.copy(sampleFile, fileName)
+    return fileName
+
+
+def testBinaryPath():
+    assert FFt_math.binaryPath('ACCL_L1B_0210_20210617_122730_microphonics.dat') == \
+        'ACCL_L1B_0210_20210617_122730_microphonics.npz'
+    assert FFt_math.binaryPath('res_CM01_cav1234_c1_20220601_120000') == 'res_CM01_cav1234_c1_20220601_120000.npz'
+    assert FFt_math.binaryPath('res_CM01_cav1234_c1_20220601_120000.npz') == 'res_CM01_cav1234_c1_20220601_120000.npz'
+
+
+def testConvertedFileMatchesText(tmp_path, sampleFile):
+    fileName = textCopy(tmp_path, sampleFile)
+    textDat, textHeader = FFt_math.loadCavDat(fileName)
+    outName = FFt_math.convertCavDat(fileName)
+    assert outName == FFt_math.binaryPath(fileName)
+    assert FFt_math.isCavDatBinary(outName) and not FFt_math.isCavDatBinary(fileName)
+
+    # loadCavDat reads either format
+    cavDat, header_Data = FFt_math.loadCavDat(outName)
+    assert header_Data == textHeader
+    assert cavDat.shape == textDat.shape
+    np.testing.assert_allclose(cavDat, textDat, rtol=np.finfo(FFt_math.BINARY_DTYPE).eps)
+    with np.load(outName) as npz:
+        skipped = list(npz['skipped'])
+    with open(fileName) as f:
+        lines = f.readlines()
+    start = lines.index(textHeader[-1]) + 1
+    assert skipped == lines[start:start + 2]
+
+
+def testFloat64RoundTripIsExact(tmp_path, sampleFile):
+    fileName = textCopy(tmp_path, sampleFile)
+    read_data, header_Data = FFt_math.readCavDat(fileName)
+    textDat = FFt_math.parseCavDatArray(read_data)
+    outName = FFt_math.convertCavDat(fileName, compress=True, dtype=np.float64)
+    cavDat, checkHeader = FFt_math.readCavDatBinary(outName)
+    assert checkHeader == header_Data
+    np.testing.assert_array_equal(cavDat, textDat)
+
+
+def testChunksReadBackInBlocks(tmp_path):
+    cavDat = np.arange(3000, dtype=np.float32).reshape(1000, 3)
+    cavDat[990:, 2] = np.nan
+    fileName = FFt_math.writeCavDatBinary(path.join(str(tmp_path), 'chunks.npz'), cavDat, ['# header\n'],
+                                          chunkRows=300)
+    with np.load(fileName) as npz:
+        assert sorted(npz.files) == ['data00000', 'data00001', 'data00002', 'data00003', 'header']
+    blocks = list(FFt_math.iterCavDatBinary(fileName, blockSize=128))
+    assert max(len(block) for block in blocks) == 128
+    np.testing.assert_array_equal(np.concatenate(blocks), cavDat)
+    readDat, header_Data = FFt_math.readCavDatBinary(fileName)
+    assert header_Data == ['# header\n']
+    np.testing.assert_array_equal(readDat, cavDat)
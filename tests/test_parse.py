@@ -0,0 +1,36 @@
+import numpy as np
+
+import FFt_math
+
+
+def testSampleMatchesParseCavDat(sampleFile):
+    read_data, header_Data = FFt_math.readCavDat(sampleFile)
+    cavDat = FFt_math.parseCavDatArray(read_data)
+    assert cavDat.shape == (16843, 1)
+    columns = [column for column in FFt_math.parseCavDat(read_data) if len(column) > 0]
+    assert len(columns) == cavDat.shape[1]
+    for cavData, column in zip(FFt_math.cavDatColumns(cavDat), columns):
+        np.testing.assert_array_equal(cavData, column)
+
+
+def testRaggedLinesAreNaN():
+    read_data = ['  1.5       2.5       3.5\n', '  4.5       5.5\n', '  6.5\n']
+    cavDat = FFt_math.parseCavDatArray(read_data)
+    np.testing.assert_array_equal(cavDat, [[1.5, 2.5, 3.5], [4.5, 5.5, np.nan], [6.5, np.nan, np.nan]])
+    assert [len(cavData) for cavData in FFt_math.cavDatColumns(cavDat)] == [3, 2, 1]
+
+
+def testWideValuesReadTheSameOnBothPaths():
+    # the first two lines alone take the loadtxt path, the short third line
+    #  sends all three down the line by line one
+    read_data = ['  -12.3456789  1.5\n', '  3.25       -4.75\n', '  6.5\n']
+    fast = FFt_math.parseCavDatArray(read_data[:2])
+    slow = FFt_math.parseCavDatArray(read_data)
+    np.testing.assert_array_equal(fast, [[-12.3456789, 1.5], [3.25, -4.75]])
+    np.testing.assert_array_equal(slow[:2], fast)
+
+
+def testUnreadableValueEndsTheLine():
+    read_data = ['  1.5       2.5       3.5\n', '  4.5       x         5.5\n']
+    cavDat = FFt_math.parseCavDatArray(read_data)
+    np.testing.assert_array_equal(cavDat[1], [4.5, np.nan, np.nan])